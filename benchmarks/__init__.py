@@ -0,0 +1 @@
+"""Local benchmarks for the Maya1 handler (see README, "Benchmarks")."""
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Benchmark the compiled (static KV cache + torch.compile) decode engine against eager generation.
+
+Generates a fixed number of tokens with both engines on the model from MODEL_NAME (or the tiny
+offline stand-ins with --tiny) for prompts of several lengths, and reports per-token latency,
+the improvement and how many graphs torch.compile built. Only the decode step is compiled, so
+new prompt lengths within a cache bucket should not add graphs. Runs on CPU when CUDA is not
+available (force it with CUDA_VISIBLE_DEVICES="").
+
+Usage:
+    python benchmarks/compiled_decode.py --tokens 256 --runs 3
+    CUDA_VISIBLE_DEVICES="" python benchmarks/compiled_decode.py --tiny --tokens 64 --prompts 5
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+from torch._dynamo.utils import counters
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import handler  # noqa: E402
+
+
+def time_generation(input_ids: torch.Tensor, num_tokens: int, use_static_cache: bool) -> float:
+    """Generate exactly num_tokens tokens and return wall-clock seconds."""
+    generate_kwargs = handler.build_generate_kwargs(0.6, num_tokens, prompt_len=input_ids.shape[1])
+    generate_kwargs['min_new_tokens'] = num_tokens  # Ignore EOS so every run decodes the same length
+    past_key_values = (
+        handler.get_static_cache(input_ids.shape[0], input_ids.shape[1] + num_tokens) if use_static_cache else None
+    )
+    
+    if input_ids.device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    with torch.no_grad():
+        handler.model.generate(input_ids, past_key_values=past_key_values, **generate_kwargs)
+    if input_ids.device.type == 'cuda':
+        torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def compiled_graphs() -> int:
+    return counters['stats']['unique_graphs']
+
+
+def measure(label: str, input_ids: torch.Tensor, num_tokens: int, runs: int, warmup_runs: int,
+            use_static_cache: bool) -> float:
+    """Warm up, then return the best per-token latency (ms) over `runs` runs."""
+    # The first static-cache run compiles against an uninitialized cache and the second
+    # against an initialized one, so two warmup runs reach the steady state
+    for warmup in range(warmup_runs):
+        seconds = time_generation(input_ids, num_tokens, use_static_cache)
+        print(f"{label}: warmup {warmup + 1}: {seconds:.2f}s (includes compilation for the compiled engine)")
+    
+    per_token_ms = []
+    for run in range(runs):
+        seconds = time_generation(input_ids, num_tokens, use_static_cache)
+        per_token_ms.append(1000 * seconds / num_tokens)
+        print(f"{label}: run {run + 1}: {seconds:.2f}s, {per_token_ms[-1]:.2f} ms/token")
+    return min(per_token_ms)
+
+
+def build_prompts(text: str, count: int, device: torch.device) -> list:
+    """`count` prompts of increasing length: the text repeated 1, 2, ... times."""
+    return [
+        handler.tokenizer(handler.build_prompt('Neutral voice, clear speech', ' '.join([text] * (index + 1))),
+                          return_tensors='pt')['input_ids'].to(device)
+        for index in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=256, help='Tokens generated per run')
+    parser.add_argument('--runs', type=int, default=3, help='Timed runs per engine and prompt')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed warmup runs per engine (first prompt)')
+    parser.add_argument('--prompts', type=int, default=3, help='Prompt lengths (the text repeated 1..N times)')
+    parser.add_argument('--text', default='Hello, this is a benchmark of the compiled decode engine.')
+    parser.add_argument('--tiny', action='store_true', help='Use the offline stand-in models instead of Maya1')
+    args = parser.parse_args()
+    
+    if args.tiny:
+        from benchmarks import tiny_model
+        tiny_model.install(handler)
+    else:
+        handler.load_model()
+    device = next(handler.model.parameters()).device
+    prompts = build_prompts(args.text, max(1, args.prompts), device)
+    print(f"Device: {device}, prompts: {[ids.shape[1] for ids in prompts]} tokens, "
+          f"generating {args.tokens} tokens per run")
+    
+    results = []
+    handler.enable_compiled_engine()  # Eager runs pass no static cache, so their forward calls stay eager
+    for index, input_ids in enumerate(prompts):
+        warmup = args.warmup if index == 0 else 0
+        label = f"{input_ids.shape[1]}-token prompt"
+        eager_ms = measure(f'eager, {label}', input_ids, args.tokens, args.runs, warmup, use_static_cache=False)
+        graphs_before = compiled_graphs()
+        compiled_ms = measure(f'compiled, {label}', input_ids, args.tokens, args.runs, warmup,
+                              use_static_cache=True)
+        results.append((input_ids.shape[1], eager_ms, compiled_ms, compiled_graphs() - graphs_before))
+    handler.save_compile_artifacts()
+    
+    print()
+    print(f"{'prompt':>7} {'eager ms/tok':>13} {'compiled ms/tok':>16} {'improvement':>12} {'new graphs':>11}")
+    for prompt_len, eager_ms, compiled_ms, new_graphs in results:
+        print(f"{prompt_len:>7} {eager_ms:>13.2f} {compiled_ms:>16.2f} "
+              f"{100 * (eager_ms - compiled_ms) / eager_ms:>+11.1f}% {new_graphs:>11}")
+    print(f"Compiled graphs in total: {compiled_graphs()} "
+          f"(new prompt lengths in the same cache bucket should add none)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Replay handler events against a worker and report latency percentiles, TTFA and throughput.
+
+Events come from a JSONL file (one RunPod event per line, {"input": {...}}) or a JSON file
+holding one event or a list of them (e.g. test_request.json); lines without "input" are skipped.
+An event may carry "offset" (seconds since the start of the trace) for --replay-timestamps.
+
+Targets:
+  local                 handler() / stream_handler() in this process (--tiny uses the offline
+                        stand-in models from benchmarks/tiny_model.py instead of loading Maya1;
+                        MAX_CONCURRENCY > 1 starts the batch scheduler like the worker does).
+                        The audio cache and length predictor are off unless set in the
+                        environment or --stateful is given, so repeated events aren't cache hits
+                        and runs don't train each other's token budgets
+  http://host:port      a running worker's local API (python handler.py --rp_serve_api):
+                        POST /runsync, or POST /run + polling GET /stream/{id} with --stream
+
+Load shapes:
+  closed loop (default) --concurrency clients send events back to back
+  --rate R              open loop: R requests/s (Poisson arrivals, or --arrival uniform)
+  --replay-timestamps   open loop: the events' own offsets, multiplied by --time-scale
+In open loop at most --concurrency requests are in flight; latency is measured from each
+request's scheduled arrival, so time spent queued behind a saturated worker counts.
+
+Reported: p50/p95/p99 latency and time-to-first-audio (TTFA: first streamed segment with
+--stream, otherwise the full response), request and audio-seconds throughput and the error
+rate, overall and per text length (short <= 30 words, long > 200 words i.e. chunked, else medium).
+
+Usage:
+    python benchmarks/load_replay.py traffic.jsonl --concurrency 4 --repeat 3
+    python benchmarks/load_replay.py traffic.jsonl --tiny --rate 2 --requests 50 --stream
+    python benchmarks/load_replay.py traffic.jsonl --target http://localhost:8000 --replay-timestamps --time-scale 0.5
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TERMINAL_STATUSES = ('COMPLETED', 'FAILED', 'CANCELLED', 'TIMED_OUT')
+
+
+def load_events(path: str) -> list:
+    """Events (dicts with "input") from a JSONL file, or a JSON file with one event or a list."""
+    with open(path) as f:
+        content = f.read()
+    try:
+        parsed = json.loads(content)
+        records = parsed if isinstance(parsed, list) else [parsed]
+    except ValueError:
+        records = [json.loads(line) for line in content.splitlines() if line.strip()]
+    events = [record for record in records if isinstance(record, dict) and isinstance(record.get("input"), dict)]
+    skipped = len(records) - len(events)
+    if skipped:
+        print(f"Skipped {skipped} record(s) without an \"input\" object")
+    if not events:
+        raise SystemExit(f"No handler events in {path}")
+    return events
+
+
+def length_bucket(event: dict) -> str:
+    words = len(str(event["input"].get("text", "")).split())
+    return 'short' if words <= 30 else 'long' if words > 200 else 'medium'
+
+
+class LocalTarget:
+    """
+    Runs events through this process's handler (non-streaming) or stream_handler.
+    
+    Without the batch scheduler a worker runs one job at a time, so requests are serialized here
+    too: overlapping jobs would share the model and the global seed, and the time a request waits
+    for the one before it belongs in its latency and TTFA.
+    """
+    
+    def __init__(self, stream: bool, tiny: bool, stateful: bool = False):
+        if tiny:
+            os.environ['CUDA_VISIBLE_DEVICES'] = ''  # The stand-ins are CPU models
+        if not stateful:
+            os.environ.setdefault('AUDIO_CACHE_ENABLED', '0')
+            os.environ.setdefault('LENGTH_PREDICTOR_ENABLED', '0')
+        sys.path.insert(0, ROOT)
+        import handler
+        self.handler = handler
+        self.stream = stream
+        if tiny:
+            from benchmarks import tiny_model
+            tiny_model.install(handler)
+        else:
+            handler.load_model()
+        if handler.MAX_CONCURRENCY > 1:
+            handler.start_batch_scheduler()
+        self._one_job_at_a_time = threading.Lock() if handler.batch_scheduler is None else None
+    
+    def send(self, event: dict, started: float) -> dict:
+        if self._one_job_at_a_time is None:
+            return self._send(event, started)
+        with self._one_job_at_a_time:
+            return self._send(event, started)
+    
+    def _send(self, event: dict, started: float) -> dict:
+        if not self.stream:
+            response = self.handler.handler(event)
+            ttfa = time.perf_counter() - started
+            output = response.get("output") or {}
+            return {"ok": response.get("status") == "COMPLETED", "error": response.get("error"),
+                    "ttfa": ttfa, "audio_seconds": output.get("duration", 0.0)}
+        ttfa, final = None, {}
+        for item in self.handler.stream_handler(event):
+            if ttfa is None and "audio_base64" in item:
+                ttfa = time.perf_counter() - started
+            final = item
+        return {"ok": final.get("status") == "COMPLETED", "error": final.get("error"),
+                "ttfa": ttfa, "audio_seconds": final.get("duration", 0.0)}
+
+
+class HttpTarget:
+    """Sends events to a worker's local API (RunPod /runsync, or /run + /stream polling)."""
+    
+    def __init__(self, base_url: str, stream: bool, poll_interval: float, timeout: float):
+        self.base_url = base_url.rstrip('/')
+        self.stream = stream
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+    
+    def _request(self, path: str, payload: dict = None) -> dict:
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+    
+    def send(self, event: dict, started: float) -> dict:
+        if not self.stream:
+            response = self._request('/runsync', event)
+            ttfa = time.perf_counter() - started
+            output = response.get("output") or {}
+            return {"ok": response.get("status") == "COMPLETED", "error": response.get("error"),
+                    "ttfa": ttfa, "audio_seconds": output.get("duration", 0.0) if isinstance(output, dict) else 0.0}
+        
+        job_id = self._request('/run', event)["id"]
+        ttfa, audio_seconds, status, error = None, 0.0, None, None
+        deadline = time.perf_counter() + self.timeout
+        while status not in TERMINAL_STATUSES:
+            if time.perf_counter() > deadline:
+                return {"ok": False, "error": f"timed out after {self.timeout:.0f}s", "ttfa": ttfa, "audio_seconds": 0.0}
+            response = self._request(f'/stream/{job_id}')
+            status, error = response.get("status"), response.get("error") or error
+            for item in response.get("stream") or []:
+                output = item.get("output", item)
+                if ttfa is None and "audio_base64" in output:
+                    ttfa = time.perf_counter() - started
+                audio_seconds = output.get("duration", audio_seconds)
+            if status not in TERMINAL_STATUSES:
+                time.sleep(self.poll_interval)
+        return {"ok": status == 'COMPLETED', "error": error, "ttfa": ttfa, "audio_seconds": audio_seconds}
+
+
+def execute(target, event: dict, index: int, scheduled: float) -> dict:
+    """Send one event; latency and TTFA are measured from `scheduled` (perf_counter time)."""
+    started = time.perf_counter()
+    try:
+        result = target.send(event, scheduled)
+    except Exception as e:  # Network errors, handler exceptions: counted, not fatal
+        result = {"ok": False, "error": f"{type(e).__name__}: {e}", "ttfa": None, "audio_seconds": 0.0}
+    result.update(index=index, bucket=length_bucket(event), latency=time.perf_counter() - scheduled,
+                  queued=started - scheduled)
+    return result
+
+
+def run_closed_loop(target, events: list, total: int, concurrency: int) -> list:
+    """`concurrency` clients sending the next event as soon as their previous one finishes."""
+    results, lock = [], threading.Lock()
+    next_index = iter(range(total))
+    
+    def client():
+        while True:
+            with lock:
+                index = next(next_index, None)
+            if index is None:
+                return
+            result = execute(target, events[index % len(events)], index, time.perf_counter())
+            with lock:
+                results.append(result)
+    
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def arrival_offsets(events: list, total: int, args) -> list:
+    """Seconds after start at which each of the `total` requests arrives (open loop)."""
+    if args.replay_timestamps:
+        offsets = [float(event.get("offset", 0.0)) for event in events]
+        # Repeated passes follow each other with the trace's mean inter-arrival gap in between
+        period = max(offsets) * len(events) / (len(events) - 1) if len(events) > 1 else 0.0
+        return [args.time_scale * (offsets[i % len(events)] + period * (i // len(events))) for i in range(total)]
+    rng = random.Random(args.seed)
+    offsets, now = [], 0.0
+    for _ in range(total):
+        offsets.append(now)
+        now += rng.expovariate(args.rate) if args.arrival == 'poisson' else 1.0 / args.rate
+    return offsets
+
+
+def run_open_loop(target, events: list, offsets: list, concurrency: int) -> list:
+    """Dispatch requests at their arrival offsets, with at most `concurrency` in flight."""
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        for index, offset in enumerate(offsets):
+            scheduled = start + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(execute, target, events[index % len(events)], index, scheduled))
+    return [future.result() for future in futures]
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3)}
+
+
+def summarize(results: list, wall_seconds: float) -> dict:
+    ok = [r for r in results if r["ok"]]
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else 0.0,
+        "throughput_rps": round(len(ok) / wall_seconds, 3) if wall_seconds > 0 else 0.0,
+        "audio_seconds_per_second": round(sum(r["audio_seconds"] or 0.0 for r in ok) / wall_seconds, 3)
+        if wall_seconds > 0 else 0.0,
+        "latency_s": percentiles([r["latency"] for r in ok]),
+        "ttfa_s": percentiles([r["ttfa"] for r in ok if r["ttfa"] is not None]),
+        "queued_s": percentiles([r["queued"] for r in results]),
+    }
+
+
+def print_report(report: dict) -> None:
+    def fmt(value):
+        return '-' if value is None else f"{value:.3f}"
+    
+    print()
+    print(f"{'group':<8} {'reqs':>5} {'err%':>6} {'req/s':>7} "
+          f"{'lat p50':>8} {'p95':>8} {'p99':>8} {'ttfa p50':>9} {'p95':>8} {'p99':>8}")
+    for group, stats in [('all', report["overall"])] + sorted(report["by_length"].items()):
+        latency, ttfa = stats["latency_s"], stats["ttfa_s"]
+        print(f"{group:<8} {stats['requests']:>5} {100 * stats['error_rate']:>5.1f}% {stats['throughput_rps']:>7.3f} "
+              f"{fmt(latency['p50']):>8} {fmt(latency['p95']):>8} {fmt(latency['p99']):>8} "
+              f"{fmt(ttfa['p50']):>9} {fmt(ttfa['p95']):>8} {fmt(ttfa['p99']):>8}")
+    overall = report["overall"]
+    print(f"\nWall time {report['wall_seconds']:.1f}s, {overall['audio_seconds_per_second']:.2f} audio s/s, "
+          f"queueing p95 {fmt(overall['queued_s']['p95'])}s")
+    for error, count in report["error_samples"].items():
+        print(f"  {count}x {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('events', help='JSONL (or JSON) file of handler events')
+    parser.add_argument('--target', default='local', help="'local' or the worker's base URL")
+    parser.add_argument('--tiny', action='store_true', help='Local target: use the offline stand-in models')
+    parser.add_argument('--stream', action='store_true', help='Use the streaming handler / endpoint (real TTFA)')
+    parser.add_argument('--stateful', action='store_true',
+                        help='Local target: keep the audio cache and length predictor on (state persists under /tmp)')
+    parser.add_argument('--concurrency', type=int, default=1, help='Clients (closed loop) or max in flight (open loop)')
+    parser.add_argument('--requests', type=int, help='Requests to send (default: events x --repeat)')
+    parser.add_argument('--repeat', type=int, default=1, help='Passes over the event file')
+    parser.add_argument('--rate', type=float, help='Open loop: arrivals per second')
+    parser.add_argument('--arrival', choices=['poisson', 'uniform'], default='poisson')
+    parser.add_argument('--replay-timestamps', action='store_true', help="Open loop at the events' \"offset\" times")
+    parser.add_argument('--time-scale', type=float, default=1.0, help='Multiplier for replayed offsets (0.5 = 2x faster)')
+    parser.add_argument('--poll-interval', type=float, default=0.05, help='HTTP streaming: /stream poll interval (s)')
+    parser.add_argument('--timeout', type=float, default=600.0, help='HTTP: per-request timeout (s)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for Poisson arrivals')
+    parser.add_argument('--json', help='Write the report (and per-request results) to this file')
+    args = parser.parse_args()
+    
+    events = load_events(args.events)
+    total = args.requests or len(events) * max(1, args.repeat)
+    concurrency = max(1, args.concurrency)
+    if args.target == 'local':
+        target = LocalTarget(args.stream, args.tiny, args.stateful)
+    else:
+        target = HttpTarget(args.target, args.stream, args.poll_interval, args.timeout)
+    
+    open_loop = args.rate is not None or args.replay_timestamps
+    print(f"Replaying {total} request(s) from {len(events)} event(s) against {args.target}: "
+          + (f"open loop, up to {concurrency} in flight" if open_loop else f"closed loop, {concurrency} client(s)"))
+    start = time.perf_counter()
+    if open_loop:
+        if args.rate is not None and args.rate <= 0:
+            raise SystemExit("--rate must be positive")
+        results = run_open_loop(target, events, arrival_offsets(events, total, args), concurrency)
+    else:
+        results = run_closed_loop(target, events, total, concurrency)
+    wall_seconds = time.perf_counter() - start
+    
+    errors = {}
+    for result in results:
+        if not result["ok"]:
+            errors[str(result["error"])[:200]] = errors.get(str(result["error"])[:200], 0) + 1
+    report = {
+        "target": args.target,
+        "wall_seconds": round(wall_seconds, 3),
+        "overall": summarize(results, wall_seconds),
+        "by_length": {
+            bucket: summarize([r for r in results if r["bucket"] == bucket], wall_seconds)
+            for bucket in sorted({r["bucket"] for r in results})
+        },
+        "error_samples": errors,
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(report, results=sorted(results, key=lambda r: r["index"])), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
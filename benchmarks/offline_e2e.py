@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Offline end-to-end benchmark on CPU with tiny random stand-ins for Maya1 and SNAC.
+
+Runs each scenario through the generation stages the way generate_audio does (prompt,
+generate, extract, unpack, decode, encode) and once through handler() end to end, then
+reports tokens/s, real-time factor (handler latency / audio seconds), per-stage latency
+(median over runs, ms) and peak RSS. Results are compared with a baseline JSON
+(benchmarks/offline_baseline.json by default); the exit status is 1 when any metric is worse
+than the baseline by more than --tolerance (relative). No network, GPU or model download.
+
+Baselines are machine-specific: record one on the machine you compare on before making a
+change (--update-baseline), then rerun after it.
+
+Usage:
+    python benchmarks/offline_e2e.py
+    python benchmarks/offline_e2e.py --update-baseline
+    python benchmarks/offline_e2e.py --runs 5 --tolerance 0.2 --json results.json
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+
+# CPU only, and nothing persisted between runs
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+os.environ.setdefault('AUDIO_CACHE_ENABLED', '0')
+os.environ.setdefault('LENGTH_PREDICTOR_ENABLED', '0')
+
+import torch  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import handler  # noqa: E402
+from benchmarks import tiny_model  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'offline_baseline.json')
+VOICE = 'Female, 30s, American accent, warm and clear'
+SCENARIOS = {
+    # name: (text, max_new_tokens)
+    'short': ('Hello there, this is a short benchmark sentence.', 210),
+    'long': ('The quick brown fox jumps over the lazy dog <laugh> and then it keeps on running through '
+             'the field, past the river and into the woods, until the sun goes down.', 700),
+}
+STAGES = ['prompt', 'generate', 'extract', 'unpack', 'decode', 'encode']
+# Metric name suffix -> whether larger values are better
+HIGHER_IS_BETTER = {'tokens_per_second': True}
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, 1000 * (time.perf_counter() - start)
+
+
+def run_stages(text: str, max_new_tokens: int, seed: int) -> dict:
+    """One pass through the generate_audio stages; returns per-stage ms plus token and audio counts."""
+    device = next(handler.model.parameters()).device
+    timings = {}
+    input_ids, timings['prompt'] = timed(
+        lambda: handler.tokenizer(handler.build_prompt(VOICE, text), return_tensors='pt')['input_ids'].to(device)
+    )
+    generate_kwargs = handler.build_generate_kwargs(0.6, max_new_tokens, prompt_len=input_ids.shape[1])
+    generate_kwargs['min_new_tokens'] = max_new_tokens  # Fixed length, so runs are comparable
+    handler.set_generation_seed(seed)
+    with torch.no_grad():
+        outputs, timings['generate'] = timed(handler.model.generate, input_ids, **generate_kwargs)
+    generated = outputs[0, input_ids.shape[1]:]
+    codes, timings['extract'] = timed(handler.extract_snac_codes, generated)
+    _, timings['unpack'] = timed(handler.unpack_snac_from_7, codes, device=device)
+    audio, timings['decode'] = timed(handler.decode_snac_codes, codes, device)  # Includes its own unpack
+    _, timings['encode'] = timed(handler.encode_audio, audio, handler.SAMPLING_RATE, handler.parse_output_options({}))
+    return {"timings": timings, "tokens": int(generated.shape[0]), "samples": int(audio.shape[0])}
+
+
+def run_handler(text: str, max_new_tokens: int, seed: int) -> tuple:
+    """One handler() call; returns (ms, audio seconds)."""
+    event = {"id": "offline-benchmark", "input": {
+        "text": text, "voice_description": VOICE, "max_new_tokens": max_new_tokens, "seed": seed, "use_cache": False,
+    }}
+    response, elapsed_ms = timed(handler.handler, event)
+    if response.get("status") != "COMPLETED":
+        raise RuntimeError(f"handler failed: {response.get('error')}")
+    return elapsed_ms, response["output"]["duration"]
+
+
+def benchmark(runs: int, seed: int) -> dict:
+    """Median metrics per scenario, keyed '<scenario>.<metric>', plus peak RSS."""
+    metrics = {}
+    for name, (text, max_new_tokens) in SCENARIOS.items():
+        run_stages(text, max_new_tokens, seed)  # Warmup (allocator, prefix cache, lazy inits)
+        stage_runs, handler_runs = [], []
+        for run in range(runs):
+            stage_runs.append(run_stages(text, max_new_tokens, seed + run))
+            handler_runs.append(run_handler(text, max_new_tokens, seed + run))
+        
+        for stage in STAGES:
+            metrics[f'{name}.{stage}_ms'] = statistics.median(r["timings"][stage] for r in stage_runs)
+        metrics[f'{name}.tokens_per_second'] = statistics.median(
+            1000 * r["tokens"] / r["timings"]["generate"] for r in stage_runs
+        )
+        metrics[f'{name}.handler_ms'] = statistics.median(ms for ms, _ in handler_runs)
+        metrics[f'{name}.real_time_factor'] = statistics.median(
+            ms / 1000 / duration for ms, duration in handler_runs if duration > 0
+        )
+    metrics['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return metrics
+
+
+def compare(metrics: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list:
+    """
+    Print current vs. baseline; return the metrics that regressed beyond tolerance.
+    
+    Latencies must also be worse by at least min_delta_ms, so sub-millisecond stages don't flap.
+    """
+    regressions = []
+    print(f"{'metric':<32} {'baseline':>12} {'current':>12} {'change':>9}")
+    for key, value in metrics.items():
+        reference = baseline.get(key)
+        if not reference:
+            print(f"{key:<32} {'-':>12} {value:>12.2f}")
+            continue
+        change = (value - reference) / reference
+        worse = -change if HIGHER_IS_BETTER.get(key.split('.')[-1], False) else change
+        regressed = worse > tolerance and not (key.endswith('_ms') and abs(value - reference) < min_delta_ms)
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{key:<32} {reference:>12.2f} {value:>12.2f} {100 * change:>+8.1f}%{flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='Measured runs per scenario (median is reported)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative slowdown per metric')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0, help='Ignore latency changes smaller than this')
+    parser.add_argument('--update-baseline', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+    
+    tiny_model.install(handler)
+    metrics = {key: round(value, 3) for key, value in benchmark(args.runs, args.seed).items()}
+    
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(metrics, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(metrics, f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+        return
+    
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one")
+    regressions = compare(metrics, baseline, args.tolerance, args.min_delta_ms)
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {100 * args.tolerance:.0f}%: "
+              f"{', '.join(regressions)}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+if __name__ == '__main__':
+    main()
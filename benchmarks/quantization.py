@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Compare the CPU QUANTIZATION modes (int8, bf16) against the fp32 baseline.
+
+Each mode runs in its own subprocess (so RSS is not polluted by the other modes) on the model
+from MODEL_NAME (or the tiny offline stand-ins with --tiny): it generates a fixed number of tokens per prompt with the same seed, decodes
+them to audio, and scores the fp32 token sequences teacher-forced. Reported per mode:
+  - tokens/s          generated tokens per second of decode (best run)
+  - RSS               resident memory after loading, and peak
+  - token agreement   share of positions where the mode's greedy next token on the fp32
+                      sequence matches fp32's own (teacher-forced, so sampling noise cancels out)
+  - spectral sim.     cosine similarity of the mean log-mel spectrum against the fp32 audio
+                      (sampled sequences diverge, so this compares timbre rather than waveforms)
+bf16 is skipped on CPUs without native bf16 support.
+
+Usage:
+    CUDA_VISIBLE_DEVICES="" python benchmarks/quantization.py --tokens 256 --runs 2
+    python benchmarks/quantization.py --tiny --tokens 70 --runs 1
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPTS = [
+    ('Neutral voice, clear speech', 'Hello, this is a benchmark of quantized CPU inference.'),
+    ('Female, 30s, warm and friendly', 'The quick brown fox jumps over the lazy dog <laugh> again.'),
+]
+
+
+def current_rss_mb() -> float:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_worker(mode: str, args) -> None:
+    """Load the model with QUANTIZATION=mode, generate, score the baseline sequences, dump results."""
+    os.environ['QUANTIZATION'] = mode
+    sys.path.insert(0, ROOT)
+    import torch
+    import handler
+    
+    if mode != 'none' and handler.resolve_cpu_quantization('cpu') == 'none':
+        with open(os.path.join(args.out_dir, f'{mode}.json'), 'w') as f:
+            json.dump({"mode": mode, "skipped": True}, f)
+        return
+    
+    if args.tiny:
+        # load_model is skipped with the stand-ins installed, so apply the mode the way it would
+        from benchmarks import tiny_model
+        tiny_model.install(handler)
+        if mode == 'bf16':
+            handler.model = handler.model.to(torch.bfloat16)
+        elif mode == 'int8':
+            handler.model = handler.quantize_model_int8(handler.model)
+    else:
+        handler.load_model('cpu')
+    load_rss_mb = current_rss_mb()
+    device = torch.device('cpu')
+    
+    tokens_per_second = 0.0
+    sequences, audio = [], []
+    for run in range(args.runs):
+        sequences, audio = [], []
+        elapsed = 0.0
+        for index, (description, text) in enumerate(PROMPTS):
+            input_ids = handler.tokenizer(handler.build_prompt(description, text), return_tensors='pt')['input_ids']
+            generate_kwargs = handler.build_generate_kwargs(0.6, args.tokens, prompt_len=input_ids.shape[1])
+            generate_kwargs['min_new_tokens'] = args.tokens  # Ignore EOS so every mode decodes the same length
+            handler.set_generation_seed(args.seed + index)
+            start = time.perf_counter()
+            with torch.no_grad():
+                output = handler.model.generate(input_ids, **generate_kwargs)
+            elapsed += time.perf_counter() - start
+            generated = output[0, input_ids.shape[1]:]
+            sequences.append(output[0].tolist())
+            audio.append(handler.decode_snac_codes(handler.extract_snac_codes(generated), device))
+        tokens_per_second = max(tokens_per_second, args.tokens * len(PROMPTS) / elapsed)
+        print(f"{mode}: run {run + 1}: {args.tokens * len(PROMPTS) / elapsed:.1f} tokens/s", flush=True)
+    
+    # Teacher-forced greedy predictions on the fp32 sequences (the baseline scores its own)
+    baseline_path = os.path.join(args.out_dir, 'none.json')
+    reference = sequences if mode == 'none' else json.load(open(baseline_path))["sequences"]
+    predictions = []
+    with torch.no_grad():
+        for sequence in reference:
+            logits = handler.model(torch.tensor([sequence])).logits[0, -args.tokens - 1:-1]
+            predictions.append(logits.float().argmax(dim=-1).tolist())
+    
+    np.savez(os.path.join(args.out_dir, f'{mode}.npz'), *audio)
+    with open(os.path.join(args.out_dir, f'{mode}.json'), 'w') as f:
+        json.dump({
+            "mode": mode,
+            "tokens_per_second": tokens_per_second,
+            "load_rss_mb": load_rss_mb,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "sequences": sequences,
+            "predictions": predictions,
+        }, f)
+
+
+def mean_log_mel(audio: np.ndarray, sampling_rate: int = 24000) -> np.ndarray:
+    import librosa
+    mel = librosa.feature.melspectrogram(y=audio.astype(np.float32), sr=sampling_rate, n_fft=1024,
+                                         hop_length=256, n_mels=80)
+    return np.log(mel + 1e-6).mean(axis=1)
+
+
+def spectral_similarity(audio: list, reference: list) -> float:
+    """Mean cosine similarity of the mean log-mel spectra, prompt by prompt."""
+    scores = []
+    for candidate, baseline in zip(audio, reference):
+        a, b = mean_log_mel(candidate), mean_log_mel(baseline)
+        a, b = a - a.mean(), b - b.mean()
+        scores.append(float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-12)))
+    return float(np.mean(scores))
+
+
+def load_audio(path: str) -> list:
+    with np.load(path) as data:
+        return [data[f'arr_{i}'] for i in range(len(data.files))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=256, help='Tokens generated per prompt (multiple of 7)')
+    parser.add_argument('--runs', type=int, default=2, help='Timed runs per mode (best is reported)')
+    parser.add_argument('--modes', default='int8,bf16', help='Modes compared against fp32')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tiny', action='store_true', help='Use the offline stand-in models instead of Maya1')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--out-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.worker:
+        run_worker(args.worker, args)
+        return
+    
+    modes = ['none'] + [mode for mode in args.modes.split(',') if mode and mode != 'none']
+    env = dict(os.environ, CUDA_VISIBLE_DEVICES='')
+    with tempfile.TemporaryDirectory() as out_dir:
+        for mode in modes:
+            command = [sys.executable, os.path.abspath(__file__), '--worker', mode, '--out-dir', out_dir,
+                       '--tokens', str(args.tokens), '--runs', str(args.runs), '--seed', str(args.seed)]
+            subprocess.run(command + (['--tiny'] if args.tiny else []), env=env, check=True)
+        
+        results = {mode: json.load(open(os.path.join(out_dir, f'{mode}.json'))) for mode in modes}
+        baseline = results['none']
+        baseline_audio = load_audio(os.path.join(out_dir, 'none.npz'))
+        
+        print()
+        print(f"{'mode':<6} {'tokens/s':>9} {'speedup':>8} {'RSS MB':>8} {'peak MB':>8} {'tok agree':>10} {'spec sim':>9}")
+        for mode in modes:
+            result = results[mode]
+            label = 'fp32' if mode == 'none' else mode
+            if result.get("skipped"):
+                print(f"{label:<6} skipped (not supported on this CPU)")
+                continue
+            agreement = np.mean([
+                np.mean(np.array(predicted) == np.array(expected))
+                for predicted, expected in zip(result["predictions"], baseline["predictions"])
+            ])
+            similarity = spectral_similarity(load_audio(os.path.join(out_dir, f'{mode}.npz')), baseline_audio)
+            print(f"{label:<6} {result['tokens_per_second']:>9.1f} "
+                  f"{result['tokens_per_second'] / baseline['tokens_per_second']:>7.2f}x "
+                  f"{result['load_rss_mb']:>8.0f} {result['peak_rss_mb']:>8.0f} "
+                  f"{100 * agreement:>9.1f}% {similarity:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
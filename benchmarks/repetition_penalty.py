@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark the windowed, incremental repetition penalty against HF's stock processor.
+
+Replays a long synthetic SNAC generation (random valid codes, one token per step) through both
+processors and reports the per-step cost at the start and end of the sequence. The stock
+processor gathers over the whole sequence every step; the windowed one only updates counts
+for the newest token. No model is loaded.
+
+Usage:
+    python benchmarks/repetition_penalty.py --tokens 6000 --batch 4 --window 64
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+from transformers.generation.logits_process import RepetitionPenaltyLogitsProcessor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import handler  # noqa: E402
+
+VOCAB_SIZE = handler.SNAC_MAX_ID + 10
+PROMPT_LEN = 64
+
+
+def synthetic_sequence(batch_size: int, num_tokens: int, device: torch.device) -> torch.Tensor:
+    """Prompt tokens followed by num_tokens SNAC codes in the 7-slot frame layout."""
+    prompt = torch.randint(0, 128000, (batch_size, PROMPT_LEN), device=device)
+    slots = torch.arange(num_tokens, device=device) % handler.SNAC_TOKENS_PER_FRAME
+    codes = torch.randint(0, handler.SNAC_CODEBOOK_SIZE, (batch_size, num_tokens), device=device)
+    return torch.cat([prompt, handler.CODE_TOKEN_OFFSET + slots * handler.SNAC_CODEBOOK_SIZE + codes], dim=1)
+
+
+def replay(processor, sequence: torch.Tensor, scores: torch.Tensor, sample_every: int) -> list:
+    """Feed the growing sequence to the processor step by step; return (step, ms) samples."""
+    samples = []
+    for step in range(sequence.shape[1] - PROMPT_LEN):
+        input_ids = sequence[:, :PROMPT_LEN + step + 1]
+        if sequence.device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        processor(input_ids, scores.clone())
+        if sequence.device.type == 'cuda':
+            torch.cuda.synchronize()
+        elapsed_ms = 1000 * (time.perf_counter() - start)
+        if step % sample_every == 0 or step == sequence.shape[1] - PROMPT_LEN - 1:
+            samples.append((step, elapsed_ms))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=6000, help='Generated tokens per sequence')
+    parser.add_argument('--batch', type=int, default=4, help='Sequences per batch')
+    parser.add_argument('--window', type=int, default=64, help='Penalty window in SNAC frames (0 = whole output)')
+    parser.add_argument('--samples', type=int, default=6, help='Per-step timings printed per processor')
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    torch.manual_seed(0)
+    sequence = synthetic_sequence(args.batch, args.tokens, device)
+    scores = torch.randn(args.batch, VOCAB_SIZE, device=device)
+    sample_every = max(1, args.tokens // args.samples)
+
+    print(f"Device: {device}, batch {args.batch}, {args.tokens} tokens, window {args.window} frames")
+    totals = {}
+    for label, processor in (
+        ("stock", RepetitionPenaltyLogitsProcessor(1.1)),
+        ("windowed", handler.WindowedRepetitionPenaltyLogitsProcessor(PROMPT_LEN, 1.1, args.window)),
+    ):
+        start = time.perf_counter()
+        samples = replay(processor, sequence, scores, sample_every)
+        totals[label] = time.perf_counter() - start
+        timings = ", ".join(f"step {step}: {ms:.3f} ms" for step, ms in samples)
+        print(f"{label}: total {totals[label]:.2f}s ({1000 * totals[label] / args.tokens:.3f} ms/step) | {timings}")
+
+    print(f"Speedup: {totals['stock'] / totals['windowed']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
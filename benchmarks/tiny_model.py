@@ -0,0 +1,93 @@
+"""
+Tiny random-weight stand-ins for Maya1 and SNAC, for running the handler offline on CPU.
+
+The tokenizer is character-level but keeps Maya1's vocabulary size and special-token ids
+(Llama 3 specials at 128000+, <custom_token_N> from 128256, SNAC codes from 128266), so
+build_prompt, the logits processors and SNAC unpacking behave exactly as with the real model.
+The SNAC stand-in has the 24 kHz model's hop length, codebook size and VQ strides (2048 samples
+per 7-token frame) with much narrower layers. Nothing is downloaded.
+
+    import handler
+    from benchmarks.tiny_model import install
+    install(handler)
+"""
+
+import torch
+from snac import SNAC
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+VOCAB_SIZE = 156940  # Maya1's embedding size
+LLAMA_SPECIAL_TOKENS = {
+    128000: '<|begin_of_text|>',
+    128001: '<|end_of_text|>',
+    128009: '<|eot_id|>',
+}
+CUSTOM_TOKEN_START = 128256
+
+
+def build_tokenizer() -> PreTrainedTokenizerFast:
+    """Character-level tokenizer over printable ASCII with Maya1's special-token layout."""
+    chars = [chr(i) for i in range(32, 127)]
+    vocab = {c: i for i, c in enumerate(chars)}
+    special = dict(LLAMA_SPECIAL_TOKENS)
+    special.update({
+        i: f'<custom_token_{i - CUSTOM_TOKEN_START}>' for i in range(CUSTOM_TOKEN_START, CUSTOM_TOKEN_START + 10)
+    })
+    for i in range(len(chars), VOCAB_SIZE):
+        vocab[special.get(i, f'<reserved_{i}>')] = i
+    
+    backend = Tokenizer(models.WordLevel(vocab=vocab, unk_token='?'))
+    backend.pre_tokenizer = pre_tokenizers.Split('', 'isolated')
+    backend.decoder = decoders.Fuse()
+    backend.add_special_tokens(list(special.values()))
+    return PreTrainedTokenizerFast(
+        tokenizer_object=backend,
+        bos_token=LLAMA_SPECIAL_TOKENS[128000],
+        eos_token=LLAMA_SPECIAL_TOKENS[128001],
+    )
+
+
+def build_model(hidden_size: int = 64, num_layers: int = 2, seed: int = 0) -> LlamaForCausalLM:
+    """Random Llama with Maya1's vocabulary and a few narrow layers."""
+    config = LlamaConfig(
+        vocab_size=VOCAB_SIZE,
+        hidden_size=hidden_size,
+        intermediate_size=2 * hidden_size,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=8192,
+        bos_token_id=128000,
+        eos_token_id=128001,
+    )
+    torch.manual_seed(seed)
+    return LlamaForCausalLM(config).eval()
+
+
+# SNAC with the 24 kHz model's rates and codebooks but narrow layers (also its config.json contents)
+SNAC_CONFIG = {
+    'sampling_rate': 24000,
+    'encoder_dim': 8,
+    'encoder_rates': [2, 4, 8, 8],
+    'decoder_dim': 32,
+    'decoder_rates': [8, 8, 4, 2],
+    'attn_window_size': None,
+    'codebook_size': 4096,
+    'codebook_dim': 8,
+    'vq_strides': [4, 2, 1],
+}
+
+
+def build_snac(seed: int = 0) -> SNAC:
+    """SNAC built from SNAC_CONFIG with random weights."""
+    torch.manual_seed(seed)
+    return SNAC(**SNAC_CONFIG).eval()
+
+
+def install(handler_module, hidden_size: int = 64, num_layers: int = 2, seed: int = 0):
+    """Put the stand-ins into handler's globals so load_model() is skipped; returns the module."""
+    handler_module.tokenizer = build_tokenizer()
+    handler_module.model = build_model(hidden_size, num_layers, seed)
+    handler_module.snac_decoder = build_snac(seed)
+    return handler_module
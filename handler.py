@@ -5,18 +5,48 @@ Generates expressive voice audio from text and voice descriptions
 """
 
 import os
+import sys
 import json
+import logging
+import time
+import inspect
+import functools
+import contextvars
+from contextlib import contextmanager
 import base64
 import io
 import re
+import copy
+import hashlib
+import queue
+import tempfile
+import shutil
+import asyncio
+import threading
+import warnings
+import gc
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterator
 
 import torch
 import numpy as np
 import soundfile as sf
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache, StaticCache
+from transformers.generation.streamers import BaseStreamer
+from transformers.generation.logits_process import (
+    LogitsProcessor,
+    LogitsProcessorList,
+    MinNewTokensLengthLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
 from snac import SNAC
+from safetensors import safe_open
+from safetensors.torch import save_file as save_safetensors
 
 # Firebase Admin SDK
 try:
@@ -26,6 +56,20 @@ try:
 except ImportError:
     FIREBASE_AVAILABLE = False
 
+# Logging: LOG_LEVEL sets the worker-wide level; a request's "debug": true enables DEBUG diagnostics for it alone
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+logger = logging.getLogger('maya1')
+if not logger.handlers:
+    _log_handler = logging.StreamHandler(sys.stdout)
+    _log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logger.addHandler(_log_handler)
+    logger.propagate = False
+logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+
+_request_debug = contextvars.ContextVar('maya1_request_debug', default=False)
+_request_speculation = contextvars.ContextVar('maya1_request_speculation', default=None)
+
 # Maya1 Special Tokens
 CODE_START_TOKEN_ID = 128257
 CODE_END_TOKEN_ID = 128258
@@ -33,6 +77,11 @@ CODE_TOKEN_OFFSET = 128266
 SNAC_MIN_ID = 128266
 SNAC_MAX_ID = 156937
 SNAC_TOKENS_PER_FRAME = 7
+SNAC_CODEBOOK_SIZE = 4096  # Codes per frame slot: slot k uses CODE_TOKEN_OFFSET + k*4096 ... +4095
+SNAC_SAMPLES_PER_FRAME = 2048  # 24 kHz samples decoded per 7-token frame
+SAMPLING_RATE = 24000
+# Frame slot → level layout: slot 0 is level 1, slots 1/4 level 2, slots 2/3/5/6 level 3
+SNAC_SLOT_ORDER = [0, 1, 4, 2, 3, 5, 6]
 
 SOH_ID = 128259  # Start of Header
 EOH_ID = 128260  # End of Header
@@ -40,11 +89,140 @@ SOA_ID = 128261  # Start of Audio
 BOS_ID = 128000  # Beginning of Sequence
 TEXT_EOT_ID = 128009  # End of Text
 
+# Streaming: frames per emitted segment, left-context overlap and held-back lookahead
+STREAM_FIRST_CHUNK_FRAMES = int(os.getenv('STREAM_FIRST_CHUNK_FRAMES', '3'))
+STREAM_CHUNK_FRAMES = int(os.getenv('STREAM_CHUNK_FRAMES', '12'))
+STREAM_OVERLAP_FRAMES = int(os.getenv('STREAM_OVERLAP_FRAMES', '4'))
+STREAM_LOOKAHEAD_FRAMES = int(os.getenv('STREAM_LOOKAHEAD_FRAMES', '1'))
+
+# Voice-description prefix KV cache (prefilled header reused across requests)
+PREFIX_CACHE_ENABLED = os.getenv('PREFIX_CACHE_ENABLED', '1').lower() in ('1', 'true', 'yes')
+PREFIX_CACHE_MAX_MB = float(os.getenv('PREFIX_CACHE_MAX_MB', '256'))
+
+# Content-addressed result cache (in-memory LRU tier + on-disk LRU tier)
+AUDIO_CACHE_ENABLED = os.getenv('AUDIO_CACHE_ENABLED', '1').lower() in ('1', 'true', 'yes')
+AUDIO_CACHE_MEMORY_MB = float(os.getenv('AUDIO_CACHE_MEMORY_MB', '64'))
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', '/tmp/maya1-audio-cache')
+AUDIO_CACHE_DISK_MB = float(os.getenv('AUDIO_CACHE_DISK_MB', '1024'))
+
+# Sampling: restrict each step to the SNAC codes valid for its frame slot (per-request "constrained_sampling")
+SNAC_CONSTRAINED_SAMPLING = os.getenv('SNAC_CONSTRAINED_SAMPLING', '1').lower() in ('1', 'true', 'yes')
+# Repetition penalty only looks at codes from the last N frames (per-request "repetition_penalty_window"; 0 = whole output)
+REPETITION_PENALTY_WINDOW_FRAMES = int(os.getenv('REPETITION_PENALTY_WINDOW_FRAMES', '0'))
+
+# Length predictor: learns SNAC token counts from finished generations (persisted to LENGTH_PREDICTOR_PATH)
+# and sizes default token budgets from them instead of the fixed 4000/6000 caps
+LENGTH_PREDICTOR_ENABLED = os.getenv('LENGTH_PREDICTOR_ENABLED', '1').lower() in ('1', 'true', 'yes')
+LENGTH_PREDICTOR_PATH = os.getenv('LENGTH_PREDICTOR_PATH', '/tmp/maya1-length-observations.json')
+LENGTH_PREDICTOR_MARGIN = float(os.getenv('LENGTH_PREDICTOR_MARGIN', '1.3'))
+LENGTH_PREDICTOR_MIN_OBSERVATIONS = int(os.getenv('LENGTH_PREDICTOR_MIN_OBSERVATIONS', '50'))
+
+# Snapshot mode: MODEL_SNAPSHOT_DIR holds both models as safetensors in the target dtype (written on
+# the first load if missing), so cold starts memory-map local files instead of resolving/downloading
+MODEL_SNAPSHOT_DIR = os.getenv('MODEL_SNAPSHOT_DIR', '')
+SNAC_MODEL_NAME = 'hubertsiuzdak/snac_24khz'
+
+# CPU inference precision: QUANTIZATION=int8 dynamically quantizes the transformer's linear layers,
+# bf16 loads it in bfloat16 (only where the CPU has native bf16 support); SNAC always stays fp32
+QUANTIZATION = os.getenv('QUANTIZATION', 'none').lower()
+
+# Compiled decode engine: ENGINE_MODE=compiled preallocates static KV caches (bucketed lengths) and
+# torch.compiles the decode step; inductor/compile artifacts persist in COMPILE_CACHE_DIR
+ENGINE_MODE = os.getenv('ENGINE_MODE', 'eager').lower()
+COMPILE_MODE = os.getenv('COMPILE_MODE', '')  # Default: reduce-overhead on CUDA, default on CPU
+COMPILE_CACHE_DIR = os.getenv('COMPILE_CACHE_DIR', '/tmp/maya1-compile-cache')
+STATIC_CACHE_BUCKETS = sorted(int(b) for b in os.getenv('STATIC_CACHE_BUCKETS', '1024,2048,4096,8192').split(','))
+
+# Speculative decoding (per-request "speculative_decoding"): off, ngram (draft-free lookup of the last
+# SPECULATIVE_NGRAM tokens earlier in the output) or draft (small SNAC draft model from DRAFT_MODEL_NAME);
+# up to SPECULATIVE_TOKENS drafted tokens are verified per forward pass of Maya1
+SPECULATIVE_DECODING = os.getenv('SPECULATIVE_DECODING', 'off').lower()
+SPECULATIVE_TOKENS = int(os.getenv('SPECULATIVE_TOKENS', '7'))
+SPECULATIVE_NGRAM = int(os.getenv('SPECULATIVE_NGRAM', '3'))
+DRAFT_MODEL_NAME = os.getenv('DRAFT_MODEL_NAME', '')
+
+# Continuous batching across concurrent RunPod jobs (MAX_CONCURRENCY > 1 enables the scheduler)
+MAX_CONCURRENCY = int(os.getenv('MAX_CONCURRENCY', '1'))
+SCHEDULER_MAX_BATCH_SIZE = int(os.getenv('SCHEDULER_MAX_BATCH_SIZE', '16'))
+
+# Chunk joins: equal-power crossfade length, and the audio length above which the assembled
+# output is spooled to a memory-mapped temp file in AUDIO_SPOOL_DIR instead of RAM
+AUDIO_CROSSFADE_MS = float(os.getenv('AUDIO_CROSSFADE_MS', '10'))
+AUDIO_SPOOL_SECONDS = float(os.getenv('AUDIO_SPOOL_SECONDS', '600'))
+AUDIO_SPOOL_DIR = os.getenv('AUDIO_SPOOL_DIR') or tempfile.gettempdir()
+
+# Storage for uploaded audio: STORAGE_BACKEND=firebase (default) or local (files under LOCAL_STORAGE_DIR,
+# served from LOCAL_STORAGE_BASE_URL if set); uploads run on a bounded background thread pool with retries
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'firebase').lower()
+LOCAL_STORAGE_DIR = os.getenv('LOCAL_STORAGE_DIR', '/tmp/maya1-storage')
+LOCAL_STORAGE_BASE_URL = os.getenv('LOCAL_STORAGE_BASE_URL', '')
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '4'))
+UPLOAD_MAX_PENDING = int(os.getenv('UPLOAD_MAX_PENDING', '16'))
+UPLOAD_RETRIES = int(os.getenv('UPLOAD_RETRIES', '3'))
+UPLOAD_RESUMABLE_MB = float(os.getenv('UPLOAD_RESUMABLE_MB', '8'))
+
+# Replica pool: REPLICA_WORKERS > 1 runs generation in that many worker processes, each with a model
+# replica (CPU: one shared-memory copy of the weights; GPU: one replica per device, round-robin)
+REPLICA_WORKERS = int(os.getenv('REPLICA_WORKERS', '0'))
+
+# Chunked generation: number of text chunks decoded together in one model.generate call
+DEFAULT_CHUNK_BATCH_SIZE = int(os.getenv('CHUNK_BATCH_SIZE', '8'))
+# Texts over CHUNK_THRESHOLD_TOKENS prompt tokens (~200 words) are split into balanced chunks of at most
+# CHUNK_MAX_TOKENS (~150 words) at paragraph, sentence, then clause boundaries
+CHUNK_THRESHOLD_TOKENS = int(os.getenv('CHUNK_THRESHOLD_TOKENS', '260'))
+CHUNK_MAX_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS', '200'))
+
+# Memory governor: generation reserves its estimated KV-cache + SNAC-decode memory against MEMORY_BUDGET_MB
+# (0 = auto: MEMORY_BUDGET_FRACTION of the GPU minus what is allocated at startup; unlimited on CPU), chunk
+# batches are sized to fit, and an OOM halves the batch or splits the chunk instead of failing the job
+MEMORY_BUDGET_MB = float(os.getenv('MEMORY_BUDGET_MB', '0'))
+MEMORY_BUDGET_FRACTION = float(os.getenv('MEMORY_BUDGET_FRACTION', '0.9'))
+MEMORY_RELEASE_BETWEEN_STAGES = os.getenv('MEMORY_RELEASE_BETWEEN_STAGES', '1').lower() in ('1', 'true', 'yes')
+
 # Global model and tokenizer (loaded once at startup)
 model = None
 tokenizer = None
 snac_decoder = None
 firebase_app = None
+batch_scheduler = None
+replica_pool = None
+storage_uploader = None
+compiled_engine = False
+model_load_timings = {}  # Phase -> seconds of the last load_model call
+static_caches = {}  # (batch_size, max_cache_len) -> StaticCache, reused across requests
+snac_streams = {}  # CUDA device -> side stream for pipelined SNAC decoding
+draft_model = None
+_draft_model_lock = threading.Lock()
+_snac_rng_lock = threading.Lock()  # Scheduled jobs decode concurrently; seeded decoder noise must not interleave
+memory_governor = None
+
+
+def debug_enabled() -> bool:
+    """True when DEBUG diagnostics should run: LOG_LEVEL=DEBUG or the current request asked for them."""
+    return _request_debug.get() or logger.isEnabledFor(logging.DEBUG)
+
+
+def log_debug(msg: str, *args) -> None:
+    """
+    Log a lazily formatted DEBUG message.
+    
+    Emitted when the logger level allows it, or (bypassing the level) while a request with
+    "debug": true is being handled. Arguments are only formatted if the record is emitted.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(msg, *args, stacklevel=2)
+    elif _request_debug.get():
+        logger.handle(logger.makeRecord(logger.name, logging.DEBUG, '(request debug)', 0, msg, args, None))
+
+
+@contextmanager
+def request_debug(enabled: bool):
+    """Enable per-request DEBUG diagnostics for the duration of the block."""
+    token = _request_debug.set(bool(enabled))
+    try:
+        yield
+    finally:
+        _request_debug.reset(token)
 
 
 def init_firebase():
@@ -70,7 +248,7 @@ def init_firebase():
                 cred_dict = json.loads(service_account_json)
                 cred = credentials.Certificate(cred_dict)
             except (json.JSONDecodeError, KeyError) as e:
-                print(f"Error parsing FIREBASE_SERVICE_ACCOUNT_KEY: {e}")
+                logger.error("Error parsing FIREBASE_SERVICE_ACCOUNT_KEY: %s", e)
                 return None
         else:
             # Try individual environment variables
@@ -79,7 +257,7 @@ def init_firebase():
             private_key = os.getenv('FIREBASE_PRIVATE_KEY')
             
             if not all([project_id, client_email, private_key]):
-                print("Firebase credentials not found in environment variables")
+                logger.warning("Firebase credentials not found in environment variables")
                 return None
             
             cred = credentials.Certificate({
@@ -95,93 +273,488 @@ def init_firebase():
             'storageBucket': storage_bucket
         })
         
-        print("Firebase initialized successfully")
+        logger.info("Firebase initialized successfully")
         return firebase_app
     
     except Exception as e:
-        print(f"Failed to initialize Firebase: {e}")
+        logger.error("Failed to initialize Firebase: %s", e)
+        return None
+
+
+def _snapshot_manifest(snapshot_dir: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(snapshot_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
         return None
 
 
-def load_model():
+def save_model_snapshot(snapshot_dir: str, model_name: str, dtype: torch.dtype) -> None:
+    """
+    Write the loaded model, tokenizer and SNAC decoder to snapshot_dir.
+    
+    Layout: model/ (save_pretrained safetensors + tokenizer), snac/ (config.json + model.safetensors)
+    and manifest.json, written last so a partial snapshot is never used.
+    """
+    from huggingface_hub import hf_hub_download
+    
+    tmp_dir = f"{snapshot_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    model.save_pretrained(os.path.join(tmp_dir, 'model'), safe_serialization=True)
+    tokenizer.save_pretrained(os.path.join(tmp_dir, 'model'))
+    os.makedirs(os.path.join(tmp_dir, 'snac'))
+    shutil.copyfile(hf_hub_download(repo_id=SNAC_MODEL_NAME, filename='config.json'),
+                    os.path.join(tmp_dir, 'snac', 'config.json'))
+    snac_state = {name: tensor.detach().cpu().contiguous() for name, tensor in snac_decoder.state_dict().items()}
+    save_safetensors(snac_state, os.path.join(tmp_dir, 'snac', 'model.safetensors'))
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump({"model_name": model_name, "snac_model_name": SNAC_MODEL_NAME,
+                   "dtype": str(dtype).replace('torch.', ''), "created": datetime.now().isoformat()}, f)
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    os.replace(tmp_dir, snapshot_dir)
+
+
+def load_snac_snapshot(snac_dir: str) -> SNAC:
+    """Build SNAC from the snapshot config and assign its weights straight from the mmapped safetensors."""
+    decoder = SNAC.from_config(os.path.join(snac_dir, 'config.json'))
+    with safe_open(os.path.join(snac_dir, 'model.safetensors'), framework='pt') as f:
+        state = {name: f.get_tensor(name) for name in f.keys()}
+    decoder.load_state_dict(state, assign=True)
+    return decoder.eval()
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether this CPU has native bf16 matmul support (AVX512-BF16/AMX), where bf16 beats fp32."""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def resolve_cpu_quantization(device: str) -> str:
+    """Effective QUANTIZATION mode for a load on `device` ('none', 'int8' or 'bf16')."""
+    if QUANTIZATION in ('', 'none', 'fp32'):
+        return 'none'
+    if QUANTIZATION not in ('int8', 'bf16'):
+        logger.warning("Unknown QUANTIZATION=%s, using fp32", QUANTIZATION)
+        return 'none'
+    if device != 'cpu':
+        logger.warning("QUANTIZATION=%s only applies to CPU inference, ignoring it on %s", QUANTIZATION, device)
+        return 'none'
+    if QUANTIZATION == 'bf16' and not cpu_supports_bf16():
+        logger.warning("QUANTIZATION=bf16 requested but this CPU has no native bf16 support, using fp32")
+        return 'none'
+    return QUANTIZATION
+
+
+def quantize_model_int8(target_model):
+    """
+    Replace every nn.Linear in the transformer (attention, MLP and lm_head) with an int8
+    dynamically quantized one: weights are stored as int8 with per-tensor scales, activations
+    are quantized on the fly per batch. Embeddings and norms stay fp32.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        return torch.ao.quantization.quantize_dynamic(target_model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_model(device: Optional[str] = None):
     """
     Load Maya1 model and tokenizer (called once at startup).
     
     Ensures strict device consistency: model and SNAC decoder on same device.
+    `device` pins the model to one device (e.g. "cuda:1" in a replica worker) instead of
+    spreading it with device_map="auto".
+    
+    With MODEL_SNAPSHOT_DIR set, both models load from the local snapshot (memory-mapped
+    safetensors already in the target dtype, no network); a missing or stale snapshot is
+    written after a normal load. Per-phase timings end up in model_load_timings.
+    
+    On CPU, QUANTIZATION=bf16 loads the transformer in bfloat16 and QUANTIZATION=int8 quantizes
+    its linear layers after loading (the snapshot keeps the unquantized weights); SNAC stays fp32.
     """
-    global model, tokenizer, snac_decoder
+    global model, tokenizer, snac_decoder, model_load_timings
     
     if model is not None and tokenizer is not None:
         return model, tokenizer
     
     model_name = os.getenv('MODEL_NAME', 'maya-research/maya1')
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    device_map = {'': device} if device else 'auto'
+    device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    quantization = resolve_cpu_quantization(device)
+    dtype = torch.bfloat16 if device.startswith('cuda') or quantization == 'bf16' else torch.float32
+    
+    manifest = _snapshot_manifest(MODEL_SNAPSHOT_DIR) if MODEL_SNAPSHOT_DIR else None
+    use_snapshot = manifest is not None and manifest.get("model_name") == model_name and \
+        manifest.get("dtype") == str(dtype).replace('torch.', '')
+    source = os.path.join(MODEL_SNAPSHOT_DIR, 'model') if use_snapshot else model_name
+    timings = {}
     
-    print(f"Loading model {model_name} on {device}...")
+    logger.info("Loading model %s on %s%s...", model_name, device, " from snapshot" if use_snapshot else "")
     
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    phase_start = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(source, local_files_only=use_snapshot)
+    timings["tokenizer"] = time.perf_counter() - phase_start
+    
+    phase_start = time.perf_counter()
     model = AutoModelForCausalLM.from_pretrained(
-        model_name,
-        torch_dtype=torch.bfloat16 if device == 'cuda' else torch.float32,
-        device_map='auto' if device == 'cuda' else None
+        source,
+        torch_dtype=dtype,
+        device_map=device_map if device.startswith('cuda') else None,
+        local_files_only=use_snapshot
     )
+    timings["model"] = time.perf_counter() - phase_start
     
+    phase_start = time.perf_counter()
     if device == 'cpu':
         model = model.to(device)
     
     model.eval()
+    timings["model_to_device"] = time.perf_counter() - phase_start
     
     # Record device from model parameters (for strict consistency)
     model_device = next(model.parameters()).device
-    print(f"Model loaded on device: {model_device}")
+    logger.info("Model loaded on device: %s", model_device)
     
     # Initialize SNAC decoder and move to same device as model
     # CRITICAL: Keep decoder and codes on same device to avoid device mismatch errors
-    print("Loading SNAC decoder...")
-    snac_decoder = SNAC.from_pretrained("hubertsiuzdak/snac_24khz").eval()
+    logger.info("Loading SNAC decoder...")
+    phase_start = time.perf_counter()
+    if use_snapshot:
+        snac_decoder = load_snac_snapshot(os.path.join(MODEL_SNAPSHOT_DIR, 'snac'))
+    else:
+        snac_decoder = SNAC.from_pretrained(SNAC_MODEL_NAME).eval()
+    timings["snac"] = time.perf_counter() - phase_start
+    phase_start = time.perf_counter()
     snac_decoder = snac_decoder.to(model_device)  # Always match model device
-    print(f"SNAC decoder loaded and moved to device: {model_device}")
-    
-    print("Model loaded successfully")
+    timings["snac_to_device"] = time.perf_counter() - phase_start
+    logger.info("SNAC decoder loaded and moved to device: %s", model_device)
+    
+    if MODEL_SNAPSHOT_DIR and not use_snapshot:
+        phase_start = time.perf_counter()
+        try:
+            save_model_snapshot(MODEL_SNAPSHOT_DIR, model_name, dtype)
+            logger.info("Wrote model snapshot to %s", MODEL_SNAPSHOT_DIR)
+        except OSError as e:
+            logger.warning("Failed to write model snapshot to %s: %s", MODEL_SNAPSHOT_DIR, e)
+        timings["snapshot_write"] = time.perf_counter() - phase_start
+    
+    if quantization == 'int8':
+        phase_start = time.perf_counter()
+        model = quantize_model_int8(model)
+        timings["quantize"] = time.perf_counter() - phase_start
+    if quantization != 'none':
+        logger.info("CPU inference precision: %s (SNAC decoder fp32)", quantization)
+    
+    if ENGINE_MODE == 'compiled':
+        phase_start = time.perf_counter()
+        enable_compiled_engine()
+        timings["compile"] = time.perf_counter() - phase_start
+    
+    model_load_timings = timings
+    logger.info("Model loaded successfully (%s in %.2fs: %s)", "snapshot" if use_snapshot else "hub",
+                sum(timings.values()), ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items()))
     return model, tokenizer
 
 
+def load_tokenizer():
+    """
+    Load only the tokenizer (from the snapshot when there is one). Used by a parent process whose
+    GPU replica workers hold the models, which still tokenizes to chunk texts.
+    """
+    global tokenizer
+    
+    if tokenizer is None:
+        model_name = os.getenv('MODEL_NAME', 'maya-research/maya1')
+        manifest = _snapshot_manifest(MODEL_SNAPSHOT_DIR) if MODEL_SNAPSHOT_DIR else None
+        use_snapshot = manifest is not None and manifest.get("model_name") == model_name
+        source = os.path.join(MODEL_SNAPSHOT_DIR, 'model') if use_snapshot else model_name
+        tokenizer = AutoTokenizer.from_pretrained(source, local_files_only=use_snapshot)
+        logger.info("Tokenizer loaded from %s (models live in the replica workers)", source)
+    return tokenizer
+
+
+def ensure_model_loaded() -> None:
+    """Load what this process generates with: the model, or only the tokenizer when GPU replicas do the work."""
+    if replica_pool is not None and not replica_pool.shares_weights:
+        load_tokenizer()
+    elif model is None:
+        load_model()
+
+
+def _compile_artifacts_path() -> str:
+    return os.path.join(COMPILE_CACHE_DIR, 'maya1-compile-artifacts.bin')
+
+
+def enable_compiled_engine() -> None:
+    """
+    Switch generation to static KV caches with a torch.compiled decode step.
+    
+    Inductor's FX graph cache and (on torch >= 2.7) the portable compile artifacts are kept in
+    COMPILE_CACHE_DIR, so a restarted worker reloads compiled kernels instead of recompiling.
+    """
+    global model, compiled_engine
+    
+    if compiled_engine:
+        return
+    
+    os.makedirs(COMPILE_CACHE_DIR, exist_ok=True)
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.join(COMPILE_CACHE_DIR, 'inductor'))
+    os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+    
+    artifacts_path = _compile_artifacts_path()
+    if hasattr(torch.compiler, 'load_cache_artifacts') and os.path.exists(artifacts_path):
+        try:
+            with open(artifacts_path, 'rb') as f:
+                torch.compiler.load_cache_artifacts(f.read())
+            logger.info("Loaded compile artifacts from %s", artifacts_path)
+        except Exception as e:
+            logger.warning("Could not load compile artifacts (%s), compiling from scratch", e)
+    
+    device = next(model.parameters()).device
+    mode = COMPILE_MODE or ('reduce-overhead' if device.type == 'cuda' else 'default')
+    model.forward = compiled_decode_forward(model.forward, mode)
+    compiled_engine = True
+    logger.info("Compiled decode engine enabled (mode=%s, cache buckets=%s)", mode, STATIC_CACHE_BUCKETS)
+
+
+def compiled_decode_forward(eager_forward, mode: str):
+    """
+    Wrap a model's forward so only single-token decode steps on a static cache run compiled.
+    
+    Prefill (whose shape changes with every prompt length), multi-token verification and calls on
+    a DynamicCache (scheduler, speculative decoding, prefix prefill) stay eager, so the compiled
+    graphs are bounded by batch size x STATIC_CACHE_BUCKETS.
+    """
+    compiled_forward = torch.compile(eager_forward, mode=mode, dynamic=False)
+    
+    @functools.wraps(eager_forward)
+    def forward(*args, **kwargs):
+        input_ids = kwargs.get('input_ids', args[0] if args else None)
+        if (input_ids is not None and input_ids.shape[-1] == 1
+                and isinstance(kwargs.get('past_key_values'), StaticCache)):
+            return compiled_forward(*args, **kwargs)
+        return eager_forward(*args, **kwargs)
+    
+    return forward
+
+
+def save_compile_artifacts() -> None:
+    """Persist compile artifacts so the next worker start skips recompilation (torch >= 2.7)."""
+    if not hasattr(torch.compiler, 'save_cache_artifacts'):
+        return
+    try:
+        artifacts = torch.compiler.save_cache_artifacts()
+        if artifacts is not None:
+            with open(_compile_artifacts_path(), 'wb') as f:
+                f.write(artifacts[0])
+    except Exception as e:
+        logger.warning("Could not save compile artifacts: %s", e)
+
+
+def static_cache_bucket(needed_len: int) -> int:
+    """Round a prompt + max_new_tokens length up to a cache bucket, bounding the set of compiled shapes."""
+    for bucket in STATIC_CACHE_BUCKETS:
+        if needed_len <= bucket:
+            return bucket
+    largest = STATIC_CACHE_BUCKETS[-1]
+    return -(-needed_len // largest) * largest
+
+
+def get_static_cache(batch_size: int, needed_len: int):
+    """Return a zeroed, preallocated StaticCache for this batch size and length bucket."""
+    key = (batch_size, static_cache_bucket(needed_len))
+    cache = static_caches.get(key)
+    if cache is None:
+        logger.info("Allocating static KV cache for batch %d, %d positions (new compile bucket)", *key)
+        if 'max_batch_size' in inspect.signature(StaticCache.__init__).parameters:
+            cache = StaticCache(config=model.config, max_batch_size=key[0], max_cache_len=key[1],
+                                device=next(model.parameters()).device, dtype=model.dtype)
+        else:
+            cache = StaticCache(config=model.config, max_cache_len=key[1])
+        static_caches[key] = cache
+    else:
+        cache.reset()
+    return cache
+
+
+def initial_past_key_values(voice_description: str, input_ids: torch.Tensor, max_new_tokens: int):
+    """
+    KV cache to start generation from: a bucketed static cache in the compiled engine,
+    otherwise a copy of the cached voice-description prefix (or None).
+    """
+    if compiled_engine:
+        return get_static_cache(input_ids.shape[0], input_ids.shape[1] + max_new_tokens)
+    return get_prefix_past_key_values(voice_description, input_ids)
+
+
+def build_prompt_header(description: str) -> str:
+    """
+    Build the voice-description header that starts every Maya1 prompt (SOH + BOS + description).
+    
+    This part depends only on the description, which is what the prefix KV cache keys on.
+    """
+    soh_token = tokenizer.decode([SOH_ID])
+    bos_token = tokenizer.bos_token if tokenizer.bos_token else tokenizer.decode([BOS_ID])
+    return soh_token + bos_token + f'<description="{description}">'
+
+
 def build_prompt(description: str, text: str) -> str:
     """
     Build formatted prompt for Maya1.
     
     Uses manual construction matching official Maya1 examples.
     """
-    # Format text with description (matching official examples)
-    formatted_text = f'<description="{description}"> {text}'
-    
-    # Manual construction (matches official Quick Start example)
-    soh_token = tokenizer.decode([SOH_ID])
+    # Manual construction (matches official Quick Start example):
+    # SOH + BOS + <description="..."> text + EOT + EOH + SOA + SOS
     eoh_token = tokenizer.decode([EOH_ID])
     soa_token = tokenizer.decode([SOA_ID])
     sos_token = tokenizer.decode([CODE_START_TOKEN_ID])
     eot_token = tokenizer.decode([TEXT_EOT_ID])
-    bos_token = tokenizer.bos_token if tokenizer.bos_token else tokenizer.decode([BOS_ID])
     
     prompt = (
-        soh_token + bos_token + formatted_text + eot_token +
+        build_prompt_header(description) + f' {text}' + eot_token +
         eoh_token + soa_token + sos_token
     )
     
-    # Debug: print prompt to verify correct text is being used
-    print(f"DEBUG: Building prompt with text: {text[:100]}...")
-    print(f"DEBUG: Prompt preview: {prompt[:200]}...")
+    # Debug: log prompt to verify correct text is being used
+    log_debug("Prompt preview: %.200s...", prompt)
     
     return prompt
 
 
-def extract_snac_codes(token_ids: list) -> list:
+def kv_cache_layers(cache) -> List[tuple]:
+    """Per-layer (key, value) tensors of a DynamicCache (handles both the layered and the legacy list layout)."""
+    if hasattr(cache, 'layers'):
+        return [(layer.keys, layer.values) for layer in cache.layers if layer.keys is not None]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def kv_cache_tensors(cache) -> List[torch.Tensor]:
+    """Flat list of all key/value tensors of a DynamicCache."""
+    return [t for layer in kv_cache_layers(cache) for t in layer]
+
+
+def build_kv_cache(layers: List[tuple]):
+    """Build a DynamicCache from per-layer (key, value) tensors shaped [batch, heads, seq, head_dim]."""
+    if hasattr(DynamicCache, 'from_legacy_cache'):
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return DynamicCache(ddp_cache_data=layers)
+
+
+class PrefixKVCache:
+    """
+    Memory-bounded LRU of prefilled KV caches for prompt headers, keyed on (model, description).
+    
+    Generation starts from a copy of the cached entry, so the header is only prefilled once per
+    voice. Entries are evicted least-recently-used first when the byte budget is exceeded.
+    """
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (header_ids, cache, nbytes)
+        self._lock = threading.Lock()
+    
+    def get(self, key: tuple) -> Optional[tuple]:
+        """Return (header_ids, cache) for key, or None. The cache must be copied before use."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+    
+    def put(self, key: tuple, header_ids: torch.Tensor, cache) -> None:
+        nbytes = sum(t.numel() * t.element_size() for t in kv_cache_tensors(cache))
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[2]
+            self._entries[key] = (header_ids, cache, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, _, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+prefix_cache = PrefixKVCache(int(PREFIX_CACHE_MAX_MB * 1024 * 1024))
+
+
+def get_prefix_past_key_values(description: str, input_ids: torch.Tensor):
+    """
+    Return a fresh copy of the prefilled header KV cache for this description, or None.
+    
+    input_ids is the tokenized full prompt ([1, seq]); the cache is only used when the
+    separately tokenized header is an exact token prefix of it.
+    """
+    if not PREFIX_CACHE_ENABLED or input_ids.shape[0] != 1:
+        return None
+    
+    key = (getattr(model, 'name_or_path', ''), description)
+    entry = prefix_cache.get(key)
+    if entry is None:
+        header_ids = tokenizer(build_prompt_header(description), return_tensors='pt')['input_ids'].to(input_ids.device)
+        cache = DynamicCache()
+        with torch.no_grad():
+            model(header_ids, past_key_values=cache, use_cache=True)
+        prefix_cache.put(key, header_ids, cache)
+    else:
+        header_ids, cache = entry
+    
+    header_len = header_ids.shape[1]
+    if header_len >= input_ids.shape[1] or not torch.equal(input_ids[:, :header_len], header_ids):
+        # Header tokens merged with the text - fall back to a full prefill
+        return None
+    
+    return copy.deepcopy(cache)
+
+
+def extract_snac_codes(token_ids):
     """
     Extract SNAC codes from generated tokens.
     
     Uses the LAST occurrence of CODE_END_TOKEN_ID to avoid cutting off
     early if the model emits an early EOS token due to sampling.
+    
+    A 1-D tensor is processed on its own device (mask + last-EOS search as tensor ops) and
+    a tensor is returned, so codes go straight to unpacking/decoding without a host copy.
+    Lists (e.g. from the streaming path) are returned as lists.
     """
+    if isinstance(token_ids, torch.Tensor):
+        if token_ids.shape[0] == 0:
+            return token_ids
+        positions = torch.arange(token_ids.shape[0], device=token_ids.device)
+        # Last EOS position, or the full length when there is none
+        last_eos = torch.where(token_ids == CODE_END_TOKEN_ID, positions, -1).max()
+        eos_idx = torch.where(last_eos >= 0, last_eos, token_ids.shape[0])
+        keep = (positions < eos_idx) & (token_ids >= SNAC_MIN_ID) & (token_ids <= SNAC_MAX_ID)
+        return token_ids[keep]
+    
     # Find the last occurrence of CODE_END_TOKEN_ID (not the first)
     # This prevents early truncation if sampling produces a premature EOS
     try:
@@ -199,390 +772,2955 @@ def extract_snac_codes(token_ids: list) -> list:
     return snac_codes
 
 
-def unpack_snac_from_7(snac_tokens: list) -> tuple:
+def unpack_snac_from_7(snac_tokens, device: Optional[torch.device] = None) -> tuple:
     """
     Unpack 7-token SNAC frames to 3 hierarchical levels.
     
+    Vectorized: the tokens are reshaped to (frames, 7) and the slot columns [0], [1, 4] and
+    [2, 3, 5, 6] are gathered in one indexing op. Accepts a list or a 1-D/2-D tensor
+    ([batch, tokens]) and returns three long tensors shaped [batch, frames], [batch, 2*frames]
+    and [batch, 4*frames] on `device` (default: the tensor's device, else the model device),
+    ready for snac_decoder.quantizer.from_codes.
+    
     CRITICAL: Handles partial frames by padding (not discarding) to preserve all audio.
     """
-    if snac_tokens and snac_tokens[-1] == CODE_END_TOKEN_ID:
-        snac_tokens = snac_tokens[:-1]
+    if device is None:
+        if isinstance(snac_tokens, torch.Tensor):
+            device = snac_tokens.device
+        elif model is not None:
+            device = next(model.parameters()).device
+    
+    codes = torch.as_tensor(snac_tokens, dtype=torch.long, device=device)
+    if codes.dim() == 1:
+        codes = codes.unsqueeze(0)
+        if codes.shape[1] and codes[0, -1].item() == CODE_END_TOKEN_ID:
+            codes = codes[:, :-1]
     
     # Calculate frames and remainder
-    total_tokens = len(snac_tokens)
+    batch_size, total_tokens = codes.shape
     frames = total_tokens // SNAC_TOKENS_PER_FRAME
     remainder = total_tokens % SNAC_TOKENS_PER_FRAME
     
-    print(f"DEBUG: unpack_snac_from_7: {total_tokens} tokens = {frames} complete frames + {remainder} remainder")
+    log_debug("unpack_snac_from_7: %d tokens = %d complete frames + %d remainder", total_tokens, frames, remainder)
     
     # CRITICAL: Don't throw away partial frames - pad them instead
     if remainder > 0:
-        print(f"⚠️ WARNING: {remainder} tokens in incomplete final frame - padding to preserve audio")
+        log_debug("%d tokens in incomplete final frame - padding to preserve audio", remainder)
         # Pad with last token to complete the frame (better than dropping)
         padding_needed = SNAC_TOKENS_PER_FRAME - remainder
-        snac_tokens = snac_tokens + [snac_tokens[-1]] * padding_needed
+        codes = torch.cat([codes, codes[:, -1:].expand(batch_size, padding_needed)], dim=1)
         frames += 1
-        print(f"DEBUG: Padded to {frames} complete frames (added {padding_needed} padding tokens)")
-    
-    # Now we have exact frame boundaries
-    snac_tokens = snac_tokens[:frames * SNAC_TOKENS_PER_FRAME]
+        log_debug("Padded to %d complete frames (added %d padding tokens)", frames, padding_needed)
     
     if frames == 0:
-        return ([], [], [])
-    
-    l1, l2, l3 = [], [], []
-    
-    for i in range(frames):
-        slots = snac_tokens[i*7:(i+1)*7]
-        # Safety check - should always be 7 now
-        if len(slots) != 7:
-            print(f"⚠️ ERROR: Frame {i} has {len(slots)} slots (expected 7) - padding...")
-            while len(slots) < 7:
-                slots.append(slots[-1] if slots else CODE_TOKEN_OFFSET)
-        
-        l1.append((slots[0] - CODE_TOKEN_OFFSET) % 4096)
-        l2.extend([
-            (slots[1] - CODE_TOKEN_OFFSET) % 4096,
-            (slots[4] - CODE_TOKEN_OFFSET) % 4096,
-        ])
-        l3.extend([
-            (slots[2] - CODE_TOKEN_OFFSET) % 4096,
-            (slots[3] - CODE_TOKEN_OFFSET) % 4096,
-            (slots[5] - CODE_TOKEN_OFFSET) % 4096,
-            (slots[6] - CODE_TOKEN_OFFSET) % 4096,
-        ])
+        empty = codes.new_zeros((batch_size, 0))
+        return (empty, empty, empty)
+    
+    # (batch, frames, 7) → slots reordered as [l1 | l2 l2 | l3 l3 l3 l3], offset removed
+    slots = codes.view(batch_size, frames, SNAC_TOKENS_PER_FRAME)[:, :, SNAC_SLOT_ORDER]
+    slots = torch.remainder(slots - CODE_TOKEN_OFFSET, SNAC_CODEBOOK_SIZE)
     
-    print(f"DEBUG: Unpacked to levels: l1={len(l1)}, l2={len(l2)}, l3={len(l3)}")
+    l1 = slots[:, :, 0]
+    l2 = slots[:, :, 1:3].reshape(batch_size, -1)
+    l3 = slots[:, :, 3:].reshape(batch_size, -1)
+    
+    log_debug("Unpacked to levels: l1=%d, l2=%d, l3=%d", l1.shape[1], l2.shape[1], l3.shape[1])
     return (l1, l2, l3)
 
 
-def generate_audio(text: str, voice_description: str, temperature: float = 0.6, max_new_tokens: int = 2000) -> tuple:
-    """
-    Generate audio from text and voice description.
-    
-    Returns:
-        tuple: (audio_array, sampling_rate)
-    """
-    global model, tokenizer, snac_decoder
-    
-    if model is None or tokenizer is None:
-        load_model()
-    
-    # Set max_new_tokens: Use fixed generous cap (no word-count guessing)
-    # Official Maya examples use fixed values (e.g. 2048), not word-count heuristics
-    # Text length → audio length → SNAC token count is NOT linear or fixed
-    # We rely on EOS token detection for completion, not the token limit
-    if max_new_tokens == 2000:  # Default value - replace with fixed cap
-        # For short/medium text (≤200 words): Use generous fixed cap
-        # This prevents truncation while allowing EOS to determine actual completion
-        words = len(text.split())
-        if words <= 200:
-            max_new_tokens = 4000  # Fixed generous cap for short/medium text (matches official approach)
-            print(f"DEBUG: Using fixed max_new_tokens: {max_new_tokens} for {words} words (relying on EOS for completion)")
-        else:
-            # For very long text (>200 words): Use larger cap (chunking will handle these)
-            max_new_tokens = 6000
-            print(f"DEBUG: Using fixed max_new_tokens: {max_new_tokens} for {words} words (long text, will be chunked)")
-        
-        print(f"DEBUG: Completion determined by EOS token detection, not token limit")
-    
-    # Build prompt
-    prompt = build_prompt(voice_description, text)
-    
-    # Debug: Verify text is in prompt and check for emotion tags
-    print(f"DEBUG: Input text received: {text[:100]}...")
-    print(f"DEBUG: Text length: {len(text)} chars, {len(text.split())} words")
-    
-    # Check if emotion tags are present
-    emotion_tags = re.findall(r'<[a-z_]+>', text.lower())
-    if emotion_tags:
-        print(f"DEBUG: Found emotion tags in input: {set(emotion_tags)}")
-    else:
-        print(f"DEBUG: No emotion tags found in input text")
-    
-    print(f"DEBUG: Prompt length: {len(prompt)} chars")
-    
-    # Tokenize input (match official example format)
-    # IMPORTANT: Don't use add_special_tokens=False - we want the tokenizer to handle tags properly
-    inputs = tokenizer(prompt, return_tensors='pt')
-    
-    # Debug: Verify tags are preserved after tokenization AND check how they're tokenized
-    input_token_ids = inputs['input_ids'][0].tolist()
-    input_text_decoded = tokenizer.decode(input_token_ids, skip_special_tokens=False)
-    if emotion_tags:
-        print(f"DEBUG: Checking if emotion tags preserved after tokenization...")
-        for tag in emotion_tags:
-            if tag in input_text_decoded.lower():
-                print(f"✅ Tag '{tag}' preserved in tokenized text")
-                
-                # CRITICAL: Check if tag is tokenized as single token or split
-                # Find tag position in original text
-                tag_lower = tag.lower()
-                tag_upper = tag  # Preserve case from original
-                if tag_lower in text.lower():
-                    tag_pos = text.lower().find(tag_lower)
-                    # Tokenize just the tag to see how it's split
-                    tag_tokens = tokenizer.encode(tag_upper, add_special_tokens=False)
-                    print(f"DEBUG: Tag '{tag}' tokenizes to {len(tag_tokens)} token(s): {tag_tokens}")
-                    if len(tag_tokens) > 3:
-                        print(f"⚠️ WARNING: Tag '{tag}' is split into {len(tag_tokens)} tokens - might cause issues!")
-                        print(f"   Tokens: {[tokenizer.decode([t]) for t in tag_tokens]}")
-                    else:
-                        print(f"✅ Tag '{tag}' tokenizes cleanly ({len(tag_tokens)} tokens)")
-            else:
-                print(f"⚠️ WARNING: Emotion tag '{tag}' may have been lost/modified during tokenization!")
-                print(f"   Original text snippet: {text[max(0, text.lower().find(tag)-20):text.lower().find(tag)+len(tag)+20]}")
-                print(f"   Decoded text snippet: {input_text_decoded.lower()[max(0, input_text_decoded.lower().find(tag)-20):input_text_decoded.lower().find(tag)+len(tag)+20] if tag in input_text_decoded.lower() else 'TAG NOT FOUND'}")
-    # Get device from model (ensures consistency)
-    device = next(model.parameters()).device
-    input_ids = inputs['input_ids'].to(device)
+def ensure_snac_on_device(device: torch.device) -> None:
+    """Move the SNAC decoder to the model device if it drifted (codes and decoder must match)."""
+    global snac_decoder
     
-    # Ensure SNAC decoder is on same device (safety check)
     if snac_decoder is not None:
         snac_decoder_device = next(snac_decoder.parameters()).device if list(snac_decoder.parameters()) else device
         if snac_decoder_device != device:
-            print(f"WARNING: SNAC decoder device ({snac_decoder_device}) != model device ({device}), moving decoder...")
+            logger.warning("SNAC decoder device (%s) != model device (%s), moving decoder...", snac_decoder_device, device)
             snac_decoder = snac_decoder.to(device)
+
+
+def decode_snac_codes(snac_codes, device: torch.device, trim_warmup: bool = True) -> np.ndarray:
+    """
+    Decode extracted SNAC codes to a float audio array.
     
-    print(f"DEBUG: Input token count: {input_ids.shape[1]} tokens")
-    print(f"DEBUG: Max new tokens: {max_new_tokens}")
-    
-    # Generate tokens with parameters matching official Maya1 examples
-    with torch.no_grad():
-        outputs = model.generate(
-            input_ids,
-            max_new_tokens=max_new_tokens,
-            min_new_tokens=28,  # At least 4 SNAC frames (7 tokens each)
-            temperature=temperature,
-            top_p=0.9,  # Nucleus sampling (conservative, consistent)
-            repetition_penalty=1.1,  # Prevent repetition loops (consistent quality)
-            do_sample=True,
-            eos_token_id=CODE_END_TOKEN_ID,  # Stop at end of speech token
-            pad_token_id=tokenizer.pad_token_id if tokenizer.pad_token_id else tokenizer.eos_token_id,
-        )
-    
-    # Extract generated tokens (remove input tokens)
-    generated_ids = outputs[0, input_ids.shape[1]:].cpu().tolist()
-    generated_tokens = generated_ids
-    
-    # CRITICAL DIAGNOSTICS: Log token generation details
-    print(f"DEBUG: Generated {len(generated_tokens)} tokens (max allowed: {max_new_tokens})")
-    token_usage_pct = (len(generated_tokens) / max_new_tokens) * 100 if max_new_tokens > 0 else 0
-    print(f"DEBUG: Token usage: {token_usage_pct:.1f}% ({len(generated_tokens)}/{max_new_tokens})")
-    
-    # Detect truncation (matching robust streaming inference patterns)
-    truncated = False
-    if CODE_END_TOKEN_ID not in generated_tokens and len(generated_tokens) >= max_new_tokens:
-        truncated = True
-        print(f"⚠️ CRITICAL: Generation hit max_new_tokens ({max_new_tokens}) without EOS token - audio WILL be truncated!")
-    elif len(generated_tokens) >= max_new_tokens:
-        print(f"⚠️ WARNING: Generated exactly {max_new_tokens} tokens - may have hit limit before natural completion")
-    
-    # Check for EOS token - log ALL positions
-    if CODE_END_TOKEN_ID in generated_tokens:
-        eos_positions = [i for i, token in enumerate(generated_tokens) if token == CODE_END_TOKEN_ID]
-        print(f"DEBUG: Found {len(eos_positions)} EOS token(s) at positions: {eos_positions}")
-        if len(eos_positions) > 1:
-            print(f"⚠️ WARNING: Multiple EOS tokens found! Using LAST one at position {eos_positions[-1]}")
-        print(f"DEBUG: Using last EOS at position {eos_positions[-1]} out of {len(generated_tokens)} tokens")
-        if truncated:
-            print(f"INFO: Truncation detected but last EOS found - will use all tokens up to last EOS")
-    else:
-        print(f"⚠️ WARNING: No EOS token found in generated tokens (length: {len(generated_tokens)})")
-        if len(generated_tokens) < max_new_tokens:
-            print(f"INFO: Generation stopped early without EOS - may indicate model completion or other issue")
-    
-    # SUMMARY: Model behavior vs limit
-    if not truncated and len(generated_tokens) < max_new_tokens * 0.8:  # Used less than 80% of limit
-        print(f"✅ Model stopped naturally: Used {len(generated_tokens)}/{max_new_tokens} tokens ({token_usage_pct:.1f}%)")
-        print(f"   → This is model behavior, not a token limit issue")
-        if CODE_END_TOKEN_ID not in generated_tokens:
-            print(f"   → Model stopped without EOS - may indicate early completion or sampling behavior")
-    
-    # Extract SNAC codes (MUST use last EOS, not first)
-    snac_codes = extract_snac_codes(generated_tokens)
-    
-    if not snac_codes:
-        raise ValueError("No SNAC codes generated. Model may not have produced valid audio tokens.")
-    
-    # CRITICAL DIAGNOSTICS: Check for partial frames
-    total_snac_tokens = len(snac_codes)
-    complete_frames = total_snac_tokens // SNAC_TOKENS_PER_FRAME
-    remainder_tokens = total_snac_tokens % SNAC_TOKENS_PER_FRAME
-    
-    print(f"DEBUG: Extracted {total_snac_tokens} SNAC codes")
-    print(f"DEBUG: Complete frames: {complete_frames}, Remainder tokens: {remainder_tokens}")
-    if remainder_tokens > 0:
-        print(f"⚠️ WARNING: {remainder_tokens} tokens in incomplete frame - may lose last {remainder_tokens} tokens!")
-    
-    # Unpack SNAC tokens
-    l1, l2, l3 = unpack_snac_from_7(snac_codes)
+    The first frame (2048 samples) is warmup and is trimmed unless trim_warmup is False
+    (the streaming path slices frames out of overlapping windows itself).
     
-    # Decode SNAC to audio using the correct API
+    Returns:
+        np.ndarray: mono 24 kHz audio
+    """
+    # Unpack SNAC tokens straight into [1, n] code tensors
     # CRITICAL: All code tensors must be on same device as SNAC decoder
     # Get device from model (which matches decoder device)
-    codes_tensor = [
-        torch.tensor(level, dtype=torch.long, device=device).unsqueeze(0)
-        for level in [l1, l2, l3]
-    ]
+    codes_tensor = list(unpack_snac_from_7(snac_codes, device=device))
     
     # Decode through SNAC quantizer + decoder (correct API)
     with torch.no_grad():
-        z_q = snac_decoder.quantizer.from_codes(codes_tensor)
-        audio_tensor = snac_decoder.decoder(z_q)
+        try:
+            audio_tensor = snac_decoder.decoder(snac_decoder.quantizer.from_codes(codes_tensor))
+        except Exception as e:
+            if not is_out_of_memory(e):
+                raise
+            # Usually fragmentation or another job's cached blocks; a second OOM propagates
+            logger.warning("SNAC decode of %d frames ran out of memory, retrying after releasing cached memory",
+                           codes_tensor[0].shape[-1])
+            release_memory(device, collect=True)
+            audio_tensor = snac_decoder.decoder(snac_decoder.quantizer.from_codes(codes_tensor))
         # Extract audio: [batch, 1, samples] → [samples]
         audio_array = audio_tensor[0, 0].cpu().numpy()
     
     # Trim warmup samples (first 2048 samples) for cleaner audio
-    if len(audio_array) > 2048:
-        audio_array = audio_array[2048:]
+    if trim_warmup and len(audio_array) > SNAC_SAMPLES_PER_FRAME:
+        audio_array = audio_array[SNAC_SAMPLES_PER_FRAME:]
     
-    sampling_rate = 24000  # Maya1 uses 24kHz
-    
-    return audio_array, sampling_rate
+    return audio_array
 
 
-def chunk_text_by_sentences(text: str, max_words_per_chunk: int = 150, min_words_per_chunk: int = 50) -> List[str]:
+def submit_snac_decode(executor: ThreadPoolExecutor, snac_codes, device: torch.device) -> Future:
     """
-    Chunk long text into smaller pieces by sentences.
+    Decode SNAC codes on the decoder worker thread while the caller goes on generating.
     
-    Args:
-        text: Input text to chunk
-        max_words_per_chunk: Maximum words per chunk (roughly ~20-25 seconds of speech)
-        min_words_per_chunk: Minimum words per chunk (to avoid tiny fragments)
-    
-    Returns:
-        List of text chunks
+    On CUDA the decode runs on a dedicated side stream that first waits for the work that
+    produced the codes, so it overlaps the next model.generate instead of queueing behind it.
     """
-    # Split by sentence boundaries (period, exclamation, question mark)
-    # Keep the punctuation with the sentence
-    sentence_pattern = r'([.!?]+[\s]+)'
-    sentences = re.split(sentence_pattern, text)
-    
-    # Rejoin sentences with their punctuation
-    chunks = []
-    current_chunk = ""
-    current_word_count = 0
-    
-    i = 0
-    while i < len(sentences):
-        sentence = sentences[i]
-        if i + 1 < len(sentences):
-            sentence += sentences[i + 1]  # Include punctuation
-            i += 1
-        
-        sentence_words = len(sentence.split())
-        
-        # If adding this sentence would exceed max, save current chunk and start new one
-        if current_word_count + sentence_words > max_words_per_chunk and current_chunk:
-            # Only save if we've accumulated enough words
-            if current_word_count >= min_words_per_chunk:
-                chunks.append(current_chunk.strip())
-                current_chunk = sentence
-                current_word_count = sentence_words
-            else:
-                # Current chunk too small, add sentence anyway (but warn if way over)
-                current_chunk += sentence
-                current_word_count += sentence_words
-        else:
-            current_chunk += sentence
-            current_word_count += sentence_words
-        
-        i += 1
+    if device.type != 'cuda':
+        return executor.submit(contextvars.copy_context().run, decode_snac_codes, snac_codes, device)
     
-    # Add remaining chunk
-    if current_chunk.strip():
-        chunks.append(current_chunk.strip())
+    codes_ready = torch.cuda.Event()
+    codes_ready.record(torch.cuda.current_stream(device))
+    if device not in snac_streams:
+        snac_streams[device] = torch.cuda.Stream(device)
+    stream = snac_streams[device]
     
-    # If no sentence boundaries found, split by length
-    if not chunks:
-        words = text.split()
-        for i in range(0, len(words), max_words_per_chunk):
-            chunk = ' '.join(words[i:i + max_words_per_chunk])
-            if chunk:
-                chunks.append(chunk)
+    def decode_on_side_stream():
+        with torch.cuda.stream(stream):
+            stream.wait_event(codes_ready)
+            return decode_snac_codes(snac_codes, device)
     
-    return chunks if chunks else [text]
+    return executor.submit(contextvars.copy_context().run, decode_on_side_stream)
 
 
-def concatenate_audio_arrays(audio_arrays: List[np.ndarray], sampling_rate: int) -> np.ndarray:
+class WindowedRepetitionPenaltyLogitsProcessor(LogitsProcessor):
     """
-    Concatenate multiple audio arrays into one.
-    
-    Args:
-        audio_arrays: List of audio arrays to concatenate
-        sampling_rate: Sampling rate (must be same for all)
-    
-    Returns:
-        Concatenated audio array
+    Repetition penalty over SNAC codes with incrementally maintained per-sequence counts.
+    
+    HF's RepetitionPenaltyLogitsProcessor gathers over the whole input_ids every step, so its
+    cost grows with the 4k-6k token outputs. This keeps a [batch, 7*4096] count table that is
+    updated only with the tokens appended since the previous call (and the tokens that slid out
+    of the window), so the per-token cost is independent of sequence length. window_frames=0
+    penalizes every code generated so far, like the stock processor; non-SNAC tokens (prompt,
+    padding, EOS) are never penalized.
     """
-    if not audio_arrays:
-        raise ValueError("No audio arrays to concatenate")
-    
-    if len(audio_arrays) == 1:
-        return audio_arrays[0]
     
-    # Concatenate all arrays
-    concatenated = np.concatenate(audio_arrays)
-    return concatenated
-
-
-def audio_to_base64(audio_array: np.ndarray, sampling_rate: int) -> str:
-    """Convert audio array to base64-encoded WAV string."""
-    buffer = io.BytesIO()
-    sf.write(buffer, audio_array, sampling_rate, format='WAV')
-    buffer.seek(0)
-    audio_bytes = buffer.read()
-    audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
-    return audio_base64
+    def __init__(self, prompt_len: int, penalty: float = 1.1, window_frames: int = 0):
+        self.prompt_len = prompt_len
+        self.penalty = penalty
+        self.window = window_frames * SNAC_TOKENS_PER_FRAME
+        self.counts = None
+        self.counted = 0  # Generated tokens already folded into self.counts
+    
+    def _add(self, tokens: torch.LongTensor, sign: int) -> None:
+        codes = tokens - CODE_TOKEN_OFFSET
+        valid = (codes >= 0) & (codes < self.counts.shape[1])
+        self.counts.scatter_add_(1, codes.clamp(0, self.counts.shape[1] - 1), valid.to(self.counts.dtype) * sign)
+    
+    def update(self, input_ids: torch.LongTensor) -> None:
+        """Fold tokens generated since the last call into the counts (usually exactly one)."""
+        if self.counts is None or self.counts.shape[0] != input_ids.shape[0]:
+            self.counts = torch.zeros(
+                input_ids.shape[0], SNAC_TOKENS_PER_FRAME * SNAC_CODEBOOK_SIZE,
+                dtype=torch.int32, device=input_ids.device
+            )
+            self.counted = 0
+        num_generated = input_ids.shape[1] - self.prompt_len
+        while self.counted < num_generated:
+            self._add(input_ids[:, self.prompt_len + self.counted:self.prompt_len + self.counted + 1], 1)
+            if self.window and self.counted >= self.window:
+                leaving = self.prompt_len + self.counted - self.window
+                self._add(input_ids[:, leaving:leaving + 1], -1)
+            self.counted += 1
+    
+    def penalize(self, scores: torch.FloatTensor, low: int, high: int) -> torch.FloatTensor:
+        """Penalize (in place) scores covering vocabulary ids [low, high) within the SNAC range."""
+        seen = self.counts[:, low - CODE_TOKEN_OFFSET:high - CODE_TOKEN_OFFSET] > 0
+        penalized = torch.where(scores > 0, scores / self.penalty, scores * self.penalty)
+        scores.copy_(torch.where(seen, penalized, scores))
+        return scores
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        self.update(input_ids)
+        high = CODE_TOKEN_OFFSET + self.counts.shape[1]
+        self.penalize(scores[:, CODE_TOKEN_OFFSET:high], CODE_TOKEN_OFFSET, high)
+        return scores
 
 
-def upload_to_firebase(audio_base64: str, user_id: str, text_preview: str) -> Dict[str, Any]:
+class SnacFrameLogitsProcessor(LogitsProcessor):
     """
-    Upload generated audio directly to Firebase Storage.
-    
-    Returns:
-        dict with success, url, filename, storage_path keys
+    Frame-position-aware sampler for SNAC audio tokens.
+    
+    After SOS every generated token must be a SNAC code, and slot k of each 7-token frame (the
+    layout unpack_snac_from_7 expects) may only use its own 4,096-code sub-range. Each step slices
+    the logits to that sub-range (plus CODE_END_TOKEN_ID on frame boundaries once min_new_tokens
+    have been generated), then applies repetition penalty, temperature, top-k and top-p to the
+    ~4k candidates instead of the full ~157k vocabulary. Returned scores are -inf everywhere except
+    the surviving candidates, so HF's own warpers must be disabled (see build_generate_kwargs).
     """
-    if not FIREBASE_AVAILABLE:
-        return {
-            "success": False,
-            "error": "Firebase Admin SDK not available"
-        }
     
-    firebase_app = init_firebase()
-    if firebase_app is None:
-        return {
-            "success": False,
-            "error": "Firebase not initialized"
-        }
+    def __init__(self, prompt_len: int, temperature: float = 0.6, top_p: float = 0.9, top_k: int = 50,
+                 repetition_penalty: float = 1.1, min_new_tokens: int = 28, repetition_window_frames: int = 0):
+        self.prompt_len = prompt_len
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.min_new_tokens = min_new_tokens
+        self.repetition = (
+            WindowedRepetitionPenaltyLogitsProcessor(prompt_len, repetition_penalty, repetition_window_frames)
+            if repetition_penalty != 1.0 else None
+        )
     
-    try:
-        # Decode base64 audio
-        audio_bytes = base64.b64decode(audio_base64)
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        num_generated = input_ids.shape[1] - self.prompt_len
+        slot = num_generated % SNAC_TOKENS_PER_FRAME
+        low = CODE_TOKEN_OFFSET + slot * SNAC_CODEBOOK_SIZE
+        eos_allowed = slot == 0 and num_generated >= self.min_new_tokens
         
-        # Generate filename
-        timestamp = int(datetime.now().timestamp() * 1000)
-        sanitized_text = "".join(c for c in text_preview[:30] if c.isalnum() or c == ' ').strip().replace(' ', '_')
-        filename = f"tts_{timestamp}_{sanitized_text}.wav"
+        candidates = scores[:, low:low + SNAC_CODEBOOK_SIZE].float()
+        if eos_allowed:
+            candidates = torch.cat([candidates, scores[:, CODE_END_TOKEN_ID:CODE_END_TOKEN_ID + 1].float()], dim=1)
+        else:
+            candidates = candidates.clone()
         
-        # Storage path
-        storage_path = f"users/{user_id}/tts/{filename}"
+        if self.repetition is not None:
+            self.repetition.update(input_ids)
+            self.repetition.penalize(candidates[:, :SNAC_CODEBOOK_SIZE], low, low + SNAC_CODEBOOK_SIZE)
+        candidates = candidates / self.temperature
         
-        # Upload to Firebase Storage
-        bucket = storage.bucket()
-        blob = bucket.blob(storage_path)
-        blob.upload_from_string(audio_bytes, content_type='audio/wav')
+        # Top-k then top-p over the candidates (topk returns them sorted, so top-p needs no full sort)
+        k = candidates.shape[1] if not self.top_k else min(self.top_k, candidates.shape[1])
+        values, indices = candidates.topk(k, dim=1)
+        if self.top_p < 1.0:
+            probs = torch.softmax(values, dim=1)
+            # Keep the smallest prefix whose mass reaches top_p (always at least the best token)
+            mass_before = probs.cumsum(dim=1) - probs
+            values = values.masked_fill(mass_before >= self.top_p, float('-inf'))
         
-        # Make publicly accessible
-        blob.make_public()
-        url = blob.public_url
+        # Map candidate indices back to vocabulary ids
+        token_ids = torch.where(indices < SNAC_CODEBOOK_SIZE, indices + low, CODE_END_TOKEN_ID)
+        processed = torch.full_like(scores, float('-inf'))
+        processed.scatter_(1, token_ids, values.to(scores.dtype))
+        return processed
+
+
+class SeededSamplingLogitsProcessor(LogitsProcessor):
+    """
+    Samples from the processed scores with a private generator (exponential race, equivalent to
+    drawing from their softmax) and returns scores whose argmax is that sample.
+    
+    Used with do_sample=False, so generation on a background thread never touches the global
+    RNG that SNAC decoder noise draws from on the caller's thread (see generate_audio_stream).
+    """
+    
+    def __init__(self, generator: torch.Generator):
+        self.generator = generator
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        race = torch.empty(scores.shape, dtype=torch.float32, device=scores.device)
+        race.exponential_(generator=self.generator)
+        return scores.float() - race.log()
+
+
+SPECULATIVE_MODES = ('off', 'ngram', 'draft')
+
+
+def parse_sampling_options(input_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Per-request sampling options from handler input (defaults from the environment)."""
+    speculative = input_data.get('speculative_decoding', SPECULATIVE_DECODING)
+    if isinstance(speculative, bool) or speculative is None:
+        speculative = 'ngram' if speculative else 'off'
+    speculative = str(speculative).lower()
+    if speculative not in SPECULATIVE_MODES:
+        raise ValueError(f"Unsupported speculative_decoding '{speculative}' (expected one of {', '.join(SPECULATIVE_MODES)})")
+    if speculative == 'draft' and not DRAFT_MODEL_NAME:
+        raise ValueError("speculative_decoding 'draft' requires the DRAFT_MODEL_NAME environment variable")
+    return {
+        "constrained": bool(input_data.get('constrained_sampling', SNAC_CONSTRAINED_SAMPLING)),
+        "repetition_window": max(0, int(input_data.get('repetition_penalty_window', REPETITION_PENALTY_WINDOW_FRAMES))),
+        "speculative": speculative,
+        "speculative_tokens": max(1, int(input_data.get('speculative_tokens', SPECULATIVE_TOKENS))),
+    }
+
+
+def build_generate_kwargs(temperature: float, max_new_tokens: int, prompt_len: Optional[int] = None,
+                          sampling: Optional[Dict[str, Any]] = None,
+                          generator: Optional[torch.Generator] = None) -> Dict[str, Any]:
+    """
+    Sampling parameters shared by every model.generate call (matching official Maya1 examples).
+    
+    With prompt_len (the padded prompt length) the repetition penalty is the windowed, incremental
+    one; with constrained sampling (default) temperature, top-k and top-p also run inside
+    SnacFrameLogitsProcessor. HF's versions of whatever we handle are switched off.
+    
+    With a generator (requires prompt_len) the whole pipeline runs as build_logits_processors and
+    the token is drawn by SeededSamplingLogitsProcessor instead of HF's global-RNG multinomial.
+    """
+    sampling = sampling if sampling is not None else parse_sampling_options({})
+    generate_kwargs = dict(
+        max_new_tokens=max_new_tokens,
+        min_new_tokens=28,  # At least 4 SNAC frames (7 tokens each)
+        temperature=temperature,
+        top_p=0.9,  # Nucleus sampling (conservative, consistent)
+        repetition_penalty=1.1,  # Prevent repetition loops (consistent quality)
+        do_sample=True,
+        eos_token_id=CODE_END_TOKEN_ID,  # Stop at end of speech token
+        pad_token_id=tokenizer.pad_token_id if tokenizer.pad_token_id else tokenizer.eos_token_id,
+    )
+    if prompt_len is None:
+        return generate_kwargs
+    if generator is not None:
+        generate_kwargs.update(
+            temperature=None,
+            top_p=None,
+            top_k=None,
+            repetition_penalty=1.0,
+            do_sample=False,  # The argmax of SeededSamplingLogitsProcessor's scores is the sample
+            logits_processor=LogitsProcessorList([
+                *build_logits_processors(prompt_len, temperature, generator.device, sampling),
+                SeededSamplingLogitsProcessor(generator),
+            ]),
+        )
+    elif sampling["constrained"]:
+        generate_kwargs.update(
+            temperature=1.0,
+            top_p=1.0,
+            top_k=0,
+            repetition_penalty=1.0,
+            logits_processor=LogitsProcessorList([
+                SnacFrameLogitsProcessor(prompt_len, temperature=temperature, top_p=0.9, top_k=50,
+                                         repetition_penalty=1.1, min_new_tokens=28,
+                                         repetition_window_frames=sampling["repetition_window"])
+            ]),
+        )
+    else:
+        # Custom processors run before HF's temperature/top-k/top-p warpers, as the stock penalty does
+        generate_kwargs.update(
+            repetition_penalty=1.0,
+            logits_processor=LogitsProcessorList([
+                WindowedRepetitionPenaltyLogitsProcessor(prompt_len, 1.1, sampling["repetition_window"])
+            ]),
+        )
+    return generate_kwargs
+
+
+LENGTH_FEATURES = [
+    "bias", "words", "chars", "emotion_tags", "pauses", "sentences", "slow_words", "fast_words",
+]
+SLOW_PACING = re.compile(r'\b(slow|slowly|measured|deliberate|unhurried|languid|drawn[- ]out)\b')
+FAST_PACING = re.compile(r'\b(fast|quick|quickly|rapid|rapidly|brisk|hurried|energetic)\b')
+
+
+def length_features(text: str, voice_description: str) -> List[float]:
+    """Features (in LENGTH_FEATURES order) that drive how many SNAC tokens a text becomes."""
+    tags = re.findall(r'<[a-z_]+>', text.lower())
+    spoken = re.sub(r'<[a-z_]+>', ' ', text.lower())
+    words = len(spoken.split())
+    description = voice_description.lower()
+    return [
+        1.0,
+        float(words),
+        float(len(spoken.replace(' ', ''))),
+        float(len(tags)),
+        float(len(re.findall(r'[,;:]|\.\.\.|--|\u2014', spoken))),
+        float(len(re.findall(r'[.!?]+', spoken))),
+        float(words if SLOW_PACING.search(description) else 0),
+        float(words if FAST_PACING.search(description) else 0),
+    ]
+
+
+class LengthPredictor:
+    """
+    Ridge regression from text features to the number of tokens generated up to EOS.
+    
+    Observations come from every generation that ended with EOS and are kept (bounded, newest
+    last) in a JSON file so the model survives worker restarts. Generations cut off before EOS
+    are kept as lower bounds: the fit only sees one where it predicts less than the bound, and
+    then targets the bound, so long outputs pull predictions up instead of being dropped. Until
+    min_observations exist, budget() returns the caller's fallback cap. Budgets are the prediction
+    scaled by `margin`, or three residual RMSEs above it if that is larger, rounded up to whole frames.
+    """
+    
+    def __init__(self, path: Optional[str], margin: float = 1.3, min_observations: int = 50,
+                 max_observations: int = 5000, save_every: int = 10, ridge: float = 1.0):
+        self.path = path
+        self.margin = margin
+        self.min_observations = min_observations
+        self.max_observations = max_observations
+        self.save_every = save_every
+        self.ridge = ridge
+        self.observations = []  # [features..., tokens]
+        self.lower_bounds = []  # [features..., tokens generated before the cutoff]
+        self.weights = None
+        self.rmse = 0.0
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._load()
+    
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("features") != LENGTH_FEATURES:
+                logger.warning("Ignoring length observations in %s (feature set changed)", self.path)
+                return
+            self.observations = data["observations"][-self.max_observations:]
+            self.lower_bounds = data.get("lower_bounds", [])[-self.max_observations:]
+            self._fit()
+            logger.info("Length predictor: loaded %d observations from %s", len(self.observations), self.path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Failed to load length observations from %s: %s", self.path, e)
+    
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            data = {"features": LENGTH_FEATURES, "observations": list(self.observations),
+                    "lower_bounds": list(self.lower_bounds)}
+            self._unsaved = 0
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Failed to save length observations: %s", e)
+    
+    def _fit(self) -> None:
+        if len(self.observations) < self.min_observations:
+            self.weights = None
+            return
+        data = np.asarray(self.observations, dtype=np.float64)
+        features, tokens = data[:, :-1], data[:, -1]
+        regularizer = self.ridge * np.eye(features.shape[1])
+        regularizer[0, 0] = 0.0  # Don't shrink the intercept
+        self.weights = np.linalg.solve(features.T @ features + regularizer, features.T @ tokens)
+        self.rmse = float(np.sqrt(np.mean((features @ self.weights - tokens) ** 2)))
+        if self.lower_bounds:
+            # Refit once with the lower bounds the fit undershoots, each at its bound
+            bounds = np.asarray(self.lower_bounds, dtype=np.float64)
+            violated = bounds[bounds[:, :-1] @ self.weights < bounds[:, -1]]
+            if len(violated):
+                features = np.concatenate([features, violated[:, :-1]])
+                tokens = np.concatenate([tokens, violated[:, -1]])
+                self.weights = np.linalg.solve(features.T @ features + regularizer, features.T @ tokens)
+    
+    def observe(self, text: str, voice_description: str, num_tokens: int, lower_bound: bool = False) -> None:
+        """Record a finished generation (tokens up to and including EOS), or a cut-off one as a lower bound."""
+        with self._lock:
+            rows = self.lower_bounds if lower_bound else self.observations
+            rows.append(length_features(text, voice_description) + [float(num_tokens)])
+            del rows[:-self.max_observations]
+            self._fit()
+            self._unsaved += 1
+            save = self._unsaved >= self.save_every
+        if save:
+            self.save()
+    
+    def predict(self, text: str, voice_description: str) -> Optional[float]:
+        """Expected token count, or None while there are too few observations."""
+        with self._lock:
+            if self.weights is None:
+                return None
+            return float(np.dot(self.weights, length_features(text, voice_description)))
+    
+    def budget(self, text: str, voice_description: str, fallback: int) -> int:
+        """Token budget for a text: prediction plus safety margin, capped at `fallback`."""
+        predicted = self.predict(text, voice_description)
+        if predicted is None:
+            return fallback
+        budget = max(predicted * self.margin, predicted + 3 * self.rmse, 4 * SNAC_TOKENS_PER_FRAME)
+        frames = int(np.ceil(budget / SNAC_TOKENS_PER_FRAME)) + 1  # +1: room for the EOS token
+        return min(fallback, frames * SNAC_TOKENS_PER_FRAME)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"observations": len(self.observations), "lower_bounds": len(self.lower_bounds),
+                    "fitted": self.weights is not None, "rmse": round(self.rmse, 1)}
+
+
+length_predictor = LengthPredictor(
+    LENGTH_PREDICTOR_PATH, LENGTH_PREDICTOR_MARGIN, LENGTH_PREDICTOR_MIN_OBSERVATIONS
+) if LENGTH_PREDICTOR_ENABLED else None
+
+
+def record_generation_length(text: str, voice_description: str, generated_tokens) -> None:
+    """Feed a finished generation to the length predictor; outputs cut off before EOS count as lower bounds."""
+    if length_predictor is None:
+        return
+    generated_tokens = torch.as_tensor(generated_tokens)
+    eos_positions = (generated_tokens == CODE_END_TOKEN_ID).nonzero()
+    if eos_positions.numel():
+        length_predictor.observe(text, voice_description, int(eos_positions[0, 0]) + 1)
+    elif generated_tokens.numel():
+        length_predictor.observe(text, voice_description, generated_tokens.numel(), lower_bound=True)
+
+
+def resolve_token_cap(text: str, max_new_tokens: int = 2000) -> int:
+    """
+    Hard token limit for a piece of text: for the default (2000) the fixed cap, 4000 up to 200
+    words and 6000 above; explicit values are kept. A predicted budget that runs out before EOS
+    is extended up to this limit (extend_truncated_generation).
+    """
+    if max_new_tokens == 2000:
+        return 4000 if len(text.split()) <= 200 else 6000
+    return max_new_tokens
+
+
+def resolve_max_new_tokens(text: str, max_new_tokens: int = 2000, voice_description: str = '') -> int:
+    """
+    Resolve the token budget for a piece of text.
+    
+    The default value (2000) is replaced by the length predictor's budget once it has learned
+    enough, otherwise by a fixed generous cap; explicit values are kept.
+    """
+    # Without a trained predictor use a fixed generous cap (no word-count guessing):
+    # text length → audio length → SNAC token count is not linear, so we rely on EOS for completion
+    if max_new_tokens == 2000:  # Default value - replace with predicted budget or fixed cap
+        words = len(text.split())
+        cap = resolve_token_cap(text, max_new_tokens)
+        max_new_tokens = length_predictor.budget(text, voice_description, cap) if length_predictor else cap
+        log_debug("Using max_new_tokens: %d for %d words (%s)", max_new_tokens, words,
+                  "predicted" if max_new_tokens != cap else "fixed cap, relying on EOS for completion")
+    
+    return max_new_tokens
+
+
+def is_out_of_memory(error: BaseException) -> bool:
+    """True for CUDA OOMs and failed CPU allocations, the errors worth retrying with less work."""
+    if isinstance(error, MemoryError) or isinstance(error, getattr(torch.cuda, 'OutOfMemoryError', ())):
+        return True
+    message = str(error).lower()
+    return isinstance(error, RuntimeError) and ('out of memory' in message or "can't allocate memory" in message)
+
+
+def release_memory(device: torch.device, collect: bool = False) -> None:
+    """Hand cached allocator blocks back to the device (after an OOM, collect garbage first)."""
+    if collect:
+        gc.collect()
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
+
+
+def snac_decode_bytes_per_sample() -> int:
+    """
+    Peak SNAC decode activation memory per output sample: the last decoder stage runs
+    decoder_dim / 2**len(decoder_rates) fp32 channels at the output rate and keeps about
+    four such activations alive (~1.5 KB/sample for the 24 kHz model).
+    """
+    channels = getattr(snac_decoder, 'decoder_dim', 1536) // 2 ** len(getattr(snac_decoder, 'decoder_rates', [8] * 4))
+    return 4 * 4 * max(1, channels)
+
+
+def estimate_generation_bytes(prompt_len: int, max_new_tokens: int) -> int:
+    """Memory one sequence needs to generate and decode: KV cache, per-step logits and SNAC decode."""
+    config = model.config
+    num_heads = config.num_attention_heads
+    head_dim = getattr(config, 'head_dim', None) or config.hidden_size // num_heads
+    kv_heads = getattr(config, 'num_key_value_heads', None) or num_heads
+    dtype_bytes = torch.finfo(model.dtype).bits // 8 if model.dtype.is_floating_point else 2
+    kv_cache = 2 * config.num_hidden_layers * kv_heads * head_dim * (prompt_len + max_new_tokens) * dtype_bytes
+    logits = 3 * 4 * config.vocab_size  # fp32 logits, processed scores and probabilities of one step
+    samples = (max_new_tokens // SNAC_TOKENS_PER_FRAME) * SNAC_SAMPLES_PER_FRAME
+    return kv_cache + logits + samples * snac_decode_bytes_per_sample()
+
+
+class MemoryGovernor:
+    """
+    Admission control for generation memory across concurrent jobs.
+    
+    Work reserves its estimate (estimate_generation_bytes per sequence) while it runs and waits
+    while other jobs' reservations leave too little of the budget. Work larger than the whole
+    budget still runs once nothing else does; if it then OOMs, the callers retry it smaller.
+    budget_bytes=None means unlimited (admission and batch sizing are no-ops).
+    """
+    
+    def __init__(self, budget_bytes: Optional[int]):
+        self.budget_bytes = budget_bytes
+        self.reserved = 0
+        self.waits = 0
+        self.oom_retries = 0
+        self._condition = threading.Condition()
+    
+    def max_sequences(self, per_sequence_bytes: int, requested: int) -> int:
+        """How many of `requested` sequences fit in the currently unreserved budget (at least 1)."""
+        if self.budget_bytes is None:
+            return requested
+        with self._condition:
+            available = self.budget_bytes - self.reserved
+        return max(1, min(requested, available // max(1, per_sequence_bytes)))
+    
+    def acquire(self, num_bytes: int, block: bool = True, force: bool = False) -> bool:
+        """
+        Reserve num_bytes until release(). Without block, returns False instead of waiting when it
+        doesn't fit; force reserves regardless (growth of work that is already running).
+        """
+        with self._condition:
+            if (not force and self.budget_bytes is not None and self.reserved
+                    and self.reserved + num_bytes > self.budget_bytes):
+                if not block:
+                    return False
+                self.waits += 1
+                while self.reserved and self.reserved + num_bytes > self.budget_bytes:
+                    self._condition.wait()
+            self.reserved += num_bytes
+        return True
+    
+    def release(self, num_bytes: int) -> None:
+        with self._condition:
+            self.reserved -= num_bytes
+            self._condition.notify_all()
+    
+    @contextmanager
+    def reserve(self, num_bytes: int):
+        self.acquire(num_bytes)
+        try:
+            yield
+        finally:
+            self.release(num_bytes)
+    
+    def stats(self) -> Dict[str, Any]:
+        mb = 1024 * 1024
+        return {
+            "budget_mb": round(self.budget_bytes / mb, 1) if self.budget_bytes is not None else None,
+            "reserved_mb": round(self.reserved / mb, 1),
+            "waits": self.waits,
+            "oom_retries": self.oom_retries,
+        }
+
+
+def get_memory_governor() -> MemoryGovernor:
+    """The process-wide governor, budgeted on first use (after the model is loaded)."""
+    global memory_governor
+    
+    if memory_governor is None:
+        device = next(model.parameters()).device
+        if MEMORY_BUDGET_MB > 0:
+            budget = int(MEMORY_BUDGET_MB * 1024 * 1024)
+        elif device.type == 'cuda':
+            total = torch.cuda.get_device_properties(device).total_memory
+            budget = max(0, int(total * MEMORY_BUDGET_FRACTION) - torch.cuda.memory_allocated(device))
+        else:
+            budget = None
+        memory_governor = MemoryGovernor(budget)
+        logger.info("Memory governor: %s", memory_governor.stats())
+    return memory_governor
+
+
+def split_text_in_half(text: str) -> Optional[List[str]]:
+    """Split a chunk at the sentence (else word) boundary nearest its middle; None if it can't shrink."""
+    words = text.split()
+    if len(words) < 2:
+        return None
+    middle = len(text) // 2
+    boundaries = [m.end() for m in re.finditer(r'[.!?;:,]\s+', text)]
+    if boundaries:
+        cut = min(boundaries, key=lambda position: abs(position - middle))
+        if 0 < cut < len(text.rstrip()):
+            return [text[:cut].strip(), text[cut:].strip()]
+    half = len(words) // 2
+    return [' '.join(words[:half]), ' '.join(words[half:])]
+
+
+def log_prompt_diagnostics(text: str, prompt: str, input_ids: torch.Tensor) -> None:
+    """
+    Debug-only prompt checks: emotion tags found in the text, whether they survive tokenization
+    and how many tokens each one becomes. Decodes the whole prompt, so never run it per request
+    in production (callers gate on debug_enabled()).
+    """
+    log_debug("Input text received: %.100s...", text)
+    log_debug("Text length: %d chars, %d words", len(text), len(text.split()))
+    
+    # Check if emotion tags are present
+    emotion_tags = re.findall(r'<[a-z_]+>', text.lower())
+    if emotion_tags:
+        log_debug("Found emotion tags in input: %s", set(emotion_tags))
+    else:
+        log_debug("No emotion tags found in input text")
+    
+    log_debug("Prompt length: %d chars, %d tokens", len(prompt), input_ids.shape[1])
+    
+    # Verify tags are preserved after tokenization AND check how they're tokenized
+    input_text_decoded = tokenizer.decode(input_ids[0].tolist(), skip_special_tokens=False).lower()
+    for tag in set(emotion_tags):
+        if tag not in input_text_decoded:
+            tag_pos = text.lower().find(tag)
+            logger.warning("Emotion tag '%s' may have been lost/modified during tokenization! Original text snippet: %s",
+                           tag, text[max(0, tag_pos - 20):tag_pos + len(tag) + 20])
+            continue
+        
+        # CRITICAL: Check if tag is tokenized as single token or split
+        tag_tokens = tokenizer.encode(tag, add_special_tokens=False)
+        log_debug("Tag '%s' preserved, tokenizes to %d token(s): %s", tag, len(tag_tokens), tag_tokens)
+        if len(tag_tokens) > 3:
+            logger.warning("Tag '%s' is split into %d tokens - might cause issues! Tokens: %s",
+                           tag, len(tag_tokens), [tokenizer.decode([t]) for t in tag_tokens])
+
+
+def log_generation_diagnostics(generated_tokens: torch.Tensor, max_new_tokens: int) -> None:
+    """Debug-only token usage and EOS position report for one generated sequence."""
+    num_generated = generated_tokens.shape[0]
+    eos_positions = (generated_tokens == CODE_END_TOKEN_ID).nonzero().flatten().tolist()
+    token_usage_pct = (num_generated / max_new_tokens) * 100 if max_new_tokens > 0 else 0
+    
+    log_debug("Generated %d tokens (max allowed: %d), token usage: %.1f%%",
+              num_generated, max_new_tokens, token_usage_pct)
+    
+    # Check for EOS token - log ALL positions
+    if eos_positions:
+        log_debug("Found %d EOS token(s) at positions: %s", len(eos_positions), eos_positions)
+        if len(eos_positions) > 1:
+            logger.warning("Multiple EOS tokens found! Using LAST one at position %d", eos_positions[-1])
+    else:
+        log_debug("No EOS token found in generated tokens (length: %d)", num_generated)
+        if num_generated < max_new_tokens:
+            log_debug("Generation stopped early without EOS - may indicate model completion or other issue")
+    
+    # SUMMARY: Model behavior vs limit
+    if num_generated < max_new_tokens * 0.8:  # Used less than 80% of limit
+        log_debug("Model stopped naturally: used %d/%d tokens - model behavior, not a token limit issue",
+                  num_generated, max_new_tokens)
+
+
+def extend_truncated_generation(sequence_ids: torch.Tensor, prompt_len: int, temperature: float,
+                                token_cap: int, sampling: Optional[Dict[str, Any]] = None,
+                                streamer: Optional[BaseStreamer] = None,
+                                generator: Optional[torch.Generator] = None) -> torch.Tensor:
+    """
+    Continue a sequence whose (predicted) token budget ran out before EOS, up to token_cap new
+    tokens in all; returns the additional ids (1-D).
+    
+    sequence_ids is [1, prompt + generated] without padding. The processors keep counting from
+    the original prompt_len, so frame slots and the repetition window carry on where they were.
+    """
+    generated = sequence_ids.shape[1] - prompt_len
+    generate_kwargs = build_generate_kwargs(temperature, token_cap - generated, prompt_len, sampling, generator)
+    generate_kwargs['min_new_tokens'] = 0  # Counted from the original prompt, so already satisfied
+    with get_memory_governor().reserve(estimate_generation_bytes(prompt_len, token_cap)), torch.no_grad():
+        outputs = model.generate(sequence_ids, attention_mask=torch.ones_like(sequence_ids), streamer=streamer,
+                                 **generate_kwargs)
+    return outputs[0, sequence_ids.shape[1]:]
+
+
+def is_truncated(generated_tokens: torch.Tensor, max_new_tokens: int) -> bool:
+    """True when generation used its whole budget without emitting EOS."""
+    return generated_tokens.shape[0] >= max_new_tokens and not (generated_tokens == CODE_END_TOKEN_ID).any()
+
+
+def generate_audio(text: str, voice_description: str, temperature: float = 0.6, max_new_tokens: int = 2000,
+                   sampling: Optional[Dict[str, Any]] = None, token_cap: Optional[int] = None) -> tuple:
+    """
+    Generate audio from text and voice description.
+    
+    With sampling["speculative"] set, tokens come from speculative_generate instead of
+    model.generate (counters go to the request's SpeculationStats, if one is active).
+    
+    A predicted budget that runs out before EOS is extended up to token_cap (default:
+    resolve_token_cap of max_new_tokens), so an under-prediction costs time, not audio.
+    
+    Returns:
+        tuple: (audio_array, sampling_rate)
+    """
+    global model, tokenizer, snac_decoder
+    
+    if model is None or tokenizer is None:
+        load_model()
+    
+    token_cap = token_cap or resolve_token_cap(text, max_new_tokens)
+    max_new_tokens = resolve_max_new_tokens(text, max_new_tokens, voice_description)
+    
+    # Build prompt
+    prompt = build_prompt(voice_description, text)
+    
+    # Tokenize input (match official example format)
+    # IMPORTANT: Don't use add_special_tokens=False - we want the tokenizer to handle tags properly
+    inputs = tokenizer(prompt, return_tensors='pt')
+    
+    if debug_enabled():
+        log_prompt_diagnostics(text, prompt, inputs['input_ids'])
+    
+    # Get device from model (ensures consistency)
+    device = next(model.parameters()).device
+    input_ids = inputs['input_ids'].to(device)
+    
+    # Ensure SNAC decoder is on same device (safety check)
+    ensure_snac_on_device(device)
+    
+    log_debug("Input token count: %d tokens, max new tokens: %d", input_ids.shape[1], max_new_tokens)
+    
+    speculative = sampling is not None and sampling.get("speculative", 'off') != 'off'
+    
+    # Generate tokens with parameters matching official Maya1 examples
+    new_buckets = len(static_caches)
+    reservation = get_memory_governor().reserve(estimate_generation_bytes(input_ids.shape[1], max_new_tokens))
+    generate_start = time.perf_counter()
+    if speculative:
+        stats = _request_speculation.get() or SpeculationStats(sampling["speculative"])
+        with reservation, torch.no_grad():
+            generated_tokens = speculative_generate(input_ids, voice_description, temperature, max_new_tokens,
+                                                    sampling, stats)
+        generate_seconds = time.perf_counter() - generate_start
+        stats.seconds += generate_seconds
+        log_debug("Speculative decoding: %s", stats.summary())
+    else:
+        with reservation, torch.no_grad():
+            outputs = model.generate(
+                input_ids,
+                past_key_values=initial_past_key_values(voice_description, input_ids, max_new_tokens),
+                **build_generate_kwargs(temperature, max_new_tokens, input_ids.shape[1], sampling)
+            )
+        generate_seconds = time.perf_counter() - generate_start
+        # Extract generated tokens (remove input tokens) - stays on device, no .tolist() round trip
+        generated_tokens = outputs[0, input_ids.shape[1]:]
+    if compiled_engine and len(static_caches) != new_buckets:
+        save_compile_artifacts()
+    log_debug("Prefix cache: %s", prefix_cache.stats())
+    
+    if is_truncated(generated_tokens, max_new_tokens) and max_new_tokens < token_cap:
+        logger.warning("Predicted budget of %d tokens ran out before EOS, continuing up to %d",
+                       max_new_tokens, token_cap)
+        sequence_ids = torch.cat([input_ids[0], generated_tokens])[None]
+        generated_tokens = torch.cat([
+            generated_tokens,
+            extend_truncated_generation(sequence_ids, input_ids.shape[1], temperature, token_cap, sampling),
+        ])
+        max_new_tokens = token_cap
+    
+    log_debug("Generation took %.2fs (%.1f ms/token, engine=%s)", generate_seconds,
+              1000 * generate_seconds / max(1, generated_tokens.shape[0]),
+              f"speculative-{sampling['speculative']}" if speculative else 'compiled' if compiled_engine else 'eager')
+    
+    if debug_enabled():
+        log_generation_diagnostics(generated_tokens, max_new_tokens)
+    
+    # Detect truncation: generate stops on EOS, so a full budget not ending in EOS was cut off
+    if is_truncated(generated_tokens, max_new_tokens):
+        logger.warning("Generation hit max_new_tokens (%d) without EOS token - audio WILL be truncated!",
+                       max_new_tokens)
+    
+    record_generation_length(text, voice_description, generated_tokens)
+    
+    # Extract SNAC codes (MUST use last EOS, not first)
+    snac_codes = extract_snac_codes(generated_tokens)
+    
+    if snac_codes.numel() == 0:
+        raise ValueError("No SNAC codes generated. Model may not have produced valid audio tokens.")
+    
+    log_debug("Extracted %d SNAC codes (%d complete frames, %d remainder tokens)",
+              snac_codes.numel(), snac_codes.numel() // SNAC_TOKENS_PER_FRAME,
+              snac_codes.numel() % SNAC_TOKENS_PER_FRAME)
+    
+    audio_array = decode_snac_codes(snac_codes, device)
+    sampling_rate = SAMPLING_RATE  # Maya1 uses 24kHz
+    
+    return audio_array, sampling_rate
+
+
+def generate_audio_batch(texts: List[str], voice_description: str, temperature: float = 0.6,
+                         max_new_tokens: int = 2000, batch_size: int = DEFAULT_CHUNK_BATCH_SIZE,
+                         sampling: Optional[Dict[str, Any]] = None, pipeline_decode: bool = True,
+                         assembler: Optional['AudioAssembler'] = None) -> tuple:
+    """
+    Generate audio for several texts (e.g. chunks of one long script) with batched decoding.
+    
+    Prompts are left-padded and up to `batch_size` of them share one model.generate call,
+    so wall-clock per batch is roughly the cost of its longest sequence. Each row gets its
+    own EOS handling via extract_snac_codes and is decoded by SNAC separately.
+    
+    With pipeline_decode, SNAC decoding (and the copy to CPU) of one batch runs on a decoder
+    thread while the next batch generates; results are joined in input order. Seeded requests
+    turn it off: SNAC's noise blocks and sampling would draw from the global RNG concurrently.
+    
+    With an assembler, chunk audio is appended to it in order as soon as it is decoded instead
+    of being returned (the returned list is then empty).
+    
+    Batches are trimmed to what the memory governor has room for. On an out-of-memory error
+    the batch is retried at half the size; a single chunk that still doesn't fit is split in
+    two at a sentence boundary and its halves are generated and joined in its place.
+    
+    Returns:
+        tuple: (list of audio_arrays in input order, sampling_rate)
+    """
+    global model, tokenizer, snac_decoder
+    
+    if model is None or tokenizer is None:
+        load_model()
+    
+    if not texts:
+        raise ValueError("No texts to generate")
+    
+    batch_size = max(1, int(batch_size))
+    device = next(model.parameters()).device
+    ensure_snac_on_device(device)
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id else tokenizer.eos_token_id
+    sampling_rate = SAMPLING_RATE  # Maya1 uses 24kHz
+    
+    governor = get_memory_governor()
+    decoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='snac-decode') if pipeline_decode else None
+    decoded = []  # Audio arrays, or decode futures when pipelined
+    try:
+        start = 0
+        while start < len(texts):
+            batch_texts = texts[start:start + batch_size]
+            batch_max_new_tokens = max(resolve_max_new_tokens(t, max_new_tokens, voice_description) for t in batch_texts)
+            
+            # Tokenize each prompt separately and left-pad so every row ends at the SOS token
+            prompt_ids = [
+                tokenizer(build_prompt(voice_description, t), return_tensors='pt')['input_ids'][0]
+                for t in batch_texts
+            ]
+            
+            # Shrink the batch to what the memory budget has room for right now
+            sequence_bytes = estimate_generation_bytes(max(len(ids) for ids in prompt_ids), batch_max_new_tokens)
+            fits = governor.max_sequences(sequence_bytes, len(batch_texts))
+            if fits < len(batch_texts):
+                log_debug("Memory budget fits %d of %d chunks (%.0f MB each)", fits, len(batch_texts),
+                          sequence_bytes / 1024 / 1024)
+                batch_texts, prompt_ids = batch_texts[:fits], prompt_ids[:fits]
+            
+            input_len = max(len(ids) for ids in prompt_ids)
+            input_ids = torch.full((len(prompt_ids), input_len), pad_token_id, dtype=torch.long)
+            attention_mask = torch.zeros((len(prompt_ids), input_len), dtype=torch.long)
+            for row, ids in enumerate(prompt_ids):
+                input_ids[row, input_len - len(ids):] = ids
+                attention_mask[row, input_len - len(ids):] = 1
+            
+            logger.info("Batched generation for chunks %d-%d/%d (input_len=%d, max_new_tokens=%d)",
+                        start + 1, start + len(batch_texts), len(texts), input_len, batch_max_new_tokens)
+            
+            new_buckets = len(static_caches)
+            try:
+                with governor.reserve(sequence_bytes * len(batch_texts)), torch.no_grad():
+                    outputs = model.generate(
+                        input_ids.to(device),
+                        attention_mask=attention_mask.to(device),
+                        past_key_values=(
+                            get_static_cache(len(prompt_ids), input_len + batch_max_new_tokens) if compiled_engine else None
+                        ),
+                        **build_generate_kwargs(temperature, batch_max_new_tokens, input_len, sampling)
+                    )
+            except Exception as e:
+                if not is_out_of_memory(e):
+                    raise
+                governor.oom_retries += 1
+                release_memory(device, collect=True)
+                if len(batch_texts) > 1:
+                    # Retry these chunks, and the rest of the request, at half the batch size
+                    batch_size = len(batch_texts) // 2
+                    logger.warning("Out of memory generating %d chunks, retrying with batch size %d",
+                                   len(batch_texts), batch_size)
+                    continue
+                halves = split_text_in_half(batch_texts[0])
+                if halves is None:
+                    raise
+                logger.warning("Out of memory generating chunk %d/%d, splitting it in two", start + 1, len(texts))
+                split_audio, _ = generate_audio_batch(halves, voice_description, temperature, max_new_tokens,
+                                                      batch_size=1, sampling=sampling, pipeline_decode=False)
+                audio = concatenate_audio_arrays(split_audio, sampling_rate)
+                if decoder:
+                    future = Future()
+                    future.set_result(audio)
+                    audio = future
+                decoded.append(audio)
+                start += 1
+                continue
+            if compiled_engine and len(static_caches) != new_buckets:
+                save_compile_artifacts()
+            
+            generated = outputs[:, input_len:]
+            for row in range(generated.shape[0]):
+                row_tokens = generated[row]
+                token_cap = resolve_token_cap(batch_texts[row], max_new_tokens)
+                if is_truncated(row_tokens, batch_max_new_tokens) and batch_max_new_tokens < token_cap:
+                    # Under-predicted budget: continue this row alone (without its left padding)
+                    logger.warning("Predicted budget of %d tokens ran out before EOS for chunk %d, continuing up to %d",
+                                   batch_max_new_tokens, start + row + 1, token_cap)
+                    prompt = prompt_ids[row].to(device)
+                    row_tokens = torch.cat([row_tokens, extend_truncated_generation(
+                        torch.cat([prompt, row_tokens])[None], len(prompt), temperature, token_cap, sampling
+                    )])
+                record_generation_length(batch_texts[row], voice_description, row_tokens)
+                # Finished rows are padded after their EOS; extract_snac_codes cuts at the last EOS
+                snac_codes = extract_snac_codes(row_tokens)
+                if snac_codes.numel() == 0:
+                    raise ValueError(f"No SNAC codes generated for chunk {start + row + 1}. "
+                                     "Model may not have produced valid audio tokens.")
+                if decoder:
+                    decoded.append(submit_snac_decode(decoder, snac_codes, device))
+                else:
+                    decoded.append(decode_snac_codes(snac_codes, device))
+            
+            # Hand finished chunks over in order so they aren't all held until the end
+            while assembler is not None and decoded and (not decoder or decoded[0].done()):
+                audio = decoded.pop(0)
+                assembler.append(audio.result() if decoder else audio)
+            
+            start += len(batch_texts)
+            if MEMORY_RELEASE_BETWEEN_STAGES:
+                release_memory(device)
+        
+        audio_arrays = [audio.result() if decoder else audio for audio in decoded]
+        if assembler is not None:
+            for audio in audio_arrays:
+                assembler.append(audio)
+            audio_arrays = []
+    finally:
+        if decoder:
+            decoder.shutdown(wait=True, cancel_futures=True)
+    
+    return audio_arrays, sampling_rate
+
+
+def build_logits_processors(prompt_len: int, temperature: float, device: torch.device,
+                            sampling: Optional[Dict[str, Any]] = None) -> LogitsProcessorList:
+    """
+    Per-sequence sampling pipeline for hand-written decode loops.
+    
+    Mirrors build_generate_kwargs: min 28 new tokens, windowed repetition penalty 1.1, temperature,
+    top-k 50 (HF's default) and top-p 0.9, either SNAC-constrained or over the full vocabulary.
+    """
+    sampling = sampling if sampling is not None else parse_sampling_options({})
+    if sampling["constrained"]:
+        return LogitsProcessorList([
+            SnacFrameLogitsProcessor(prompt_len, temperature=temperature, top_p=0.9, top_k=50,
+                                     repetition_penalty=1.1, min_new_tokens=28,
+                                     repetition_window_frames=sampling["repetition_window"])
+        ])
+    return LogitsProcessorList([
+        MinNewTokensLengthLogitsProcessor(prompt_len, 28, CODE_END_TOKEN_ID, device=device),
+        WindowedRepetitionPenaltyLogitsProcessor(prompt_len, 1.1, sampling["repetition_window"]),
+        TemperatureLogitsWarper(temperature),
+        TopKLogitsWarper(50),
+        TopPLogitsWarper(0.9),
+    ])
+
+
+class SpeculationStats:
+    """
+    Speculative decoding counters for one request (summed over its chunks).
+    
+    estimated_speedup compares the request's time per token with its own mean verification pass,
+    which stands in for a plain decode step (verifying a draft costs at least one step, so the
+    estimate errs low). It is measured on this request, but not against a separate plain run.
+    """
+    
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.proposed = 0  # Draft tokens sent for verification
+        self.accepted = 0  # Draft tokens kept
+        self.forward_passes = 0  # Maya1 decode steps (each verifies a whole draft)
+        self.forward_seconds = 0.0  # Time spent in those steps
+        self.tokens = 0  # Tokens generated
+        self.seconds = 0.0
+    
+    def summary(self) -> Dict[str, Any]:
+        ms_per_token = 1000 * self.seconds / self.tokens if self.tokens else None
+        ms_per_step = 1000 * self.forward_seconds / self.forward_passes if self.forward_passes else None
+        return {
+            "mode": self.mode,
+            "draft_tokens": self.proposed,
+            "accepted_tokens": self.accepted,
+            "acceptance_rate": round(self.accepted / self.proposed, 3) if self.proposed else 0.0,
+            "tokens_per_forward": round(self.tokens / self.forward_passes, 2) if self.forward_passes else 0.0,
+            "ms_per_token": round(ms_per_token, 2) if ms_per_token else None,
+            "estimated_speedup": round(ms_per_step / ms_per_token, 2) if ms_per_token and ms_per_step else None,
+        }
+
+
+class NgramDrafter:
+    """
+    Draft-free speculation by lookup: when the last `ngram` generated tokens occurred earlier in
+    the output, propose the tokens that followed that occurrence. SNAC codes encode their frame
+    slot, so a match is always frame-aligned; this pays off on sustained sounds and silences.
+    The index maps each n-gram to the position after its latest occurrence and grows by one
+    entry per accepted token.
+    """
+    
+    def __init__(self, ngram: int = SPECULATIVE_NGRAM):
+        self.ngram = max(1, ngram)
+        self.tokens = []
+        self.index = {}
+    
+    def extend(self, tokens: List[int]) -> None:
+        for token in tokens:
+            self.tokens.append(token)
+            position = len(self.tokens) - 1
+            if position >= self.ngram:
+                self.index[tuple(self.tokens[position - self.ngram:position])] = position
+    
+    def propose(self, num_tokens: int, generator: Optional[torch.Generator] = None) -> tuple:
+        """(draft tokens, None): proposals are deterministic, i.e. a point-mass draft distribution."""
+        if num_tokens <= 0 or len(self.tokens) < self.ngram:
+            return [], None
+        position = self.index.get(tuple(self.tokens[-self.ngram:]))
+        if position is None:
+            return [], None
+        return self.tokens[position:position + num_tokens], None
+
+
+class DraftModelDrafter:
+    """
+    Speculation with a small causal LM sharing Maya1's tokenizer (e.g. distilled on SNAC streams).
+    
+    The draft samples autoregressively with the SNAC frame-slot constraint, temperature, top-k and
+    top-p but no repetition penalty (any draft distribution keeps verification exact, and this one
+    needs no per-sequence state). Its KV cache is cropped back to the accepted tokens lazily, on
+    the next proposal.
+    """
+    
+    def __init__(self, draft: torch.nn.Module, input_ids: torch.Tensor, temperature: float):
+        self.model = draft
+        self.ids = input_ids
+        self.processor = SnacFrameLogitsProcessor(input_ids.shape[1], temperature=temperature, top_p=0.9, top_k=50,
+                                                  repetition_penalty=1.0, min_new_tokens=28)
+        self.cache = DynamicCache()
+        self.cache_tokens = []  # Tokens whose keys/values are in self.cache
+        self.stable = 0  # Prefix of cache_tokens known to match self.ids
+    
+    def extend(self, tokens: List[int]) -> None:
+        self.ids = torch.cat([self.ids, torch.tensor([tokens], dtype=torch.long, device=self.ids.device)], dim=1)
+    
+    def _sync(self) -> torch.Tensor:
+        """Drop rejected drafts from the cache, feed what is missing and return next-token logits."""
+        ids = self.ids[0].tolist()
+        common = self.stable
+        limit = min(len(self.cache_tokens), len(ids))
+        while common < limit and self.cache_tokens[common] == ids[common]:
+            common += 1
+        common = min(common, len(ids) - 1)  # Always feed at least one token to get logits
+        crop_cache(self.cache, common)
+        del self.cache_tokens[common:]
+        self.stable = common
+        logits = self.model(self.ids[:, common:], past_key_values=self.cache, use_cache=True).logits[:, -1]
+        self.cache_tokens.extend(ids[common:])
+        return logits
+    
+    def propose(self, num_tokens: int, generator: Optional[torch.Generator] = None) -> tuple:
+        """(draft tokens, the processed draft distribution each one was sampled from)."""
+        if num_tokens <= 0:
+            return [], None
+        logits = self._sync()
+        input_ids = self.ids
+        tokens, distributions = [], []
+        for step in range(num_tokens):
+            probs = torch.softmax(self.processor(input_ids, logits.float()), dim=-1)
+            token = torch.multinomial(probs, num_samples=1, generator=generator)
+            tokens.append(token.item())
+            distributions.append(probs[0])
+            if tokens[-1] == CODE_END_TOKEN_ID or step == num_tokens - 1:
+                break
+            input_ids = torch.cat([input_ids, token], dim=1)
+            logits = self.model(token, past_key_values=self.cache, use_cache=True).logits[:, -1]
+            self.cache_tokens.append(tokens[-1])
+        return tokens, distributions
+
+
+def load_draft_model() -> torch.nn.Module:
+    """Load DRAFT_MODEL_NAME next to Maya1 (same device and dtype) on first use."""
+    global draft_model
+    with _draft_model_lock:
+        if draft_model is None:
+            if not DRAFT_MODEL_NAME:
+                raise ValueError("speculative_decoding 'draft' requires the DRAFT_MODEL_NAME environment variable")
+            device = next(model.parameters()).device
+            logger.info("Loading draft model %s on %s...", DRAFT_MODEL_NAME, device)
+            draft_model = AutoModelForCausalLM.from_pretrained(DRAFT_MODEL_NAME, torch_dtype=model.dtype)
+            draft_model = draft_model.to(device).eval()
+        return draft_model
+
+
+def crop_cache(cache: DynamicCache, length: int) -> None:
+    """Drop cached positions beyond `length` (negative crop: the form newer transformers expect)."""
+    excess = cache.get_seq_length() - length
+    if excess > 0:
+        cache.crop(-excess)
+
+
+def verify_draft_token(probs: torch.Tensor, token: int, draft_probs: Optional[torch.Tensor],
+                       generator: Optional[torch.Generator] = None) -> tuple:
+    """
+    Speculative sampling acceptance test for one drafted token; returns (token, accepted).
+    
+    The draft token is kept with probability min(1, p/q); otherwise a replacement is drawn from
+    the normalized residual max(p - q, 0). The result is distributed exactly as p (Maya1's fully
+    processed distribution), whatever the draft. A deterministic proposal has q = 1 on its token.
+    """
+    p = probs[token]
+    q = draft_probs[token] if draft_probs is not None else 1.0
+    if torch.rand((), device=probs.device, generator=generator) * q < p:
+        return token, True
+    if draft_probs is None:
+        residual = probs.clone()
+        residual[token] = 0.0
+    else:
+        residual = (probs - draft_probs).clamp_(min=0.0)
+    if residual.sum() <= 0:
+        residual = probs
+    return torch.multinomial(residual, num_samples=1, generator=generator).item(), False
+
+
+def speculative_generate(input_ids: torch.Tensor, voice_description: str, temperature: float, max_new_tokens: int,
+                         sampling: Dict[str, Any], stats: SpeculationStats,
+                         generator: Optional[torch.Generator] = None) -> torch.Tensor:
+    """
+    Generate one sequence with speculative decoding; returns the generated ids (1-D, device).
+    
+    Each step feeds the last token plus up to sampling["speculative_tokens"] drafted tokens
+    through Maya1 in one forward pass. The drafts are then checked left to right against the
+    same processors as the regular path (build_logits_processors), each seeing exactly the
+    accepted prefix, so the output follows the non-speculative sampling distribution. The first
+    rejection is replaced by a residual sample; if all drafts pass, a bonus token is sampled
+    from the last position. Rejected positions are cropped from the KV cache.
+    """
+    device = input_ids.device
+    prompt_len = input_ids.shape[1]
+    processors = build_logits_processors(prompt_len, temperature, device, sampling)
+    if sampling["speculative"] == 'draft':
+        drafter = DraftModelDrafter(load_draft_model(), input_ids, temperature)
+    else:
+        drafter = NgramDrafter()
+    
+    token_ids = torch.empty((1, prompt_len + max_new_tokens), dtype=torch.long, device=device)
+    token_ids[:, :prompt_len] = input_ids
+    length = prompt_len
+    
+    # Prefill everything but the last prompt token, which the first step feeds
+    cache = get_prefix_past_key_values(voice_description, input_ids) or DynamicCache()
+    crop_cache(cache, prompt_len - 1)
+    cached_len = cache.get_seq_length()
+    if cached_len < prompt_len - 1:
+        model(input_ids[:, cached_len:prompt_len - 1], past_key_values=cache, use_cache=True)
+    
+    while length - prompt_len < max_new_tokens:
+        remaining = prompt_len + max_new_tokens - length
+        draft, draft_probs = drafter.propose(min(sampling["speculative_tokens"], remaining - 1), generator)
+        feed = token_ids[:, length - 1:length]
+        if draft:
+            feed = torch.cat([feed, torch.tensor([draft], dtype=torch.long, device=device)], dim=1)
+        forward_start = time.perf_counter()
+        logits = model(feed, past_key_values=cache, use_cache=True).logits.float()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        stats.forward_seconds += time.perf_counter() - forward_start
+        stats.forward_passes += 1
+        stats.proposed += len(draft)
+        
+        new_tokens = []
+        for position in range(len(draft) + 1):
+            scores = processors(token_ids[:, :length], logits[:, position])
+            probs = torch.softmax(scores, dim=-1)[0]
+            if position < len(draft):
+                token, accepted = verify_draft_token(
+                    probs, draft[position], draft_probs[position] if draft_probs else None, generator
+                )
+                stats.accepted += int(accepted)
+            else:
+                token, accepted = torch.multinomial(probs, num_samples=1, generator=generator).item(), False
+            token_ids[0, length] = token
+            length += 1
+            new_tokens.append(token)
+            if not accepted or token == CODE_END_TOKEN_ID:
+                break
+        
+        crop_cache(cache, length - 1)  # The newest token is fed on the next step
+        drafter.extend(new_tokens)
+        if new_tokens[-1] == CODE_END_TOKEN_ID:
+            break
+    
+    stats.tokens += length - prompt_len
+    return token_ids[0, prompt_len:length]
+
+
+class _ScheduledSequence:
+    """One prompt in the continuous batch: token buffer, sampling state and the future to resolve."""
+    
+    def __init__(self, input_ids: torch.Tensor, voice_description: str, temperature: float,
+                 max_new_tokens: int, seed: Optional[int], sampling: Optional[Dict[str, Any]] = None,
+                 token_cap: Optional[int] = None):
+        self.prompt_len = input_ids.shape[1]
+        self.max_new_tokens = max_new_tokens
+        self.token_cap = max(max_new_tokens, token_cap or max_new_tokens)  # A predicted budget extends up to this
+        self.voice_description = voice_description
+        self.future = Future()
+        self.num_generated = 0
+        self.reserved_bytes = 0  # Held with the memory governor while the sequence is in the batch
+        # Prompt + generated tokens, preallocated so each step is an in-place write
+        self.token_ids = torch.empty((1, self.prompt_len + self.token_cap), dtype=torch.long, device=input_ids.device)
+        self.token_ids[:, :self.prompt_len] = input_ids
+        self.processors = build_logits_processors(self.prompt_len, temperature, input_ids.device, sampling)
+        # Unseeded sequences get their own generator too, so the scheduler thread never draws from
+        # the global RNG that jobs' SNAC decoding uses
+        self.generator = torch.Generator(device=input_ids.device)
+        if seed is not None:
+            self.generator.manual_seed(seed)
+        else:
+            self.generator.seed()
+    
+    @property
+    def input_ids(self) -> torch.Tensor:
+        return self.token_ids[:, :self.prompt_len + self.num_generated]
+    
+    @property
+    def last_token(self) -> torch.Tensor:
+        return self.token_ids[:, self.prompt_len + self.num_generated - 1]
+    
+    @property
+    def next_position(self) -> int:
+        # Position of last_token, the token fed on the next decode step
+        return self.prompt_len + self.num_generated - 1
+    
+    def sample(self, logits: torch.Tensor) -> int:
+        """Sample the next token from [1, vocab] logits, append it and return it."""
+        scores = self.processors(self.input_ids, logits.float())
+        probs = torch.softmax(scores, dim=-1)
+        token = torch.multinomial(probs, num_samples=1, generator=self.generator)
+        self.token_ids[:, self.prompt_len + self.num_generated] = token[:, 0]
+        self.num_generated += 1
+        return token.item()
+    
+    @property
+    def generated(self) -> torch.Tensor:
+        return self.token_ids[0, self.prompt_len:self.prompt_len + self.num_generated]
+
+
+class ContinuousBatchScheduler:
+    """
+    Shared decode loop for sequences from concurrent jobs (continuous batching).
+    
+    Jobs submit prompts (whole texts or chunks) from their own threads. A single scheduler thread
+    prefills new prompts, merges their KV caches into the running batch (left-padded), samples one
+    token per sequence per step, and retires sequences on CODE_END_TOKEN_ID or their token budget by
+    resolving their futures with the generated ids. Freed slots are refilled on the next step, so the
+    GPU decodes up to `max_batch_size` sequences at once instead of one.
+    
+    Each sequence reserves estimate_generation_bytes with the memory governor before it is admitted;
+    one that doesn't fit waits (keeping its place in line) until running sequences retire. An OOM only
+    costs the newest sequence its place: it leaves the batch with its tokens so far and is prefilled
+    again once there is room, and the batch stays smaller until it drains. A sequence that OOMs on
+    its own fails alone.
+    """
+    
+    def __init__(self, max_batch_size: int = SCHEDULER_MAX_BATCH_SIZE):
+        self.max_batch_size = max(1, max_batch_size)
+        self._pending = queue.Queue()
+        self._waiting = deque()  # Deferred or evicted sequences, admitted before anything pending
+        self._batch_limit = self.max_batch_size  # Lowered after an OOM until the batch empties
+        self._active = []
+        self._cache_layers = None  # per-layer (key, value) for the active batch
+        self._cache = None
+        self._attention_mask = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self.steps = 0
+        self.tokens_generated = 0
+        self.deferrals = 0
+        self.oom_evictions = 0
+    
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='maya1-batch-scheduler', daemon=True)
+                self._thread.start()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self._active),
+            "pending": self._pending.qsize(),
+            "waiting": len(self._waiting),
+            "batch_limit": self._batch_limit,
+            "deferrals": self.deferrals,
+            "oom_evictions": self.oom_evictions,
+            "steps": self.steps,
+            "tokens_generated": self.tokens_generated,
+            "mean_batch_size": round(self.tokens_generated / self.steps, 2) if self.steps else 0.0,
+        }
+    
+    def submit(self, text: str, voice_description: str, temperature: float = 0.6,
+               max_new_tokens: int = 2000, seed: Optional[int] = None,
+               sampling: Optional[Dict[str, Any]] = None) -> Future:
+        """Queue one prompt; the future resolves to its generated token ids (1-D device tensor)."""
+        if model is None or tokenizer is None:
+            load_model()
+        self.start()
+        
+        device = next(model.parameters()).device
+        input_ids = tokenizer(build_prompt(voice_description, text), return_tensors='pt')['input_ids'].to(device)
+        sequence = _ScheduledSequence(
+            input_ids, voice_description, temperature,
+            resolve_max_new_tokens(text, max_new_tokens, voice_description), seed, sampling,
+            token_cap=resolve_token_cap(text, max_new_tokens)
+        )
+        self._pending.put(sequence)
+        return sequence.future
+    
+    def _run(self) -> None:
+        while True:
+            try:
+                self._admit()
+                if self._active:
+                    self._step()
+            except Exception as e:
+                logger.exception("Batch scheduler step failed, failing %d active sequence(s)", len(self._active))
+                for sequence in self._active:
+                    self._resolve(sequence, e)
+                self._active = []
+                self._reset_batch()
+    
+    def _admit(self) -> None:
+        """Prefill waiting prompts into free batch slots (blocks while the batch is empty)."""
+        while len(self._active) < min(self.max_batch_size, self._batch_limit):
+            waited = bool(self._waiting)
+            if waited:
+                sequence = self._waiting.popleft()
+            else:
+                try:
+                    sequence = self._pending.get(block=not self._active)
+                except queue.Empty:
+                    return
+            if not self._reserve(sequence, block=not self._active):
+                self.deferrals += not waited
+                self._waiting.appendleft(sequence)
+                return
+            try:
+                self._prefill(sequence)
+            except Exception as e:
+                if not is_out_of_memory(e) or not self._active:
+                    self._resolve(sequence, e)
+                    continue
+                # No room next to the running batch: retry once a running sequence retires
+                logger.warning("Out of memory admitting a sequence next to %d running, deferring it",
+                               len(self._active))
+                self._release(sequence)
+                self._after_oom(len(self._active))
+                self._waiting.appendleft(sequence)
+                return
+    
+    def _reserve(self, sequence: _ScheduledSequence, block: bool) -> bool:
+        num_bytes = estimate_generation_bytes(sequence.prompt_len, sequence.max_new_tokens)
+        if not get_memory_governor().acquire(num_bytes, block=block):
+            return False
+        sequence.reserved_bytes = num_bytes
+        return True
+    
+    def _release(self, sequence: _ScheduledSequence) -> None:
+        if sequence.reserved_bytes:
+            get_memory_governor().release(sequence.reserved_bytes)
+            sequence.reserved_bytes = 0
+    
+    def _resolve(self, sequence: _ScheduledSequence, error: Optional[BaseException] = None) -> None:
+        """Release the sequence's reservation and complete its future (generated ids, or the error)."""
+        self._release(sequence)
+        if sequence.future.done():
+            return
+        if error is None:
+            sequence.future.set_result(sequence.generated)
+        else:
+            sequence.future.set_exception(error)
+    
+    def _after_oom(self, batch_limit: int) -> None:
+        get_memory_governor().oom_retries += 1
+        release_memory(next(model.parameters()).device, collect=True)
+        self._batch_limit = max(1, batch_limit)
+    
+    def _reset_batch(self) -> None:
+        self._cache = self._cache_layers = self._attention_mask = None
+        self._batch_limit = self.max_batch_size
+    
+    def _prefill(self, sequence: _ScheduledSequence) -> None:
+        input_ids = sequence.input_ids
+        cache = get_prefix_past_key_values(sequence.voice_description, input_ids) or DynamicCache()
+        cached_len = cache.get_seq_length()
+        with torch.no_grad():
+            outputs = model(input_ids[:, cached_len:], past_key_values=cache, use_cache=True)
+        token = sequence.sample(outputs.logits[:, -1, :])
+        self.tokens_generated += 1
+        if self._finished(sequence, token):
+            self._resolve(sequence)
+            return
+        
+        layers = kv_cache_layers(cache)
+        # Covers tokens generated before an OOM eviction too (they were prefilled with the prompt)
+        mask = torch.ones((1, input_ids.shape[1]), dtype=torch.long, device=input_ids.device)
+        if self._cache is not None:
+            # Decode steps grow the live cache; the layers snapshot is from the last merge or retire
+            self._cache_layers = kv_cache_layers(self._cache)
+        if self._cache_layers is None:
+            self._cache_layers, self._attention_mask = layers, mask
+        else:
+            # Left-pad whichever side is shorter so every row ends at the current step
+            current_len, new_len = self._attention_mask.shape[1], mask.shape[1]
+            target_len = max(current_len, new_len)
+            merged = []
+            for (k_old, v_old), (k_new, v_new) in zip(self._cache_layers, layers):
+                merged.append((
+                    torch.cat([self._left_pad(k_old, target_len), self._left_pad(k_new, target_len)], dim=0),
+                    torch.cat([self._left_pad(v_old, target_len), self._left_pad(v_new, target_len)], dim=0),
+                ))
+            self._cache_layers = merged
+            self._attention_mask = torch.cat([
+                self._left_pad(self._attention_mask, target_len),
+                self._left_pad(mask, target_len),
+            ], dim=0)
+        self._active.append(sequence)
+        self._cache = None  # rebuilt from _cache_layers on the next step
+    
+    @staticmethod
+    def _left_pad(tensor: torch.Tensor, target_len: int) -> torch.Tensor:
+        """Zero-pad the sequence axis (dim 2 for KV, dim 1 for masks) on the left up to target_len."""
+        seq_dim = 2 if tensor.dim() == 4 else 1
+        missing = target_len - tensor.shape[seq_dim]
+        if missing <= 0:
+            return tensor
+        shape = list(tensor.shape)
+        shape[seq_dim] = missing
+        return torch.cat([tensor.new_zeros(shape), tensor], dim=seq_dim)
+    
+    def _finished(self, sequence: _ScheduledSequence, token: int) -> bool:
+        if token == CODE_END_TOKEN_ID:
+            return True
+        if sequence.num_generated < sequence.max_new_tokens:
+            return False
+        if sequence.max_new_tokens < sequence.token_cap:
+            # Under-predicted budget: keep decoding up to the cap rather than cut the audio off
+            logger.warning("Predicted budget of %d tokens ran out before EOS, continuing up to %d",
+                           sequence.max_new_tokens, sequence.token_cap)
+            sequence.max_new_tokens = sequence.token_cap
+            if sequence.reserved_bytes:
+                # Already decoding, so the extra memory is reserved even over budget
+                extra = estimate_generation_bytes(sequence.prompt_len, sequence.token_cap) - sequence.reserved_bytes
+                get_memory_governor().acquire(extra, force=True)
+                sequence.reserved_bytes += extra
+            return False
+        return True
+    
+    def _step(self) -> None:
+        """One batched decode step over all active sequences."""
+        device = self._attention_mask.device
+        if self._cache is None:
+            self._cache = build_kv_cache(self._cache_layers)
+        
+        batch_size = len(self._active)
+        last_tokens = torch.stack([sequence.last_token for sequence in self._active])  # [batch, 1]
+        positions = torch.tensor([[sequence.next_position] for sequence in self._active], device=device)
+        attention_mask = torch.cat([self._attention_mask, self._attention_mask.new_ones((batch_size, 1))], dim=1)
+        
+        try:
+            with torch.no_grad():
+                outputs = model(
+                    input_ids=last_tokens,
+                    attention_mask=attention_mask,
+                    position_ids=positions,
+                    past_key_values=self._cache,
+                    use_cache=True,
+                )
+        except Exception as e:
+            if not is_out_of_memory(e):
+                raise
+            self._evict_newest(e)
+            return
+        self._attention_mask = attention_mask
+        logits = outputs.logits[:, -1, :]
+        self.steps += 1
+        
+        finished_rows = []
+        for row, sequence in enumerate(self._active):
+            token = sequence.sample(logits[row:row + 1])
+            self.tokens_generated += 1
+            if self._finished(sequence, token):
+                finished_rows.append(row)
+        
+        if finished_rows:
+            for row in finished_rows:
+                self._resolve(self._active[row])
+            self._retire(finished_rows)
+    
+    def _evict_newest(self, error: BaseException) -> None:
+        """After an OOM in a decode step: requeue the newest sequence (or fail it if it ran alone)."""
+        # Layers the failed step already extended are cut back to the last completed step
+        past_len = self._attention_mask.shape[1]
+        self._cache_layers = [(k[:, :, :past_len], v[:, :, :past_len]) for k, v in kv_cache_layers(self._cache)]
+        self._cache = None
+        newest = self._active[-1]
+        self._after_oom(len(self._active) - 1)
+        if len(self._active) == 1:
+            logger.warning("Out of memory decoding a single sequence, failing it")
+            self._resolve(newest, error)
+        else:
+            logger.warning("Out of memory decoding %d sequences, requeueing the newest", len(self._active))
+            self.oom_evictions += 1
+            self._release(newest)
+            self._waiting.appendleft(newest)
+        self._retire([len(self._active) - 1])
+    
+    def _retire(self, finished_rows: List[int]) -> None:
+        """Drop finished rows from the batch and trim columns that are padding for every remaining row."""
+        keep = [row for row in range(len(self._active)) if row not in finished_rows]
+        self._active = [self._active[row] for row in keep]
+        if not self._active:
+            self._reset_batch()
+            return
+        
+        mask = self._attention_mask[keep]
+        first_used = int((mask.sum(dim=0) > 0).nonzero()[0])
+        index = torch.tensor(keep, device=mask.device)
+        self._attention_mask = mask[:, first_used:]
+        self._cache_layers = [
+            (k.index_select(0, index)[:, :, first_used:], v.index_select(0, index)[:, :, first_used:])
+            for k, v in (kv_cache_layers(self._cache) if self._cache is not None else self._cache_layers)
+        ]
+        self._cache = None
+
+
+def generate_audio_scheduled(texts: List[str], voice_description: str, temperature: float = 0.6,
+                             max_new_tokens: int = 2000, seed: Optional[int] = None,
+                             sampling: Optional[Dict[str, Any]] = None,
+                             assembler: Optional['AudioAssembler'] = None) -> tuple:
+    """
+    Generate audio for one job's texts (chunks) through the shared continuous-batching scheduler.
+    
+    With an assembler, chunks are appended to it in order instead of being returned. With a seed,
+    chunk i samples with seed + i and its SNAC decoder noise is seeded the same way, so the audio
+    doesn't depend on what other jobs are doing.
+    
+    Returns:
+        tuple: (list of audio_arrays in input order, sampling_rate)
+    """
+    futures = [
+        batch_scheduler.submit(text, voice_description, temperature, max_new_tokens,
+                               seed=None if seed is None else seed + index, sampling=sampling)
+        for index, text in enumerate(texts)
+    ]
+    
+    device = next(model.parameters()).device
+    ensure_snac_on_device(device)
+    audio_arrays = []
+    for index, future in enumerate(futures):
+        record_generation_length(texts[index], voice_description, future.result())
+        snac_codes = extract_snac_codes(future.result())
+        if snac_codes.numel() == 0:
+            raise ValueError(f"No SNAC codes generated for chunk {index + 1}. "
+                             "Model may not have produced valid audio tokens.")
+        audio = decode_snac_codes_isolated(snac_codes, device, None if seed is None else seed + index)
+        if assembler is not None:
+            assembler.append(audio)
+        else:
+            audio_arrays.append(audio)
+    
+    log_debug("Batch scheduler: %s", batch_scheduler.stats())
+    return audio_arrays, SAMPLING_RATE
+
+
+def start_batch_scheduler(max_batch_size: int = SCHEDULER_MAX_BATCH_SIZE) -> ContinuousBatchScheduler:
+    """Create and start the process-wide continuous-batching scheduler."""
+    global batch_scheduler
+    
+    if batch_scheduler is None:
+        batch_scheduler = ContinuousBatchScheduler(max_batch_size)
+        batch_scheduler.start()
+        logger.info("Continuous batching scheduler started (max batch size %d)", batch_scheduler.max_batch_size)
+    return batch_scheduler
+
+
+class LengthObservationRelay:
+    """
+    Length predictor stand-in for replica workers: observations are collected and sent back with
+    each result so only the parent writes LENGTH_PREDICTOR_PATH (budgets are resolved before submit).
+    """
+    
+    def __init__(self):
+        self.pending = []
+    
+    def observe(self, *args, **kwargs) -> None:
+        self.pending.append((args, kwargs))
+    
+    def budget(self, text: str, voice_description: str, fallback: int) -> int:
+        return fallback
+    
+    def take(self) -> List[tuple]:
+        pending, self.pending = self.pending, []
+        return pending
+
+
+def _replica_worker(worker_index: int, device: str, num_threads: int, task_queue, result_queue,
+                    shared_model=None, shared_tokenizer=None, shared_snac=None) -> None:
+    """
+    Replica process main loop: take (task_id, kwargs) from the shared task queue, generate, reply.
+    
+    CPU replicas are forked with the parent's shared-memory model (no copy); GPU replicas load their own.
+    """
+    global model, tokenizer, snac_decoder, length_predictor
+    
+    torch.set_num_threads(num_threads)
+    torch.seed()  # Workers would otherwise all continue from the same RNG state
+    if length_predictor is not None:
+        length_predictor = LengthObservationRelay()
+    if shared_model is not None:
+        model, tokenizer, snac_decoder = shared_model, shared_tokenizer, shared_snac
+        if ENGINE_MODE == 'compiled':
+            enable_compiled_engine()
+    else:
+        if device.startswith('cuda'):
+            torch.cuda.set_device(device)
+        load_model(device)
+    result_queue.put((None, worker_index, None, []))  # Ready
+    
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        task_id, kwargs = task
+        seed = kwargs.pop('seed')
+        try:
+            with request_debug(kwargs.pop('debug')):
+                if seed is not None:
+                    set_generation_seed(seed)
+                audio_array, _ = generate_audio(**kwargs)
+            result = (task_id, audio_array, None)
+        except Exception as e:  # Exceptions may not pickle; send the message
+            result = (task_id, None, f"{type(e).__name__}: {e}")
+        result_queue.put(result + (length_predictor.take() if length_predictor is not None else [],))
+
+
+class ReplicaPool:
+    """
+    Pool of worker processes, each holding a model replica, fed from one shared task queue.
+    
+    Tasks are single texts (a whole short job or one chunk of a long one), so idle workers pick up
+    the next chunk of any job. On CPU the parent's weights are moved to shared memory and the
+    workers are forked, so they map the same pages (SNAC's weight-norm parametrizations can't be
+    pickled for spawn) and resident memory stays near one copy; intra-op threads are split between
+    workers. On GPU workers are spawned and each loads a replica on device `index % device_count`,
+    and the parent keeps only the tokenizer.
+    
+    The parent resolves each task's token budget with its length predictor, and workers send their
+    length observations back with the result, so only the parent writes the observations file.
+    """
+    
+    def __init__(self, num_workers: int):
+        self.num_workers = num_workers
+        self.tasks_submitted = 0
+        self.tasks_completed = 0
+        self._processes = []
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._task_ids = iter(range(1 << 62))
+        self._ready = 0
+        self._ready_event = threading.Event()
+        self.shares_weights = not torch.cuda.is_available()
+    
+    def start(self) -> None:
+        use_cuda = torch.cuda.is_available()
+        context = torch.multiprocessing.get_context('spawn' if use_cuda else 'fork')
+        self._task_queue = context.Queue()
+        self._result_queue = context.Queue()
+        
+        self.shares_weights = not use_cuda
+        shared = (None, None, None)
+        if not use_cuda:
+            if model is None:
+                load_model()
+            model.share_memory()
+            snac_decoder.share_memory()
+            shared = (model, tokenizer, snac_decoder)
+        num_threads = max(1, torch.get_num_threads() // self.num_workers)
+        
+        for index in range(self.num_workers):
+            device = f"cuda:{index % torch.cuda.device_count()}" if use_cuda else 'cpu'
+            process = context.Process(
+                target=_replica_worker,
+                args=(index, device, num_threads, self._task_queue, self._result_queue, *shared),
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+        
+        threading.Thread(target=self._collect, name="replica-pool-results", daemon=True).start()
+        self._ready_event.wait()
+        logger.info("Replica pool ready: %d workers on %s (%d threads each)",
+                    self.num_workers, 'cuda' if use_cuda else 'cpu (shared weights)', num_threads)
+    
+    def submit(self, text: str, voice_description: str, temperature: float = 0.6, max_new_tokens: int = 2000,
+               seed: Optional[int] = None, sampling: Optional[Dict[str, Any]] = None) -> Future:
+        """Queue one text for generation; the future resolves to its audio array."""
+        future = Future()
+        with self._lock:
+            task_id = next(self._task_ids)
+            self._futures[task_id] = future
+            self.tasks_submitted += 1
+        self._task_queue.put((task_id, dict(
+            text=text, voice_description=voice_description, temperature=temperature,
+            max_new_tokens=resolve_max_new_tokens(text, max_new_tokens, voice_description),  # Parent's predictor
+            token_cap=resolve_token_cap(text, max_new_tokens), sampling=sampling, seed=seed, debug=debug_enabled(),
+        )))
+        return future
+    
+    def _collect(self) -> None:
+        """Resolve futures from worker replies; fail everything pending if a worker dies."""
+        while True:
+            try:
+                task_id, audio_array, error, length_observations = self._result_queue.get(timeout=1.0)
+            except queue.Empty:
+                dead = [index for index, process in enumerate(self._processes) if not process.is_alive()]
+                if dead:
+                    self._fail_pending(RuntimeError(f"Replica worker(s) {dead} exited"))
+                    return
+                continue
+            
+            if length_predictor is not None:
+                for args, kwargs in length_observations:
+                    length_predictor.observe(*args, **kwargs)
+            if task_id is None:
+                self._ready += 1
+                if self._ready == self.num_workers:
+                    self._ready_event.set()
+                continue
+            with self._lock:
+                future = self._futures.pop(task_id)
+                self.tasks_completed += 1
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(audio_array)
+    
+    def _fail_pending(self, error: Exception) -> None:
+        logger.error("Replica pool failed: %s", error)
+        with self._lock:
+            futures, self._futures = list(self._futures.values()), {}
+        for future in futures:
+            future.set_exception(error)
+        self._ready_event.set()  # Unblock start() if a worker died while loading
+    
+    def shutdown(self) -> None:
+        for _ in self._processes:
+            self._task_queue.put(None)
+        for process in self._processes:
+            process.join()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.num_workers,
+                "alive": sum(process.is_alive() for process in self._processes),
+                "submitted": self.tasks_submitted,
+                "completed": self.tasks_completed,
+                "pending": len(self._futures),
+            }
+
+
+def generate_audio_replicated(texts: List[str], voice_description: str, temperature: float = 0.6,
+                              max_new_tokens: int = 2000, seed: Optional[int] = None,
+                              sampling: Optional[Dict[str, Any]] = None,
+                              assembler: Optional['AudioAssembler'] = None) -> tuple:
+    """
+    Generate audio for one job's texts (chunks) across the replica pool.
+    
+    With an assembler, chunks are appended to it in order instead of being returned.
+    
+    Returns:
+        tuple: (list of audio_arrays in input order, sampling_rate)
+    """
+    futures = [
+        replica_pool.submit(text, voice_description, temperature, max_new_tokens,
+                            seed=None if seed is None else seed + index, sampling=sampling)
+        for index, text in enumerate(texts)
+    ]
+    audio_arrays = []
+    for future in futures:
+        if assembler is not None:
+            assembler.append(future.result())
+        else:
+            audio_arrays.append(future.result())
+    log_debug("Replica pool: %s", replica_pool.stats())
+    return audio_arrays, SAMPLING_RATE
+
+
+def start_replica_pool(num_workers: int = REPLICA_WORKERS) -> ReplicaPool:
+    """Create and start the process-wide replica pool."""
+    global replica_pool
+    
+    if replica_pool is None:
+        pool = ReplicaPool(num_workers)
+        pool.start()
+        replica_pool = pool
+    return replica_pool
+
+
+class SnacTokenStreamer(BaseStreamer):
+    """
+    Token streamer that hands generated token ids to a consumer thread through a queue.
+    
+    model.generate calls put() with the prompt first, then once per new token, then end().
+    end() only marks one generate call done; finish() ends the stream, so a continuation
+    (extend_truncated_generation) can feed the same consumer after restart().
+    """
+    
+    def __init__(self):
+        self.token_queue = queue.Queue()
+        self.prompt_seen = False
+    
+    def put(self, value):
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        for token_id in value.reshape(-1).tolist():
+            self.token_queue.put(token_id)
+    
+    def end(self):
+        pass
+    
+    def restart(self):
+        """Expect another generate call (whose first put() is its prompt)."""
+        self.prompt_seen = False
+    
+    def finish(self):
+        self.token_queue.put(None)
+    
+    def __iter__(self):
+        while True:
+            token_id = self.token_queue.get()
+            if token_id is None:
+                return
+            yield token_id
+
+
+def generate_audio_stream(text: str, voice_description: str, temperature: float = 0.6, max_new_tokens: int = 2000,
+                          first_chunk_frames: int = STREAM_FIRST_CHUNK_FRAMES,
+                          chunk_frames: int = STREAM_CHUNK_FRAMES,
+                          overlap_frames: int = STREAM_OVERLAP_FRAMES,
+                          lookahead_frames: int = STREAM_LOOKAHEAD_FRAMES,
+                          sampling: Optional[Dict[str, Any]] = None,
+                          seed: Optional[int] = None) -> Iterator[np.ndarray]:
+    """
+    Generate audio incrementally, yielding decoded segments as soon as enough SNAC frames exist.
+    
+    model.generate runs in a background thread feeding a token streamer. Each segment is decoded
+    from a sliding window that adds `overlap_frames` of left context and `lookahead_frames` of
+    right context, and only the samples of the new frames are emitted, so joins don't click.
+    Concatenating all segments matches the warmup-trimmed output of generate_audio.
+    
+    A seed makes the stream reproducible: generation samples from its own generator (the
+    global RNG is shared with SNAC decoding on this thread), and decoding is seeded with it.
+    
+    Yields:
+        np.ndarray: consecutive 24 kHz audio segments
+    """
+    global model, tokenizer, snac_decoder
+    
+    if model is None or tokenizer is None:
+        load_model()
+    
+    token_cap = resolve_token_cap(text, max_new_tokens)
+    max_new_tokens = resolve_max_new_tokens(text, max_new_tokens, voice_description)
+    device = next(model.parameters()).device
+    ensure_snac_on_device(device)
+    
+    inputs = tokenizer(build_prompt(voice_description, text), return_tensors='pt')
+    input_ids = inputs['input_ids'].to(device)
+    
+    past_key_values = initial_past_key_values(voice_description, input_ids, max_new_tokens)
+    streamer = SnacTokenStreamer()
+    generation_error = []
+    generator = None
+    if seed is not None:
+        set_generation_seed(seed)  # SNAC decoder noise; sampling below no longer draws from it
+        generator = torch.Generator(device=device)
+        generator.manual_seed(seed)
+    
+    def run_generation():
+        try:
+            with torch.no_grad():
+                outputs = model.generate(
+                    input_ids,
+                    past_key_values=past_key_values,
+                    streamer=streamer,
+                    **build_generate_kwargs(temperature, max_new_tokens, input_ids.shape[1], sampling, generator)
+                )
+            if is_truncated(outputs[0, input_ids.shape[1]:], max_new_tokens) and max_new_tokens < token_cap:
+                logger.warning("Predicted budget of %d tokens ran out before EOS, continuing up to %d",
+                               max_new_tokens, token_cap)
+                streamer.restart()
+                extend_truncated_generation(outputs, input_ids.shape[1], temperature, token_cap, sampling, streamer,
+                                            generator)
+        except Exception as e:  # surfaced to the consumer below
+            generation_error.append(e)
+        finally:
+            streamer.finish()
+    
+    generation_thread = threading.Thread(target=run_generation, daemon=True)
+    generation_thread.start()
+    
+    snac_codes = []
+    emitted_frames = 1  # Frame 0 is decoder warmup and is trimmed, as in generate_audio
+    
+    def decode_frames(start_frame: int, end_frame: int) -> np.ndarray:
+        window_start = max(0, start_frame - overlap_frames)
+        window_end = min(len(snac_codes), (end_frame + lookahead_frames) * SNAC_TOKENS_PER_FRAME)
+        window_audio = decode_snac_codes(
+            snac_codes[window_start * SNAC_TOKENS_PER_FRAME:window_end], device, trim_warmup=False
+        )
+        return window_audio[(start_frame - window_start) * SNAC_SAMPLES_PER_FRAME:
+                            (end_frame - window_start) * SNAC_SAMPLES_PER_FRAME]
+    
+    num_generated = 0
+    eos_seen = False
+    for token_id in streamer:
+        num_generated += 1
+        if token_id == CODE_END_TOKEN_ID:
+            eos_seen = True
+            if length_predictor is not None:
+                length_predictor.observe(text, voice_description, num_generated)
+            continue  # generate stops on EOS; keep draining until finish()
+        if not SNAC_MIN_ID <= token_id <= SNAC_MAX_ID:
+            continue
+        snac_codes.append(token_id)
+        
+        stable_frames = len(snac_codes) // SNAC_TOKENS_PER_FRAME - lookahead_frames
+        target = first_chunk_frames if emitted_frames == 1 else chunk_frames
+        if stable_frames - emitted_frames >= target:
+            yield decode_frames(emitted_frames, stable_frames)
+            emitted_frames = stable_frames
+    
+    generation_thread.join()
+    if generation_error:
+        raise generation_error[0]
+    if not eos_seen and num_generated and length_predictor is not None:
+        length_predictor.observe(text, voice_description, num_generated, lower_bound=True)
+    
+    if not snac_codes:
+        raise ValueError("No SNAC codes generated. Model may not have produced valid audio tokens.")
+    
+    # Flush the tail (partial final frame is padded by unpack_snac_from_7)
+    total_frames = -(-len(snac_codes) // SNAC_TOKENS_PER_FRAME)
+    if total_frames <= 1:
+        # Too short to have a warmup frame to trim (generate_audio keeps it too)
+        yield decode_snac_codes(snac_codes, device)
+    elif total_frames > emitted_frames:
+        yield decode_frames(emitted_frames, total_frames)
+
+
+# Words ending in a period that don't end a sentence (compared lowercased, without the final period)
+ABBREVIATIONS = frozenset({
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'mt', 'ft', 'vs', 'etc', 'e.g', 'i.e', 'cf', 'al',
+    'inc', 'ltd', 'co', 'corp', 'dept', 'fig', 'vol', 'approx', 'est', 'gen', 'gov', 'sgt',
+    'capt', 'lt', 'col', 'rev', 'hon', 'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept',
+    'oct', 'nov', 'dec', 'a.m', 'p.m', 'u.s', 'u.k',
+})
+# Sentence end: terminal punctuation, closing quotes/brackets, then any emotion tags reacting to it
+SENTENCE_END_PATTERN = re.compile(r'[.!?\u2026]+[\'"\u2019\u201d)\]]*(?:\s*<[a-z_]+>)*(?=\s)')
+CLAUSE_END_PATTERN = re.compile(r'[,;:\u2013\u2014](?=\s)')
+WORD_END_PATTERN = re.compile(r'\S(?=\s)')
+PARAGRAPH_PATTERN = re.compile(r'\n\s*\n')
+
+
+def count_text_tokens(texts: List[str]) -> List[int]:
+    """Prompt tokens each text adds (one batched tokenizer call); ~4 chars/token before the model loads."""
+    if not texts:
+        return []
+    if tokenizer is None:
+        return [max(1, (len(t) + 2) // 4) for t in texts]
+    return [len(ids) for ids in tokenizer(texts, add_special_tokens=False)['input_ids']]
+
+
+def is_sentence_end(text: str, match: re.Match) -> bool:
+    """Whether a SENTENCE_END_PATTERN match really ends a sentence (not "Dr.", "e.g.", "No. 5" or "J. Smith")."""
+    following = text[match.end():match.end() + 40].lstrip()
+    if following[:1].islower() or following[:1].isdigit():
+        return False  # "e.g. the", "No. 5": sentences don't start lowercase or with a digit
+    if text[match.start()] != '.' or text[match.start():match.start() + 2] == '..':
+        return True
+    word_start = match.start()
+    while word_start > 0 and not text[word_start - 1].isspace():
+        word_start -= 1
+    word = text[word_start:match.start()].lstrip('(\'"\u201c\u2018').lower()
+    return not (word in ABBREVIATIONS or (len(word) == 1 and word.isalpha()))
+
+
+def split_spans(text: str, start: int, end: int, pattern: re.Pattern) -> List[tuple]:
+    """(start, end) spans of text[start:end] cut after each boundary match, whitespace trimmed."""
+    spans = []
+    for match in pattern.finditer(text, start, end):
+        if pattern is SENTENCE_END_PATTERN and not is_sentence_end(text, match):
+            continue
+        spans.append((start, match.end()))
+        start = match.end()
+    spans.append((start, end))
+    trimmed = []
+    for span_start, span_end in spans:
+        while span_start < span_end and text[span_start].isspace():
+            span_start += 1
+        while span_end > span_start and text[span_end - 1].isspace():
+            span_end -= 1
+        if span_start < span_end:
+            trimmed.append((span_start, span_end))
+    return trimmed
+
+
+def split_token_spans(text: str, start: int, end: int, max_tokens: int) -> List[tuple]:
+    """
+    (start, end) spans of text[start:end] cut between tokens into equal pieces of at most max_tokens,
+    for runs with nothing else to cut at (no spaces). ~4 chars/token before the model loads.
+    """
+    if tokenizer is None:
+        boundaries, per_piece = list(range(start, end)), max(1, 4 * max_tokens - 2)
+    else:
+        offsets = tokenizer(text[start:end], add_special_tokens=False, return_offsets_mapping=True)['offset_mapping']
+        boundaries, per_piece = [start + token_start for token_start, _ in offsets], max(1, max_tokens)
+    if not boundaries:
+        return [(start, end)]
+    size = -(-len(boundaries) // -(-len(boundaries) // per_piece))
+    cuts = [start] + boundaries[size::size] + [end]
+    return [(cut, next_cut) for cut, next_cut in zip(cuts, cuts[1:]) if cut < next_cut]
+
+
+def suffix_chunk_counts(counts: List[int], joins: List[int], capacity: int) -> List[int]:
+    """
+    For each unit i, the fewest chunks of at most capacity tokens that units i.. pack into, where
+    joins[i] is the tokens between unit i and i + 1 (greedy from i is optimal; the greedy ends only
+    move forward, so one two-pointer pass).
+    """
+    prefix, join_prefix = [0], [0]
+    for count in counts:
+        prefix.append(prefix[-1] + count)
+    for join in joins:
+        join_prefix.append(join_prefix[-1] + join)
+    ends, end = [], 0
+    for start in range(len(counts)):
+        end = max(end, start + 1)
+        while (end < len(counts)
+               and prefix[end + 1] - prefix[start] + join_prefix[end] - join_prefix[start] <= capacity):
+            end += 1
+        ends.append(end)
+    needed = [0] * (len(counts) + 1)
+    for start in range(len(counts) - 1, -1, -1):
+        needed[start] = 1 + needed[ends[start]]
+    return needed
+
+
+def balance_chunks(counts: List[int], joins: List[int], ends_paragraph: List[bool], max_tokens: int) -> List[int]:
+    """
+    Group consecutive units (token counts, with joins[i] separator tokens between unit i and i + 1)
+    into chunks; returns the index of each chunk's last unit.
+    
+    Uses the fewest chunks that fit max_tokens, under the smallest cap that still allows that
+    many (binary search over greedy packings). Each chunk then closes at the unit boundary nearest
+    the remaining average, or at a paragraph end within 10% of it, whenever the units after it
+    still pack into the chunks left.
+    """
+    num_chunks = suffix_chunk_counts(counts, joins, max_tokens)[0]
+    low, high = max(counts), max(max_tokens, max(counts))
+    while low < high:
+        middle = (low + high) // 2
+        if suffix_chunk_counts(counts, joins, middle)[0] <= num_chunks:
+            high = middle
+        else:
+            low = middle + 1
+    capacity = low
+    needed = suffix_chunk_counts(counts, joins, capacity)
+    
+    remaining = sum(counts) + sum(joins)
+    ends, size = [], None
+    for index, count in enumerate(counts):
+        size = count if size is None else size + joins[index - 1] + count
+        if index == len(counts) - 1:
+            ends.append(index)
+            break
+        chunks_left = num_chunks - len(ends)
+        target = remaining / chunks_left
+        grown = size + joins[index] + counts[index + 1]
+        rest_fits = needed[index + 1] <= chunks_left - 1
+        if grown > capacity or (rest_fits and (
+                (grown > target and target - size <= grown - target)
+                or (ends_paragraph[index] and size >= 0.9 * target))):
+            ends.append(index)
+            remaining -= size + joins[index]
+            size = None
+    return ends
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS,
+               threshold_tokens: int = CHUNK_THRESHOLD_TOKENS) -> List[str]:
+    """
+    Split long text into chunks of at most max_tokens tokens, balanced in size.
+    
+    Text of up to threshold_tokens is returned whole. Otherwise it is cut into units at
+    paragraph and sentence boundaries (skipping abbreviations and initials); sentences over
+    max_tokens are cut at clause boundaries, then between words, then (runs without spaces)
+    between tokens. Emotion tags right after a sentence's punctuation stay with that sentence.
+    Units are then packed in order, counting the real tokens of the text between them (paragraph
+    breaks, runs of spaces): the chunk count is the fewest that fit max_tokens, and each chunk
+    closes at the unit boundary nearest the remaining text's average chunk size, so no chunk is
+    much longer than the others. A paragraph break ends a chunk once it has 90% of that size.
+    Chunks are slices of the original text. Tokens are counted with one batched tokenizer call per pass and the packing takes a
+    few linear passes, so book-length input is fine.
+    
+    Returns:
+        List of text chunks
+    """
+    text = text.strip()
+    spans = []  # (start, end, ends_paragraph)
+    for paragraph in split_spans(text, 0, len(text), PARAGRAPH_PATTERN):
+        sentences = split_spans(text, *paragraph, SENTENCE_END_PATTERN)
+        spans.extend((start, end, index == len(sentences) - 1) for index, (start, end) in enumerate(sentences))
+    counts = count_text_tokens([text[start:end] for start, end, _ in spans])
+    if not spans or sum(counts) <= threshold_tokens:
+        return [text]
+    
+    # Oversized sentences: clauses, words, then tokens (each pass only tokenizes the pieces it produced)
+    for pattern in (CLAUSE_END_PATTERN, WORD_END_PATTERN, None):
+        if max(counts) <= max_tokens:
+            break
+        pieces, piece_counts, pending = [], [], []
+        for (start, end, ends_paragraph), count in zip(spans, counts):
+            if count <= max_tokens:
+                pieces.append((start, end, ends_paragraph))
+                piece_counts.append(count)
+                continue
+            parts = (split_spans(text, start, end, pattern) if pattern is not None
+                     else split_token_spans(text, start, end, max_tokens))
+            pending.append((len(pieces), len(parts)))
+            pieces.extend((part_start, part_end, ends_paragraph and index == len(parts) - 1)
+                          for index, (part_start, part_end) in enumerate(parts))
+            piece_counts.extend([0] * len(parts))
+        split_counts = iter(count_text_tokens([
+            text[start:end] for offset, length in pending for start, end, _ in pieces[offset:offset + length]
+        ]))
+        for offset, length in pending:
+            piece_counts[offset:offset + length] = [next(split_counts) for _ in range(length)]
+        spans, counts = pieces, piece_counts
+    
+    gaps = [text[end:next_start] for (_, end, _), (next_start, _, _) in zip(spans, spans[1:])]
+    unique_gaps = list(set(gaps))
+    gap_tokens = dict(zip(unique_gaps, count_text_tokens(unique_gaps)))
+    joins = [gap_tokens[gap] if gap else 0 for gap in gaps]
+    ends = balance_chunks(counts, joins, [ends_paragraph for _, _, ends_paragraph in spans], max_tokens)
+    return [text[spans[first][0]:spans[last][1]] for first, last in zip([0] + [end + 1 for end in ends[:-1]], ends)]
+
+
+class AudioAssembler:
+    """
+    Joins chunk audio into one preallocated buffer with short equal-power crossfades.
+    
+    The buffer grows geometrically, so appends are amortized O(chunk) and no list of chunks is
+    kept. Past spool_seconds of capacity the buffer moves to a memory-mapped temp file (unlinked,
+    so it disappears with the last reference) and keeps growing in place on disk, which keeps
+    resident memory bounded for hour-long jobs. Each join blends the last `crossfade_ms` of the
+    buffer with the start of the next chunk (cos/sin gains), shortening the output by that much.
+    """
+    
+    def __init__(self, sampling_rate: int, crossfade_ms: float = AUDIO_CROSSFADE_MS, expected_samples: int = 0,
+                 spool_seconds: float = AUDIO_SPOOL_SECONDS, spool_dir: str = AUDIO_SPOOL_DIR):
+        self.sampling_rate = sampling_rate
+        self.crossfade = int(sampling_rate * crossfade_ms / 1000)
+        self.spool_samples = int(sampling_rate * spool_seconds)
+        self.spool_dir = spool_dir
+        self.length = 0
+        self.chunks = 0
+        self._spool_file = None
+        self._buffer = np.empty(0, dtype=np.float32)
+        if expected_samples:
+            self._reserve(expected_samples)
+    
+    def _reserve(self, capacity: int) -> None:
+        if capacity <= len(self._buffer):
+            return
+        capacity = max(capacity, 2 * len(self._buffer))
+        if self._spool_file is None and capacity > self.spool_samples:
+            self._spool_file = tempfile.TemporaryFile(dir=self.spool_dir, prefix='maya1-audio-')
+            log_debug("Audio assembler: spooling %.1fs of audio to disk", capacity / self.sampling_rate)
+        if self._spool_file is not None:
+            # Growing the file and remapping it keeps the data in place (no copy once on disk)
+            in_memory = None if isinstance(self._buffer, np.memmap) else self._buffer
+            self._spool_file.truncate(capacity * np.dtype(np.float32).itemsize)
+            buffer = np.memmap(self._spool_file, dtype=np.float32, mode='r+', shape=(capacity,))
+            if in_memory is not None:
+                buffer[:self.length] = in_memory[:self.length]
+        else:
+            buffer = np.empty(capacity, dtype=np.float32)
+            buffer[:self.length] = self._buffer[:self.length]
+        self._buffer = buffer
+    
+    def append(self, audio: np.ndarray) -> None:
+        """Append one chunk, crossfading it into the end of the audio assembled so far."""
+        audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+        overlap = min(self.crossfade, self.length, len(audio)) if self.chunks else 0
+        self._reserve(self.length + len(audio) - overlap)
+        
+        if overlap:
+            phase = np.linspace(0.0, np.pi / 2, overlap, dtype=np.float32)
+            tail = self._buffer[self.length - overlap:self.length]
+            tail *= np.cos(phase)
+            tail += audio[:overlap] * np.sin(phase)
+        end = self.length + len(audio) - overlap
+        self._buffer[self.length:end] = audio[overlap:]
+        self.length = end
+        self.chunks += 1
+    
+    def finish(self) -> np.ndarray:
+        """The assembled audio (a view of the buffer; disk-backed when spooled)."""
+        return self._buffer[:self.length]
+
+
+def concatenate_audio_arrays(audio_arrays: List[np.ndarray], sampling_rate: int) -> np.ndarray:
+    """
+    Concatenate multiple audio arrays into one, crossfading the joins (see AudioAssembler).
+    
+    Args:
+        audio_arrays: List of audio arrays to concatenate
+        sampling_rate: Sampling rate (must be same for all)
+    
+    Returns:
+        Concatenated audio array
+    """
+    if not audio_arrays:
+        raise ValueError("No audio arrays to concatenate")
+    
+    if len(audio_arrays) == 1:
+        return audio_arrays[0]
+    
+    assembler = AudioAssembler(sampling_rate, expected_samples=sum(len(audio) for audio in audio_arrays))
+    for audio in audio_arrays:
+        assembler.append(audio)
+    return assembler.finish()
+
+
+def synthesize_speech(text: str, voice_description: str, temperature: float = 0.6, max_new_tokens: int = 2000,
+                      enable_chunking: bool = True, chunk_batch_size: int = DEFAULT_CHUNK_BATCH_SIZE,
+                      seed: Optional[int] = None, sampling: Optional[Dict[str, Any]] = None) -> tuple:
+    """
+    Generate the full audio for a request, chunking long text (see chunk_text) into batched chunks.
+    
+    With the replica pool running, chunks are spread across its worker processes; with the
+    continuous-batching scheduler running, all of the request's chunks join the shared decode
+    loop instead. Both seed per chunk (seed + index) rather than through the global RNG.
+    Speculative decoding only runs in-process, where chunks are generated one at a time.
+    
+    Returns:
+        tuple: (audio_array, sampling_rate)
+    """
+    word_count = len(text.split())
+    text_chunks = chunk_text(text) if enable_chunking else [text]
+    if len(text_chunks) > 1:
+        logger.info("Text is long (%d words), split into %d chunks", word_count, len(text_chunks))
+    elif enable_chunking:
+        log_debug("Text is short (%d words, <= %d tokens), generating without chunking", word_count,
+                  CHUNK_THRESHOLD_TOKENS)
+    
+    # Multi-chunk audio is appended to the assembler as each chunk becomes available
+    assembler = AudioAssembler(SAMPLING_RATE) if len(text_chunks) > 1 else None
+    
+    if replica_pool is not None:
+        audio_chunks, sampling_rate = generate_audio_replicated(
+            texts=text_chunks,
+            voice_description=voice_description,
+            temperature=temperature,
+            max_new_tokens=max_new_tokens,
+            seed=seed,
+            sampling=sampling,
+            assembler=assembler
+        )
+    elif batch_scheduler is not None:
+        audio_chunks, sampling_rate = generate_audio_scheduled(
+            texts=text_chunks,
+            voice_description=voice_description,
+            temperature=temperature,
+            max_new_tokens=max_new_tokens,
+            seed=seed,
+            sampling=sampling,
+            assembler=assembler
+        )
+    else:
+        if seed is not None:
+            set_generation_seed(seed)
+        if len(text_chunks) > 1 and sampling is not None and sampling.get("speculative", 'off') != 'off':
+            # Speculative decoding verifies one sequence at a time, so chunks go through it in order
+            for chunk in text_chunks:
+                chunk_audio, sampling_rate = generate_audio(
+                    text=chunk,
+                    voice_description=voice_description,
+                    temperature=temperature,
+                    max_new_tokens=max_new_tokens,
+                    sampling=sampling
+                )
+                assembler.append(chunk_audio)
+            audio_chunks = []
+        elif len(text_chunks) > 1:
+            # Generate audio for all chunks (batched: one model.generate call per batch of chunks)
+            audio_chunks, sampling_rate = generate_audio_batch(
+                texts=text_chunks,
+                voice_description=voice_description,
+                temperature=temperature,
+                max_new_tokens=max_new_tokens,  # Will auto-scale per chunk
+                batch_size=chunk_batch_size,
+                sampling=sampling,
+                pipeline_decode=seed is None,
+                assembler=assembler
+            )
+        else:
+            # Generate audio normally (single chunk)
+            try:
+                audio_array, sampling_rate = generate_audio(
+                    text=text,
+                    voice_description=voice_description,
+                    temperature=temperature,
+                    max_new_tokens=max_new_tokens,
+                    sampling=sampling
+                )
+            except Exception as e:
+                halves = split_text_in_half(text) if is_out_of_memory(e) else None
+                if halves is None:
+                    raise
+                # Too long for the memory left: generate it as two chunks (which split further if needed)
+                logger.warning("Out of memory generating %d words in one pass, splitting the text in two", word_count)
+                get_memory_governor().oom_retries += 1
+                release_memory(next(model.parameters()).device, collect=True)
+                halves_audio, sampling_rate = generate_audio_batch(
+                    texts=halves,
+                    voice_description=voice_description,
+                    temperature=temperature,
+                    max_new_tokens=max_new_tokens,
+                    batch_size=1,
+                    sampling=sampling,
+                    pipeline_decode=False
+                )
+                audio_array = concatenate_audio_arrays(halves_audio, sampling_rate)
+            audio_chunks = [audio_array]
+    
+    if assembler is not None:
+        audio_array = assembler.finish()
+        logger.info("Final audio length: %.2f seconds (%d chunks)", len(audio_array) / sampling_rate, assembler.chunks)
+    else:
+        audio_array = audio_chunks[0]
+    
+    return audio_array, sampling_rate
+
+
+def audio_to_wav_bytes(audio_array: np.ndarray, sampling_rate: int) -> bytes:
+    """Encode audio array as WAV file bytes."""
+    buffer = io.BytesIO()
+    sf.write(buffer, audio_array, sampling_rate, format='WAV')
+    return buffer.getvalue()
+
+
+def audio_to_base64(audio_array: np.ndarray, sampling_rate: int) -> str:
+    """Convert audio array to base64-encoded WAV string."""
+    audio_bytes = audio_to_wav_bytes(audio_array, sampling_rate)
+    audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
+    return audio_base64
+
+
+class SoundFileEncoder:
+    """
+    Output format written through libsndfile.
+    
+    sample_formats maps the request's `sample_format` to a libsndfile subtype (first entry is the
+    default). Lossy formats take a target `bitrate` (kbps) instead, which libsndfile exposes as a
+    0-1 compression level that maps linearly onto the codec's bitrate range.
+    """
+    
+    def __init__(self, extension: str, content_type: str, sf_format: str, sample_formats: Dict[str, str],
+                 bitrate_range: Optional[tuple] = None, default_bitrate: Optional[int] = None):
+        self.extension = extension
+        self.content_type = content_type
+        self.sf_format = sf_format
+        self.sample_formats = sample_formats
+        self.bitrate_range = bitrate_range  # (min, max) kbps at 24 kHz mono
+        self.default_bitrate = default_bitrate
+    
+    def validate(self, bitrate: Optional[int], sample_format: Optional[str]) -> None:
+        if sample_format is not None and sample_format not in self.sample_formats:
+            raise ValueError(f"sample_format must be one of {sorted(self.sample_formats)} for this output format")
+        if bitrate is not None:
+            if self.bitrate_range is None:
+                raise ValueError("bitrate is only supported for lossy output formats")
+            low, high = self.bitrate_range
+            if not low <= bitrate <= high:
+                raise ValueError(f"bitrate must be between {low} and {high} kbps for this output format")
+    
+    def encode(self, audio_array: np.ndarray, sampling_rate: int, bitrate: Optional[int] = None,
+               sample_format: Optional[str] = None) -> bytes:
+        subtype = self.sample_formats[sample_format or next(iter(self.sample_formats))]
+        options = {}
+        if self.bitrate_range is not None:
+            low, high = self.bitrate_range
+            bitrate = bitrate or self.default_bitrate
+            # Level 1.0 is rejected by some codecs; 0.99 is already the lowest bitrate
+            options["compression_level"] = min(0.99, (high - bitrate) / (high - low))
+            if self.sf_format == 'MP3':
+                options["bitrate_mode"] = 'CONSTANT'
+        buffer = io.BytesIO()
+        sf.write(buffer, audio_array, sampling_rate, format=self.sf_format, subtype=subtype, **options)
+        return buffer.getvalue()
+
+
+# Output formats by `output_format` name; register_audio_encoder adds more (anything with
+# extension, content_type, validate() and encode())
+AUDIO_ENCODERS = {
+    "wav": SoundFileEncoder("wav", "audio/wav", "WAV", {"pcm_16": "PCM_16", "pcm_24": "PCM_24", "float": "FLOAT"}),
+    "flac": SoundFileEncoder("flac", "audio/flac", "FLAC", {"pcm_16": "PCM_16", "pcm_24": "PCM_24"}),
+    "ogg-opus": SoundFileEncoder("ogg", "audio/ogg", "OGG", {"opus": "OPUS"},
+                                 bitrate_range=(6, 256), default_bitrate=32),
+    "mp3": SoundFileEncoder("mp3", "audio/mpeg", "MP3", {"mp3": "MPEG_LAYER_III"},
+                            bitrate_range=(8, 160), default_bitrate=64),
+}
+
+
+def register_audio_encoder(name: str, encoder) -> None:
+    """Make an encoder selectable through the `output_format` input."""
+    AUDIO_ENCODERS[name] = encoder
+
+
+def parse_output_options(input_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Validated output format options from handler input (raises ValueError on bad values)."""
+    output_format = str(input_data.get('output_format', 'wav')).lower()
+    if output_format not in AUDIO_ENCODERS:
+        raise ValueError(f"output_format must be one of {sorted(AUDIO_ENCODERS)}")
+    bitrate = input_data.get('bitrate')
+    bitrate = int(bitrate) if bitrate is not None else None
+    sample_format = input_data.get('sample_format')
+    AUDIO_ENCODERS[output_format].validate(bitrate, sample_format)
+    return {"format": output_format, "bitrate": bitrate, "sample_format": sample_format}
+
+
+def encode_audio(audio_array: np.ndarray, sampling_rate: int, output: Dict[str, Any]) -> bytes:
+    """Encode audio with the encoder selected by parse_output_options."""
+    return AUDIO_ENCODERS[output["format"]].encode(
+        audio_array, sampling_rate, bitrate=output["bitrate"], sample_format=output["sample_format"]
+    )
+
+
+def set_generation_seed(seed: int) -> None:
+    """Seed sampling (and SNAC decoder noise) on all devices for reproducible output."""
+    torch.manual_seed(seed)
+
+
+def decode_snac_codes_isolated(snac_codes, device: torch.device, seed: Optional[int] = None) -> np.ndarray:
+    """
+    decode_snac_codes for threads that share the process with other jobs: decoder noise comes from
+    `seed` (if given) in a forked RNG, and other jobs' decodes wait, so neither shifts the other's noise.
+    """
+    with _snac_rng_lock:
+        if seed is None:
+            return decode_snac_codes(snac_codes, device)
+        with torch.random.fork_rng(devices=[device] if device.type == 'cuda' else []):
+            torch.manual_seed(seed)
+            return decode_snac_codes(snac_codes, device)
+
+
+def audio_cache_key(**fields) -> str:
+    """Content address of a request: SHA-256 over the canonical JSON of everything that shapes the audio."""
+    canonical = json.dumps(fields, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class _InFlight:
+    """A generation other identical requests are waiting on (single-flight)."""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class AudioResultCache:
+    """
+    Content-addressed cache of encoded audio results.
+    
+    Two LRU tiers bounded by size: in memory, and optionally on disk (`<key>.bin` audio bytes plus a
+    `<key>.json` metadata sidecar, survives worker restarts). Concurrent requests for the same key
+    share a single generation instead of each running their own.
+    
+    Entries are dicts with "audio_bytes" plus JSON-serializable metadata (sampling_rate, duration, ...).
+    """
+    
+    def __init__(self, memory_max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_dir = disk_dir if disk_dir and disk_max_bytes > 0 else None
+        self.disk_max_bytes = disk_max_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.shared = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> (entry, nbytes)
+        self._memory_bytes = 0
+        self._disk_index = OrderedDict()  # key -> nbytes, least recently used first
+        self._disk_bytes = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+        
+        if self.disk_dir:
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+                self._scan_disk()
+            except OSError as e:
+                logger.warning("Audio cache directory %s unavailable (%s), using memory tier only", self.disk_dir, e)
+                self.disk_dir = None
+    
+    def get_or_compute(self, key: str, compute) -> tuple:
+        """
+        Return (entry, cache_hit). On a miss, compute() runs once for all concurrent callers of this key.
+        """
+        with self._lock:
+            entry = self._memory_get(key)
+            if entry is not None:
+                self.memory_hits += 1
+                return entry, True
+            
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                inflight = _InFlight()
+                self._inflight[key] = inflight
+                owner = True
+            else:
+                self.shared += 1
+                owner = False
+        
+        if not owner:
+            inflight.done.wait()
+            if inflight.error is not None:
+                raise inflight.error
+            return inflight.result, True
+        
+        try:
+            entry = self._disk_get(key)
+            if entry is not None:
+                cache_hit = True
+            else:
+                entry = compute()
+                cache_hit = False
+                self._disk_put(key, entry)
+            with self._lock:
+                if cache_hit:
+                    self.disk_hits += 1
+                else:
+                    self.misses += 1
+                self._memory_put(key, entry)
+            inflight.result = entry
+            return entry, cache_hit
+        except Exception as e:
+            inflight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            inflight.done.set()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk_index),
+                "disk_bytes": self._disk_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "shared": self.shared,
+                "misses": self.misses,
+            }
+    
+    # Memory tier (caller holds the lock)
+    
+    def _memory_get(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        self._memory.move_to_end(key)
+        return item[0]
+    
+    def _memory_put(self, key: str, entry: Dict[str, Any]) -> None:
+        nbytes = len(entry["audio_bytes"])
+        if nbytes > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[1]
+        self._memory[key] = (entry, nbytes)
+        self._memory_bytes += nbytes
+        while self._memory_bytes > self.memory_max_bytes:
+            _, (_, evicted_bytes) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_bytes
+    
+    # Disk tier
+    
+    def _disk_paths(self, key: str) -> tuple:
+        return os.path.join(self.disk_dir, f"{key}.bin"), os.path.join(self.disk_dir, f"{key}.json")
+    
+    def _scan_disk(self) -> None:
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            audio_path, meta_path = self._disk_paths(key)
+            try:
+                nbytes = os.path.getsize(audio_path) + os.path.getsize(meta_path)
+                entries.append((os.path.getmtime(meta_path), key, nbytes))
+            except OSError:
+                continue
+        for _, key, nbytes in sorted(entries):
+            self._disk_index[key] = nbytes
+            self._disk_bytes += nbytes
+    
+    def _disk_get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.disk_dir:
+            return None
+        with self._lock:
+            if key not in self._disk_index:
+                return None
+            self._disk_index.move_to_end(key)
+        audio_path, meta_path = self._disk_paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            with open(audio_path, 'rb') as f:
+                entry["audio_bytes"] = f.read()
+            os.utime(meta_path)  # Keep LRU order across restarts
+            return entry
+        except (OSError, ValueError):
+            with self._lock:
+                self._disk_bytes -= self._disk_index.pop(key, 0)
+            return None
+    
+    def _disk_put(self, key: str, entry: Dict[str, Any]) -> None:
+        if not self.disk_dir:
+            return
+        audio_path, meta_path = self._disk_paths(key)
+        meta = {k: v for k, v in entry.items() if k != "audio_bytes"}
+        meta_bytes = json.dumps(meta).encode('utf-8')
+        nbytes = len(entry["audio_bytes"]) + len(meta_bytes)
+        if nbytes > self.disk_max_bytes:
+            return
+        try:
+            # Write audio first, metadata last: a .json sidecar marks a complete entry
+            for path, data in ((audio_path, entry["audio_bytes"]), (meta_path, meta_bytes)):
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Failed to write audio cache entry: %s", e)
+            return
+        
+        evicted = []
+        with self._lock:
+            self._disk_bytes -= self._disk_index.pop(key, 0)
+            self._disk_index[key] = nbytes
+            self._disk_bytes += nbytes
+            while self._disk_bytes > self.disk_max_bytes and len(self._disk_index) > 1:
+                evicted_key, evicted_bytes = self._disk_index.popitem(last=False)
+                self._disk_bytes -= evicted_bytes
+                evicted.append(evicted_key)
+        for evicted_key in evicted:
+            for path in self._disk_paths(evicted_key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+audio_cache = AudioResultCache(
+    memory_max_bytes=int(AUDIO_CACHE_MEMORY_MB * 1024 * 1024),
+    disk_dir=AUDIO_CACHE_DIR,
+    disk_max_bytes=int(AUDIO_CACHE_DISK_MB * 1024 * 1024),
+) if AUDIO_CACHE_ENABLED else None
+
+
+def audio_segment_to_base64(audio_array: np.ndarray, sampling_rate: int, stream_format: str = 'pcm_s16le') -> str:
+    """Encode one streamed segment: raw little-endian 16-bit PCM (default) or a standalone WAV."""
+    if stream_format == 'wav':
+        return audio_to_base64(audio_array, sampling_rate)
+    pcm = (np.clip(audio_array, -1.0, 1.0) * 32767).astype('<i2')
+    return base64.b64encode(pcm.tobytes()).decode('utf-8')
+
+
+class StorageBackend(ABC):
+    """Destination for uploaded audio: upload() stores bytes at a path, url_for() is its public URL."""
+    
+    @abstractmethod
+    def upload(self, data: bytes, path: str, content_type: str) -> str:
+        """Store data at path and return its public URL."""
+    
+    @abstractmethod
+    def url_for(self, path: str) -> str:
+        """Public URL of path (known before the upload finishes)."""
+
+
+class FirebaseStorageBackend(StorageBackend):
+    """
+    Firebase Storage with one long-lived bucket handle.
+    
+    Files over resumable_bytes go through a chunked resumable upload, so a dropped connection
+    retries the current chunk instead of the whole file. Objects are made public.
+    """
+    
+    def __init__(self, resumable_bytes: int):
+        self.resumable_bytes = resumable_bytes
+        self._bucket = None
+        self._lock = threading.Lock()
+    
+    def bucket(self):
+        with self._lock:
+            if self._bucket is None:
+                if not FIREBASE_AVAILABLE:
+                    raise RuntimeError("Firebase Admin SDK not available")
+                if init_firebase() is None:
+                    raise RuntimeError("Firebase not initialized")
+                self._bucket = storage.bucket()
+            return self._bucket
+    
+    def upload(self, data: bytes, path: str, content_type: str) -> str:
+        blob = self.bucket().blob(path)
+        if len(data) > self.resumable_bytes:
+            blob.chunk_size = 8 * 1024 * 1024  # Must be a multiple of 256 KB; enables resumable upload
+            blob.upload_from_file(io.BytesIO(data), size=len(data), content_type=content_type)
+        else:
+            blob.upload_from_string(data, content_type=content_type)
+        blob.make_public()
+        return blob.public_url
+    
+    def url_for(self, path: str) -> str:
+        return self.bucket().blob(path).public_url
+
+
+class LocalStorageBackend(StorageBackend):
+    """Files under a local directory (offline testing, or a volume served by a web server at base_url)."""
+    
+    def __init__(self, root: str, base_url: str = ''):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip('/')
+    
+    def _local_path(self, path: str) -> str:
+        local_path = os.path.abspath(os.path.join(self.root, path))
+        if not local_path.startswith(self.root + os.sep):
+            raise ValueError(f"Storage path escapes the storage root: {path}")
+        return local_path
+    
+    def upload(self, data: bytes, path: str, content_type: str) -> str:
+        local_path = self._local_path(path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        tmp_path = f"{local_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, local_path)
+        return self.url_for(path)
+    
+    def url_for(self, path: str) -> str:
+        local_path = self._local_path(path)
+        return f"{self.base_url}/{path}" if self.base_url else f"file://{local_path}"
+
+
+class UploadExecutor:
+    """
+    Background uploads on a bounded thread pool.
+    
+    At most max_pending uploads are queued or running; submit() blocks beyond that, so audio
+    waiting for upload can't pile up in memory. Failed uploads (other than invalid paths) are
+    retried with exponential backoff before the future fails.
+    """
+    
+    def __init__(self, backend: StorageBackend, workers: int = 4, max_pending: int = 16, retries: int = 3,
+                 backoff_seconds: float = 1.0):
+        self.backend = backend
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.uploaded = 0
+        self.failed = 0
+        self.retried = 0
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='upload')
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._lock = threading.Lock()
+    
+    def submit(self, data: bytes, path: str, content_type: str) -> Future:
+        """Queue an upload; the future resolves to the object's URL."""
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._upload, data, path, content_type)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+    
+    def _upload(self, data: bytes, path: str, content_type: str) -> str:
+        for attempt in range(self.retries + 1):
+            try:
+                url = self.backend.upload(data, path, content_type)
+                with self._lock:
+                    self.uploaded += 1
+                return url
+            except Exception as e:
+                if isinstance(e, ValueError) or attempt == self.retries:  # ValueError: bad path, retrying won't help
+                    with self._lock:
+                        self.failed += 1
+                    logger.error("Upload of %s failed after %d attempt(s): %s", path, attempt + 1, e)
+                    raise
+                with self._lock:
+                    self.retried += 1
+                delay = self.backoff_seconds * 2 ** attempt
+                logger.warning("Upload of %s failed (%s), retrying in %.1fs", path, e, delay)
+                time.sleep(delay)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"uploaded": self.uploaded, "failed": self.failed, "retried": self.retried}
+
+
+def get_storage_uploader() -> UploadExecutor:
+    """The process-wide upload executor for the backend selected by STORAGE_BACKEND."""
+    global storage_uploader
+    
+    if storage_uploader is None:
+        if STORAGE_BACKEND == 'local':
+            backend = LocalStorageBackend(LOCAL_STORAGE_DIR, LOCAL_STORAGE_BASE_URL)
+        elif STORAGE_BACKEND == 'firebase':
+            backend = FirebaseStorageBackend(int(UPLOAD_RESUMABLE_MB * 1024 * 1024))
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+        storage_uploader = UploadExecutor(backend, UPLOAD_WORKERS, UPLOAD_MAX_PENDING, UPLOAD_RETRIES)
+    return storage_uploader
+
+
+def upload_to_firebase(audio_bytes: bytes, user_id: str, text_preview: str, extension: str = 'wav',
+                       content_type: str = 'audio/wav', wait: bool = True) -> Dict[str, Any]:
+    """
+    Upload generated audio through the storage backend (Firebase Storage unless STORAGE_BACKEND says otherwise).
+    
+    With wait=False the upload continues in the background and the result carries the URL the
+    object will have plus "pending": True.
+    
+    Returns:
+        dict with success, url, filename, storage_path keys
+    """
+    try:
+        uploader = get_storage_uploader()
+        
+        # Generate filename
+        timestamp = int(datetime.now().timestamp() * 1000)
+        sanitized_text = "".join(c for c in text_preview[:30] if c.isalnum() or c == ' ').strip().replace(' ', '_')
+        filename = f"tts_{timestamp}_{sanitized_text}.{extension}"
+        
+        # Storage path
+        storage_path = f"users/{user_id}/tts/{filename}"
+        
+        if wait:
+            url = uploader.submit(audio_bytes, storage_path, content_type).result()
+        else:
+            url = uploader.backend.url_for(storage_path)  # Fails fast if the backend is unusable
+            uploader.submit(audio_bytes, storage_path, content_type)
         
         return {
             "success": True,
             "url": url,
             "filename": filename,
-            "storage_path": storage_path
+            "storage_path": storage_path,
+            "pending": not wait
         }
     
     except Exception as e:
@@ -602,28 +3740,50 @@ def handler(event: Dict[str, Any]) -> Dict[str, Any]:
             "text": "Hello world <laugh> this is great!",
             "voice_description": "Female, in her 30s with an American accent, energetic",
             "temperature": 0.6,  # Default 0.6 for reliable generation (0.5-0.7 recommended)
-            "max_new_tokens": 2000,  # Fixed cap (4000 for ≤200 words, 6000 for >200 words) - relies on EOS for completion
-            "enable_chunking": true,  # Default: true. Chunks texts > 200 words to avoid truncation
+            "max_new_tokens": 2000,  # Default: predicted budget once learned, else 4000 (≤200 words) / 6000 - relies on EOS
+            "enable_chunking": true,  # Default: true. Chunks texts > CHUNK_THRESHOLD_TOKENS (~200 words) to avoid truncation
+            "chunk_batch_size": 8,  # Chunks generated together per model.generate call (env CHUNK_BATCH_SIZE)
+            "seed": 1234,  # Optional: deterministic sampling; identical requests are served from the audio cache
+            "use_cache": true,  # Default: true. Set false to bypass the audio result cache
+            "constrained_sampling": true,  # Default: SNAC_CONSTRAINED_SAMPLING env (on). Frame-slot-aware SNAC sampling
+            "repetition_penalty_window": 0,  # Default: REPETITION_PENALTY_WINDOW_FRAMES env (0 = whole output)
+            "speculative_decoding": "off",  # Default: SPECULATIVE_DECODING env. off, ngram or draft (needs DRAFT_MODEL_NAME)
+            "speculative_tokens": 7,  # Default: SPECULATIVE_TOKENS env. Drafted tokens verified per forward pass
+            "output_format": "wav",  # Default: wav. One of wav, flac, ogg-opus, mp3
+            "bitrate": 32,  # Optional, lossy formats only (kbps; defaults: ogg-opus 32, mp3 64)
+            "sample_format": "pcm_16",  # Optional: wav pcm_16/pcm_24/float, flac pcm_16/pcm_24
+            "debug": false,  # Default: false. Run and log DEBUG diagnostics (tokenization, EOS checks) for this request
             "upload_to_firebase": true,
-            "firebase_user_id": "user123"
+            "firebase_user_id": "user123",
+            "return_audio": true,  # Default: true. false (with upload) returns only the URL, path and metadata
+            "wait_for_upload": true  # Default: true. false returns right away while the upload finishes in the background (requires return_audio)
         }
     }
     """
+    debug_token = None
     try:
         # Load model if not already loaded
-        if model is None:
-            load_model()
+        ensure_model_loaded()
         
         # Extract input
         input_data = event.get('input', {})
+        debug_token = _request_debug.set(bool(input_data.get('debug', False)))
         text = input_data.get('text', '')
         voice_description = input_data.get('voice_description', 'Neutral voice, clear speech')
         # Use more conservative default temperature (0.6) for reliable generation
         # Higher temps can cause early EOS emission and variability
         temperature = float(input_data.get('temperature', 0.6))
         max_new_tokens = int(input_data.get('max_new_tokens', 2000))
+        seed = input_data.get('seed')
+        seed = int(seed) if seed is not None else None
+        use_cache = input_data.get('use_cache', True)
+        sampling = parse_sampling_options(input_data)
+        output = parse_output_options(input_data)
+        encoder = AUDIO_ENCODERS[output["format"]]
         upload_to_firebase_flag = input_data.get('upload_to_firebase', False)
         firebase_user_id = input_data.get('firebase_user_id', '')
+        return_audio = input_data.get('return_audio', True)
+        wait_for_upload = input_data.get('wait_for_upload', True)
         
         # Validate input
         if not text:
@@ -638,73 +3798,105 @@ def handler(event: Dict[str, Any]) -> Dict[str, Any]:
                 "status": "FAILED"
             }
         
-        # Chunk only for truly long text (>200 words)
+        if not return_audio and not upload_to_firebase_flag:
+            return {
+                "error": "return_audio can only be false when upload_to_firebase is true",
+                "status": "FAILED"
+            }
+        
+        if not return_audio and not wait_for_upload:
+            # A background upload that failed would leave no copy of the audio anywhere
+            return {
+                "error": "return_audio can only be false when wait_for_upload is true",
+                "status": "FAILED"
+            }
+        
+        # Chunk only for truly long text (> CHUNK_THRESHOLD_TOKENS, ~200 words)
         # For short/medium text, use generous fixed token cap and rely on EOS for completion
         enable_chunking = input_data.get('enable_chunking', True)  # Default: enabled
-        word_count = len(text.split())
-        chunk_threshold = 200  # Words threshold for chunking - only chunk truly long text
+        chunk_batch_size = int(input_data.get('chunk_batch_size', DEFAULT_CHUNK_BATCH_SIZE))
         
-        if enable_chunking and word_count > chunk_threshold:
-            print(f"INFO: Text is long ({word_count} words > {chunk_threshold}), chunking into smaller pieces...")
-            text_chunks = chunk_text_by_sentences(text, max_words_per_chunk=150, min_words_per_chunk=50)
-            print(f"INFO: Split into {len(text_chunks)} chunk(s)")
-            
-            # Generate audio for each chunk
-            audio_chunks = []
-            for i, chunk in enumerate(text_chunks):
-                print(f"INFO: Generating audio for chunk {i+1}/{len(text_chunks)} ({len(chunk.split())} words)...")
-                chunk_audio, sampling_rate = generate_audio(
-                    text=chunk,
+        def render() -> Dict[str, Any]:
+            speculation = SpeculationStats(sampling["speculative"]) if sampling["speculative"] != 'off' else None
+            speculation_token = _request_speculation.set(speculation)
+            try:
+                audio_array, sampling_rate = synthesize_speech(
+                    text=text,
                     voice_description=voice_description,
                     temperature=temperature,
-                    max_new_tokens=max_new_tokens  # Will auto-scale per chunk
+                    max_new_tokens=max_new_tokens,
+                    enable_chunking=enable_chunking,
+                    chunk_batch_size=chunk_batch_size,
+                    seed=seed,
+                    sampling=sampling
                 )
-                audio_chunks.append(chunk_audio)
-            
-            # Concatenate all chunks
-            print(f"INFO: Concatenating {len(audio_chunks)} audio chunk(s)...")
-            audio_array = concatenate_audio_arrays(audio_chunks, sampling_rate)
-            print(f"INFO: Final audio length: {len(audio_array) / sampling_rate:.2f} seconds")
-        else:
-            # Generate audio normally (single chunk)
-            if enable_chunking:
-                print(f"INFO: Text is short ({word_count} words <= {chunk_threshold}), generating without chunking")
-            audio_array, sampling_rate = generate_audio(
+            finally:
+                _request_speculation.reset(speculation_token)
+            rendered = {
+                "audio_bytes": encode_audio(audio_array, sampling_rate, output),
+                "sampling_rate": sampling_rate,
+                "duration": len(audio_array) / sampling_rate,
+            }
+            if speculation is not None and speculation.forward_passes:
+                rendered["speculation"] = speculation.summary()
+                logger.info("Speculative decoding: %s", rendered["speculation"])
+            return rendered
+        
+        if audio_cache is not None and use_cache:
+            cache_key = audio_cache_key(
                 text=text,
                 voice_description=voice_description,
                 temperature=temperature,
-                max_new_tokens=max_new_tokens
+                seed=seed,
+                max_new_tokens=max_new_tokens,
+                enable_chunking=bool(enable_chunking),
+                sampling=sampling,
+                output=output,
+                model=getattr(model if model is not None else tokenizer, 'name_or_path', ''),
             )
+            result, cache_hit = audio_cache.get_or_compute(cache_key, render)
+            logger.info("Audio cache %s", 'hit' if cache_hit else 'miss')
+            log_debug("Audio cache stats: %s", audio_cache.stats())
+        else:
+            result, cache_hit = render(), False
         
-        # Calculate duration
-        duration = len(audio_array) / sampling_rate
-        
-        # Convert to base64
-        audio_base64 = audio_to_base64(audio_array, sampling_rate)
+        sampling_rate = result["sampling_rate"]
+        duration = result["duration"]
         
-        # Build response
+        # Build response (audio is base64-inlined below unless it was uploaded and isn't wanted)
         response = {
-            "audio_base64": audio_base64,
             "sampling_rate": sampling_rate,
             "duration": round(duration, 2),
-            "format": "wav",
-            "content_type": "audio/wav"
+            "format": output["format"],
+            "content_type": encoder.content_type,
+            "seed": seed,
+            "cached": cache_hit
         }
+        if "speculation" in result:
+            response["speculation"] = result["speculation"]
         
-        # Upload to Firebase if requested
+        # Upload to Firebase if requested (the encoded bytes go to storage as-is)
         if upload_to_firebase_flag:
             firebase_result = upload_to_firebase(
-                audio_base64=audio_base64,
+                audio_bytes=result["audio_bytes"],
                 user_id=firebase_user_id,
-                text_preview=text[:30]
+                text_preview=text[:30],
+                extension=encoder.extension,
+                content_type=encoder.content_type,
+                wait=bool(wait_for_upload)
             )
             
             if firebase_result.get("success"):
                 response["firebase_url"] = firebase_result["url"]
                 response["firebase_path"] = firebase_result["storage_path"]
                 response["firebase_filename"] = firebase_result["filename"]
+                response["upload_status"] = "pending" if firebase_result["pending"] else "completed"
             else:
                 response["firebase_upload_error"] = firebase_result.get("error", "Unknown error")
+                return_audio = True  # Fall back to inline audio so the result isn't lost
+        
+        if return_audio:
+            response["audio_base64"] = base64.b64encode(result["audio_bytes"]).decode('utf-8')
         
         return {
             "id": event.get("id", "unknown"),
@@ -714,27 +3906,164 @@ def handler(event: Dict[str, Any]) -> Dict[str, Any]:
     
     except Exception as e:
         error_msg = str(e)
-        print(f"Error in handler: {error_msg}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in handler: %s", error_msg)
         
         return {
             "id": event.get("id", "unknown"),
             "status": "FAILED",
             "error": error_msg
         }
+    
+    finally:
+        if debug_token is not None:
+            _request_debug.reset(debug_token)
+
+
+def stream_handler(event: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    RunPod generator handler: streams audio segments while the model is still generating.
+    
+    Accepts the same input as handler() plus:
+        "stream_format": "pcm_s16le" | "wav"  # Encoding of each segment (default: raw 16-bit PCM)
+    output_format/bitrate/sample_format apply to the uploaded file.
+    
+    Yields one {"segment_index", "audio_base64", "sampling_rate", "format", "offset"} dict per
+    segment, then a final summary with "status": "COMPLETED" (plus Firebase fields if uploaded).
+    """
+    debug_token = None
+    try:
+        ensure_model_loaded()
+        
+        input_data = event.get('input', {})
+        debug_token = _request_debug.set(bool(input_data.get('debug', False)))
+        text = input_data.get('text', '')
+        voice_description = input_data.get('voice_description', 'Neutral voice, clear speech')
+        temperature = float(input_data.get('temperature', 0.6))
+        max_new_tokens = int(input_data.get('max_new_tokens', 2000))
+        stream_format = input_data.get('stream_format', 'pcm_s16le')
+        seed = input_data.get('seed')
+        sampling = parse_sampling_options(input_data)
+        output = parse_output_options(input_data)
+        encoder = AUDIO_ENCODERS[output["format"]]
+        upload_to_firebase_flag = input_data.get('upload_to_firebase', False)
+        firebase_user_id = input_data.get('firebase_user_id', '')
+        wait_for_upload = input_data.get('wait_for_upload', True)
+        
+        if not text:
+            yield {"error": "Text input is required", "status": "FAILED"}
+            return
+        
+        if upload_to_firebase_flag and not firebase_user_id:
+            yield {"error": "firebase_user_id is required when upload_to_firebase is true", "status": "FAILED"}
+            return
+        
+        enable_chunking = input_data.get('enable_chunking', True)
+        text_chunks = chunk_text(text) if enable_chunking else [text]
+        
+        # Segments are contiguous audio, so the upload copy is butt-joined exactly as streamed
+        assembler = AudioAssembler(SAMPLING_RATE, crossfade_ms=0) if upload_to_firebase_flag else None
+        segment_count = 0
+        samples_emitted = 0
+        for index, chunk in enumerate(text_chunks):
+            for segment in generate_audio_stream(
+                text=chunk,
+                voice_description=voice_description,
+                temperature=temperature,
+                max_new_tokens=max_new_tokens,
+                sampling=sampling,
+                seed=None if seed is None else int(seed) + index
+            ):
+                yield {
+                    "segment_index": segment_count,
+                    "audio_base64": audio_segment_to_base64(segment, SAMPLING_RATE, stream_format),
+                    "sampling_rate": SAMPLING_RATE,
+                    "format": stream_format,
+                    "offset": round(samples_emitted / SAMPLING_RATE, 3),
+                }
+                if assembler is not None:
+                    assembler.append(segment)
+                segment_count += 1
+                samples_emitted += len(segment)
+        
+        response = {
+            "status": "COMPLETED",
+            "segments": segment_count,
+            "sampling_rate": SAMPLING_RATE,
+            "duration": round(samples_emitted / SAMPLING_RATE, 2),
+        }
+        
+        if upload_to_firebase_flag:
+            firebase_result = upload_to_firebase(
+                audio_bytes=encode_audio(assembler.finish(), SAMPLING_RATE, output),
+                user_id=firebase_user_id,
+                text_preview=text[:30],
+                extension=encoder.extension,
+                content_type=encoder.content_type,
+                wait=bool(wait_for_upload)
+            )
+            if firebase_result.get("success"):
+                response["firebase_url"] = firebase_result["url"]
+                response["firebase_path"] = firebase_result["storage_path"]
+                response["firebase_filename"] = firebase_result["filename"]
+                response["upload_status"] = "pending" if firebase_result["pending"] else "completed"
+            else:
+                response["firebase_upload_error"] = firebase_result.get("error", "Unknown error")
+        
+        yield response
+    
+    except Exception as e:
+        error_msg = str(e)
+        logger.exception("Error in stream_handler: %s", error_msg)
+        
+        yield {"status": "FAILED", "error": error_msg}
+    
+    finally:
+        if debug_token is not None:
+            _request_debug.reset(debug_token)
+
+
+async def concurrent_handler(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Async wrapper so RunPod can run several jobs at once (MAX_CONCURRENCY > 1).
+    
+    Each job runs handler() in a worker thread; their sequences meet in the batch scheduler.
+    """
+    return await asyncio.to_thread(handler, event)
+
+
+def concurrency_modifier(current_concurrency: int) -> int:
+    """RunPod concurrency modifier: accept up to MAX_CONCURRENCY jobs per worker."""
+    return MAX_CONCURRENCY
 
 
 # RunPod serverless entry point
 if __name__ == "__main__":
     import runpod
     
-    # Load model at startup
-    load_model()
+    # Load model at startup (GPU replica workers load their own copies; the parent only tokenizes)
+    if REPLICA_WORKERS <= 1 or not torch.cuda.is_available():
+        load_model()
+    else:
+        load_tokenizer()
     
     # Initialize Firebase if credentials are available
     init_firebase()
     
     # Start RunPod serverless worker
-    runpod.serverless.start({"handler": handler})
+    # STREAMING_MODE=1 registers the generator handler (RunPod /stream); /run still aggregates the segments
+    if os.getenv('STREAMING_MODE', '0').lower() in ('1', 'true', 'yes'):
+        runpod.serverless.start({"handler": stream_handler, "return_aggregate_stream": True})
+    elif REPLICA_WORKERS > 1:
+        # Chunks of all concurrent jobs are dispatched to the replica processes
+        start_replica_pool()
+        if MAX_CONCURRENCY > 1:
+            runpod.serverless.start({"handler": concurrent_handler, "concurrency_modifier": concurrency_modifier})
+        else:
+            runpod.serverless.start({"handler": handler})
+    elif MAX_CONCURRENCY > 1:
+        # Continuous batching: concurrent jobs share one decode loop
+        start_batch_scheduler()
+        runpod.serverless.start({"handler": concurrent_handler, "concurrency_modifier": concurrency_modifier})
+    else:
+        runpod.serverless.start({"handler": handler})
 
@@ -0,0 +1,35 @@
+"""
+Offline fixtures: handler with the tiny random-weight stand-ins from benchmarks/tiny_model.py.
+
+Nothing is downloaded and everything runs on CPU. The audio cache and the length predictor are
+off so tests don't read or write state under /tmp.
+"""
+
+import os
+import sys
+
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+os.environ['AUDIO_CACHE_ENABLED'] = '0'
+os.environ['LENGTH_PREDICTOR_ENABLED'] = '0'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pytest  # noqa: E402
+import torch  # noqa: E402
+
+import handler as handler_module  # noqa: E402
+from benchmarks import tiny_model  # noqa: E402
+
+VOICE = 'Female, 30s, American accent, warm and clear'
+
+
+@pytest.fixture(scope='session')
+def handler():
+    """The handler module with the tiny model, tokenizer and SNAC installed."""
+    torch.set_num_threads(1)
+    return tiny_model.install(handler_module)
+
+
+def prompt_ids(handler, text: str, voice_description: str = VOICE) -> torch.Tensor:
+    return handler.tokenizer(handler.build_prompt(voice_description, text), return_tensors='pt')['input_ids']
@@ -0,0 +1,80 @@
+"""AudioAssembler: crossfaded joins, output length and the disk spool for long jobs."""
+
+import numpy as np
+import pytest
+
+SAMPLING_RATE = 24000
+
+
+def random_chunks(lengths: list, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    return [rng.uniform(-1, 1, length).astype(np.float32) for length in lengths]
+
+
+def crossfade_reference(chunks: list, crossfade: int) -> np.ndarray:
+    """Straightforward concatenation with an equal-power crossfade of `crossfade` samples per join."""
+    audio = chunks[0].copy()
+    for chunk in chunks[1:]:
+        overlap = min(crossfade, len(audio), len(chunk))
+        phase = np.linspace(0.0, np.pi / 2, overlap, dtype=np.float32)
+        blended = audio[len(audio) - overlap:] * np.cos(phase) + chunk[:overlap] * np.sin(phase)
+        audio = np.concatenate([audio[:len(audio) - overlap], blended, chunk[overlap:]])
+    return audio
+
+
+@pytest.mark.parametrize('crossfade_ms', [0, 10, 25])
+def test_joins_are_shortened_by_the_crossfade(handler, crossfade_ms):
+    chunks = random_chunks([4800, 2400, 7200, 1200])
+    assembler = handler.AudioAssembler(SAMPLING_RATE, crossfade_ms=crossfade_ms)
+    for chunk in chunks:
+        assembler.append(chunk)
+    audio = assembler.finish()
+    
+    crossfade = int(SAMPLING_RATE * crossfade_ms / 1000)
+    assert assembler.crossfade == crossfade
+    assert len(audio) == sum(len(chunk) for chunk in chunks) - crossfade * (len(chunks) - 1)
+    np.testing.assert_allclose(audio, crossfade_reference(chunks, crossfade), atol=1e-6)
+
+
+def test_crossfade_is_capped_by_short_chunks(handler):
+    chunks = random_chunks([100, 50, 300])
+    assembler = handler.AudioAssembler(SAMPLING_RATE, crossfade_ms=10)  # 240 samples > chunk lengths
+    for chunk in chunks:
+        assembler.append(chunk)
+    
+    assert len(assembler.finish()) == 100 + 50 + 300 - 50 - 100
+    np.testing.assert_allclose(assembler.finish(), crossfade_reference(chunks, 240), atol=1e-6)
+
+
+def test_growing_past_the_preallocation_keeps_every_sample(handler):
+    chunks = random_chunks([1000] * 20, seed=1)
+    assembler = handler.AudioAssembler(SAMPLING_RATE, crossfade_ms=0, expected_samples=1500)
+    for chunk in chunks:
+        assembler.append(chunk)
+    
+    assert assembler.chunks == 20
+    np.testing.assert_array_equal(assembler.finish(), np.concatenate(chunks))
+
+
+def test_long_output_spools_to_a_memory_mapped_file(handler, tmp_path):
+    chunks = random_chunks([SAMPLING_RATE // 2] * 6, seed=2)
+    assembler = handler.AudioAssembler(SAMPLING_RATE, crossfade_ms=10, spool_seconds=1.0, spool_dir=str(tmp_path))
+    for index, chunk in enumerate(chunks):
+        assembler.append(chunk)
+        # Two half-second chunks fit in memory; the third crosses the 1 s spool threshold
+        assert isinstance(assembler._buffer, np.memmap) == (index >= 2)
+    audio = assembler.finish()
+    
+    assert isinstance(audio, np.memmap)
+    np.testing.assert_allclose(audio, crossfade_reference(chunks, 240), atol=1e-6)
+    assert list(tmp_path.iterdir()) == []  # the spool file is unlinked from the start
+
+
+def test_concatenate_audio_arrays_uses_the_assembler(handler):
+    chunks = random_chunks([3000, 3000, 3000], seed=3)
+    audio = handler.concatenate_audio_arrays(chunks, SAMPLING_RATE)
+    
+    crossfade = int(SAMPLING_RATE * handler.AUDIO_CROSSFADE_MS / 1000)
+    np.testing.assert_allclose(audio, crossfade_reference(chunks, crossfade), atol=1e-6)
+    with pytest.raises(ValueError):
+        handler.concatenate_audio_arrays([], SAMPLING_RATE)
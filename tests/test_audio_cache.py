@@ -0,0 +1,82 @@
+"""Audio result cache: content keys, LRU eviction in both tiers and single-flight generation."""
+
+import threading
+import time
+
+import pytest
+
+
+def entry(size: int, tag: str = 'x') -> dict:
+    return {"audio_bytes": tag.encode() * size, "sampling_rate": 24000, "duration": 1.0}
+
+
+def test_cache_key_is_canonical(handler):
+    key = handler.audio_cache_key(text='Hello', voice='warm', temperature=0.6, seed=None)
+    assert key == handler.audio_cache_key(seed=None, temperature=0.6, voice='warm', text='Hello')
+    assert len(key) == 64
+
+
+@pytest.mark.parametrize('field, value', [
+    ('text', 'Hello!'), ('voice', 'cold'), ('temperature', 0.7), ('seed', 0), ('text', 'héllo'),
+])
+def test_cache_key_changes_with_every_field(handler, field, value):
+    fields = dict(text='Hello', voice='warm', temperature=0.6, seed=None)
+    assert handler.audio_cache_key(**fields) != handler.audio_cache_key(**dict(fields, **{field: value}))
+
+
+def test_memory_tier_evicts_least_recently_used(handler):
+    cache = handler.AudioResultCache(memory_max_bytes=250)
+    for key in 'abc':
+        cache.get_or_compute(key, lambda: entry(100))  # c evicts a
+    assert cache.get_or_compute('b', lambda: pytest.fail('b should be cached'))[1]
+    cache.get_or_compute('d', lambda: entry(100))  # b was used more recently, so c goes
+    
+    assert cache.get_or_compute('b', lambda: pytest.fail('b should be cached'))[1]
+    assert cache.get_or_compute('d', lambda: pytest.fail('d should be cached'))[1]
+    assert not cache.get_or_compute('c', lambda: entry(100))[1]
+    assert cache.stats()["memory_bytes"] <= 250
+
+
+def test_entries_larger_than_the_memory_tier_are_not_kept(handler):
+    cache = handler.AudioResultCache(memory_max_bytes=50)
+    cache.get_or_compute('big', lambda: entry(100))
+    assert cache.stats()["memory_entries"] == 0
+
+
+def test_disk_tier_survives_restarts_and_evicts(handler, tmp_path):
+    cache = handler.AudioResultCache(memory_max_bytes=1000, disk_dir=str(tmp_path), disk_max_bytes=600)
+    for key in 'abc':
+        cache.get_or_compute(key, lambda key=key: entry(150, key))
+        time.sleep(0.01)  # Distinct mtimes for the restart scan
+    assert cache.stats()["disk_entries"] == 3
+    cache.get_or_compute('d', lambda: entry(150, 'd'))  # Over 600 bytes with metadata: a goes
+    assert not (tmp_path / 'a.bin').exists()
+    
+    restarted = handler.AudioResultCache(memory_max_bytes=1000, disk_dir=str(tmp_path), disk_max_bytes=600)
+    cached, hit = restarted.get_or_compute('c', lambda: pytest.fail('c should be on disk'))
+    assert hit and cached == entry(150, 'c')
+    assert restarted.stats()["disk_hits"] == 1
+
+
+def test_concurrent_requests_share_one_generation(handler):
+    cache = handler.AudioResultCache(memory_max_bytes=1000)
+    release = threading.Event()
+    calls = []
+    
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return entry(10)
+    
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('k', compute))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while cache.stats()["shared"] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    
+    assert len(calls) == 1
+    assert sorted(hit for _, hit in results) == [False, True, True, True]
@@ -0,0 +1,43 @@
+"""Batched chunk generation: left-padded rows must generate what each chunk generates alone."""
+
+import pytest
+
+from conftest import VOICE
+
+TEXTS = [
+    'A short chunk.',
+    'A much longer chunk, so the other rows in its batch are left-padded.',
+    'Medium length chunk here.',
+]
+
+
+@pytest.fixture
+def greedy_codes(handler, monkeypatch):
+    """Greedy decoding (sampling would draw batch-shaped noise) and the SNAC codes of every row."""
+    codes = []
+    build_generate_kwargs = handler.build_generate_kwargs
+    extract_snac_codes = handler.extract_snac_codes
+    
+    def greedy_kwargs(*args, **kwargs):
+        return dict(build_generate_kwargs(*args, **kwargs), do_sample=False)
+    
+    def recording_extract(tokens):
+        snac_codes = extract_snac_codes(tokens)
+        codes.append(snac_codes.tolist())
+        return snac_codes
+    
+    monkeypatch.setattr(handler, 'build_generate_kwargs', greedy_kwargs)
+    monkeypatch.setattr(handler, 'extract_snac_codes', recording_extract)
+    return codes
+
+
+def test_batched_rows_match_unbatched(handler, greedy_codes):
+    audio, _ = handler.generate_audio_batch(TEXTS, VOICE, max_new_tokens=56, batch_size=1, pipeline_decode=False)
+    unbatched = list(greedy_codes)
+    assert len(unbatched) == len(TEXTS) and all(unbatched)
+    greedy_codes.clear()
+    
+    batched_audio, _ = handler.generate_audio_batch(TEXTS, VOICE, max_new_tokens=56, batch_size=3,
+                                                    pipeline_decode=False)
+    assert greedy_codes == unbatched
+    assert [len(a) for a in batched_audio] == [len(a) for a in audio]
@@ -0,0 +1,104 @@
+"""chunk_text: limits, balance and boundaries (the tiny tokenizer counts one token per character)."""
+
+import time
+
+SENTENCES = [
+    'The morning light crept slowly over the hills.',
+    'Birds began to sing in the old oak trees.',
+    'A farmer walked out to check on his fields.',
+    'Dr. Smith arrived at 9 a.m. to inspect the barn.',
+    'Nobody expected the storm that came that afternoon!',
+    'Was the harvest going to survive the winter?',
+]
+
+
+def token_counts(handler, chunks):
+    return handler.count_text_tokens(chunks)
+
+
+def long_text(repeats: int = 6) -> str:
+    return ' '.join(SENTENCES * repeats)
+
+
+def test_short_text_is_one_chunk(handler):
+    assert handler.chunk_text('  Just one sentence.  ', max_tokens=100, threshold_tokens=100) == ['Just one sentence.']
+
+
+def test_chunks_respect_the_limit_and_cover_the_text(handler):
+    text = long_text()
+    chunks = handler.chunk_text(text, max_tokens=200, threshold_tokens=200)
+    assert len(chunks) > 1
+    assert max(token_counts(handler, chunks)) <= 200
+    assert ' '.join(chunks) == text
+    assert all(text.find(chunk) >= 0 for chunk in chunks)  # Slices of the original text
+
+
+def test_chunks_are_balanced(handler):
+    counts = token_counts(handler, handler.chunk_text(long_text(), max_tokens=200, threshold_tokens=200))
+    # The fewest chunks that fit, and none longer than the average by more than a sentence
+    fewest = handler.suffix_chunk_counts(token_counts(handler, SENTENCES * 6), [1] * 35, 200)[0]
+    assert len(counts) == fewest
+    assert max(counts) - min(counts) <= max(token_counts(handler, SENTENCES))
+
+
+def test_sentences_stay_whole(handler):
+    chunks = handler.chunk_text(long_text(), max_tokens=120, threshold_tokens=120)
+    for chunk in chunks:
+        assert chunk.endswith(('.', '!', '?')), chunk
+        assert not chunk.startswith('Smith'), chunk  # "Dr." is not a sentence end
+        assert not chunk.startswith('to inspect'), chunk  # Nor is "a.m." followed by lowercase
+
+
+def test_emotion_tags_stay_with_their_sentence(handler):
+    text = ' '.join(['That was the funniest thing I ever saw! <laugh> We could not stop.'] * 8)
+    for chunk in handler.chunk_text(text, max_tokens=150, threshold_tokens=150):
+        assert not chunk.startswith('<laugh>'), chunk
+
+
+def test_paragraph_breaks_are_preferred(handler):
+    paragraph = ' '.join(SENTENCES[:3])
+    text = '\n\n'.join([paragraph] * 4)
+    chunks = handler.chunk_text(text, max_tokens=300, threshold_tokens=300)
+    assert len(chunks) == 2
+    assert all(chunk.endswith('fields.') for chunk in chunks), chunks
+
+
+def test_oversized_sentences_split_at_clauses_then_words(handler):
+    clauses = 'first, second, third; ' * 12 + 'done.'
+    words = 'word ' * 60 + 'end.'
+    for text in (clauses, words):
+        chunks = handler.chunk_text(text, max_tokens=80, threshold_tokens=80)
+        assert max(token_counts(handler, chunks)) <= 80
+        assert ' '.join(chunks) == text
+    assert all(chunk.endswith((',', ';', '.')) for chunk in handler.chunk_text(clauses, 80, 80))
+
+
+def test_book_length_text(handler):
+    text = '\n\n'.join(long_text(3) for _ in range(300))  # ~450k characters
+    started = time.perf_counter()
+    chunks = handler.chunk_text(text)
+    assert time.perf_counter() - started < 30
+    assert max(token_counts(handler, chunks)) <= handler.CHUNK_MAX_TOKENS
+
+
+def test_separator_tokens_count_against_the_limit(handler):
+    # Many short paragraphs with wide breaks: every join is several tokens, not one
+    text = '\n \n\n'.join(['Short line here.', 'Another brief one!', 'Is this the third?'] * 30)
+    for max_tokens in (100, 200):
+        chunks = handler.chunk_text(text, max_tokens=max_tokens, threshold_tokens=max_tokens)
+        assert max(token_counts(handler, chunks)) <= max_tokens
+        assert all(text.find(chunk) >= 0 for chunk in chunks)
+    
+    spaced = '    '.join(SENTENCES * 6)
+    chunks = handler.chunk_text(spaced, max_tokens=150, threshold_tokens=150)
+    assert max(token_counts(handler, chunks)) <= 150
+    assert '    '.join(chunks) == spaced
+
+
+def test_text_without_spaces_is_split_between_tokens(handler):
+    text = 'abcdefghij' * 300  # 3000 tokens, nothing to cut at
+    chunks = handler.chunk_text(text, max_tokens=200, threshold_tokens=200)
+    counts = token_counts(handler, chunks)
+    assert max(counts) <= 200
+    assert len(chunks) == 15 and max(counts) - min(counts) <= 1
+    assert ''.join(chunks) == text
@@ -0,0 +1,43 @@
+"""Compiled engine: only the decode step is compiled, so new prompt lengths don't recompile."""
+
+import os
+
+import pytest
+import torch
+from torch._dynamo.utils import counters
+
+from conftest import VOICE
+
+
+@pytest.fixture
+def compiled_handler(handler, tmp_path, monkeypatch):
+    monkeypatch.setattr(handler, 'COMPILE_CACHE_DIR', str(tmp_path))
+    monkeypatch.setitem(os.environ, 'TORCHINDUCTOR_CACHE_DIR', str(tmp_path / 'inductor'))
+    eager_forward = handler.model.forward
+    handler.enable_compiled_engine()
+    yield handler
+    handler.model.forward = eager_forward
+    handler.compiled_engine = False
+    handler.static_caches.clear()
+
+
+def test_new_prompt_lengths_reuse_the_decode_graph(compiled_handler):
+    handler = compiled_handler
+    torch._dynamo.reset()
+    counters.clear()
+    handler.generate_audio('Hi.', VOICE, max_new_tokens=21)
+    graphs = counters['stats']['unique_graphs']
+    assert graphs >= 1
+    for text in ('Hello there, friend.', 'A noticeably longer prompt than the ones before it.'):
+        handler.generate_audio(text, VOICE, max_new_tokens=21)
+    assert counters['stats']['unique_graphs'] == graphs
+
+
+def test_dynamic_cache_calls_stay_eager(compiled_handler):
+    handler = compiled_handler
+    torch._dynamo.reset()
+    counters.clear()
+    input_ids = torch.tensor([[128000, 40, 41, 42]])
+    with torch.no_grad():
+        handler.model(input_ids, past_key_values=handler.DynamicCache(), use_cache=True)
+    assert counters['stats']['unique_graphs'] == 0
@@ -0,0 +1,62 @@
+"""Output encoders: every registered format must decode back to the audio that went in."""
+
+import io
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+SAMPLING_RATE = 24000
+
+
+def tone(seconds: float = 0.5) -> np.ndarray:
+    t = np.arange(int(SAMPLING_RATE * seconds)) / SAMPLING_RATE
+    return (0.5 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+
+
+def decode(data: bytes) -> tuple:
+    audio, sampling_rate = sf.read(io.BytesIO(data), dtype='float32')
+    return audio, sampling_rate
+
+
+@pytest.mark.parametrize('name, sample_format, atol', [
+    ('wav', None, 1e-4), ('wav', 'pcm_24', 1e-6), ('wav', 'float', 0.0), ('flac', None, 1e-4), ('flac', 'pcm_24', 1e-6),
+])
+def test_lossless_round_trip(handler, name, sample_format, atol):
+    audio = tone()
+    decoded, sampling_rate = decode(handler.AUDIO_ENCODERS[name].encode(audio, SAMPLING_RATE,
+                                                                        sample_format=sample_format))
+    assert sampling_rate == SAMPLING_RATE
+    np.testing.assert_allclose(decoded, audio, atol=atol)
+
+
+@pytest.mark.parametrize('name', ['ogg-opus', 'mp3'])
+def test_lossy_round_trip(handler, name):
+    encoder = handler.AUDIO_ENCODERS[name]
+    if encoder.sf_format not in sf.available_formats():
+        pytest.skip(f'libsndfile {sf.__libsndfile_version__} cannot write {encoder.sf_format}')
+    audio = tone(1.0)
+    low, high = (encoder.encode(audio, SAMPLING_RATE, bitrate=bitrate) for bitrate in encoder.bitrate_range)
+    decoded, sampling_rate = decode(high)
+    
+    assert sampling_rate == SAMPLING_RATE
+    assert abs(len(decoded) - len(audio)) < 0.1 * SAMPLING_RATE  # Codec delay/padding only
+    assert len(low) < len(high)
+    # Same tone: the loudness survives the codec
+    assert abs(np.sqrt(np.mean(decoded ** 2)) - np.sqrt(np.mean(audio ** 2))) < 0.05
+
+
+def test_base64_wav_round_trip(handler):
+    import base64
+    audio = tone()
+    decoded, sampling_rate = decode(base64.b64decode(handler.audio_to_base64(audio, SAMPLING_RATE)))
+    assert sampling_rate == SAMPLING_RATE
+    np.testing.assert_allclose(decoded, audio, atol=1e-4)
+
+
+def test_output_options_are_validated(handler):
+    assert handler.parse_output_options({})["format"] == 'wav'
+    for bad in ({'output_format': 'aiff'}, {'output_format': 'wav', 'bitrate': 64},
+                {'output_format': 'mp3', 'bitrate': 999}, {'output_format': 'flac', 'sample_format': 'float'}):
+        with pytest.raises(ValueError):
+            handler.parse_output_options(bad)
@@ -0,0 +1,81 @@
+"""Predicted token budgets: running out before EOS extends generation to the cap instead of truncating."""
+
+import pytest
+
+from conftest import VOICE
+
+BUDGET, CAP = 35, 70
+
+
+class FixedBudgetPredictor:
+    """Predicts BUDGET tokens for everything and records what it is told."""
+    
+    def __init__(self):
+        self.observed = []
+    
+    def budget(self, text, voice_description, fallback):
+        return BUDGET
+    
+    def observe(self, text, voice_description, num_tokens, lower_bound=False):
+        self.observed.append((num_tokens, lower_bound))
+
+
+@pytest.fixture
+def predictor(handler, monkeypatch):
+    predictor = FixedBudgetPredictor()
+    monkeypatch.setattr(handler, 'length_predictor', predictor)
+    monkeypatch.setattr(handler, 'resolve_token_cap', lambda text, max_new_tokens=2000: CAP)
+    handler.set_generation_seed(0)
+    return predictor
+
+
+def assert_extended(observed, count=1):
+    assert len(observed) == count
+    for num_tokens, lower_bound in observed:
+        # Either the cap was reached (a lower bound) or EOS came after the predicted budget
+        assert num_tokens == CAP if lower_bound else BUDGET < num_tokens <= CAP
+
+
+def test_generate_audio_extends_budget(handler, predictor):
+    audio, _ = handler.generate_audio('Extend me past the predicted budget.', VOICE)
+    assert_extended(predictor.observed)
+    assert len(audio) > (BUDGET // handler.SNAC_TOKENS_PER_FRAME) * handler.SNAC_SAMPLES_PER_FRAME
+
+
+def test_batched_rows_extend_budget(handler, predictor):
+    handler.generate_audio_batch(['First chunk here.', 'Second chunk, a little longer.'], VOICE,
+                                 batch_size=2, pipeline_decode=False)
+    assert_extended(predictor.observed, count=2)
+
+
+def test_scheduler_extends_budget(handler, predictor):
+    scheduler = handler.ContinuousBatchScheduler(max_batch_size=2)
+    generated = scheduler.submit('Scheduled text.', VOICE).result(timeout=120)
+    assert BUDGET < generated.shape[0] <= CAP
+
+
+def test_stream_extends_budget(handler, predictor):
+    segments = list(handler.generate_audio_stream('Streamed text goes on.', VOICE))
+    assert segments
+    assert_extended(predictor.observed)
+
+
+def test_lower_bounds_pull_predictions_up(handler, tmp_path):
+    def fitted(with_bounds):
+        predictor = handler.LengthPredictor(str(tmp_path / f'{with_bounds}.json'), min_observations=5)
+        for words in range(1, 11):
+            predictor.observe(' '.join(['word'] * words), VOICE, 10 * words)
+        if with_bounds:
+            for words in range(11, 16):
+                predictor.observe(' '.join(['word'] * words), VOICE, 40 * words, lower_bound=True)
+        return predictor
+    
+    long_text = ' '.join(['word'] * 15)
+    plain, bounded = fitted(False), fitted(True)
+    assert bounded.predict(long_text, VOICE) > plain.predict(long_text, VOICE) + 50
+    assert bounded.stats()["lower_bounds"] == 5
+    
+    bounded.save()
+    reloaded = handler.LengthPredictor(bounded.path, min_observations=5)
+    assert len(reloaded.lower_bounds) == 5
+    assert reloaded.predict(long_text, VOICE) == pytest.approx(bounded.predict(long_text, VOICE))
@@ -0,0 +1,87 @@
+"""Sampling processors: SNAC frame-slot constraint and the incremental windowed repetition penalty."""
+
+import pytest
+import torch
+
+
+def scores_for(handler, batch_size: int = 2, seed: int = 0) -> torch.Tensor:
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+    return torch.randn(batch_size, handler.model.config.vocab_size, generator=generator)
+
+
+def generated_ids(prompt_len: int, tokens: list, batch_size: int = 2) -> torch.Tensor:
+    prompt = torch.arange(prompt_len).repeat(batch_size, 1)
+    return torch.cat([prompt, torch.tensor(tokens, dtype=torch.long).repeat(batch_size, 1)], dim=1)
+
+
+@pytest.mark.parametrize('num_generated', range(16))
+def test_each_frame_slot_only_allows_its_codebook(handler, num_generated):
+    prompt_len, min_new_tokens = 5, 7
+    processor = handler.SnacFrameLogitsProcessor(prompt_len, temperature=0.6, top_p=1.0, top_k=0,
+                                                 repetition_penalty=1.0, min_new_tokens=min_new_tokens)
+    slot = num_generated % handler.SNAC_TOKENS_PER_FRAME
+    low = handler.CODE_TOKEN_OFFSET + slot * handler.SNAC_CODEBOOK_SIZE
+    
+    tokens = [handler.CODE_TOKEN_OFFSET + (i % 7) * handler.SNAC_CODEBOOK_SIZE + i for i in range(num_generated)]
+    processed = processor(generated_ids(prompt_len, tokens), scores_for(handler, seed=num_generated))
+    
+    expected = set(range(low, low + handler.SNAC_CODEBOOK_SIZE))
+    if slot == 0 and num_generated >= min_new_tokens:
+        expected.add(handler.CODE_END_TOKEN_ID)  # EOS only on frame boundaries, after the minimum
+    for row in processed:
+        assert set(torch.isfinite(row).nonzero()[:, 0].tolist()) == expected
+
+
+def test_top_k_and_top_p_stay_inside_the_slot(handler):
+    processor = handler.SnacFrameLogitsProcessor(0, temperature=0.6, top_p=0.9, top_k=50,
+                                                 repetition_penalty=1.0, min_new_tokens=0)
+    tokens = [handler.CODE_TOKEN_OFFSET + slot * handler.SNAC_CODEBOOK_SIZE for slot in range(3)]
+    scores = scores_for(handler)
+    processed = processor(generated_ids(0, tokens), scores.clone())
+    low = handler.CODE_TOKEN_OFFSET + 3 * handler.SNAC_CODEBOOK_SIZE
+    for row in range(2):
+        kept = torch.isfinite(processed[row]).nonzero()[:, 0]
+        assert 1 <= len(kept) <= 50
+        assert kept.min() >= low and kept.max() < low + handler.SNAC_CODEBOOK_SIZE
+        # The survivors are the slot's best scores, scaled by the temperature
+        best = scores[row, low:low + handler.SNAC_CODEBOOK_SIZE].topk(len(kept)).indices + low
+        assert set(kept.tolist()) == set(best.tolist())
+        torch.testing.assert_close(processed[row, kept], scores[row, kept] / 0.6)
+
+
+def reference_penalty(handler, input_ids, scores, prompt_len, penalty, window):
+    """The penalty recomputed from scratch over the window's SNAC codes."""
+    expected = scores.clone()
+    snac_high = handler.CODE_TOKEN_OFFSET + handler.SNAC_TOKENS_PER_FRAME * handler.SNAC_CODEBOOK_SIZE
+    for row in range(input_ids.shape[0]):
+        generated = input_ids[row, prompt_len:]
+        if window:
+            generated = generated[-window:]
+        seen = {t for t in generated.tolist() if handler.CODE_TOKEN_OFFSET <= t < snac_high}
+        for token in seen:
+            value = expected[row, token]
+            expected[row, token] = value / penalty if value > 0 else value * penalty
+    return expected
+
+
+@pytest.mark.parametrize('window_frames', [0, 2])
+def test_incremental_penalty_matches_a_from_scratch_window(handler, window_frames):
+    prompt_len, penalty = 6, 1.3
+    processor = handler.WindowedRepetitionPenaltyLogitsProcessor(prompt_len, penalty, window_frames)
+    generator = torch.Generator()
+    generator.manual_seed(window_frames)
+    # A small pool of codes (plus EOS and a prompt-range id) so codes repeat inside the window and slide out of it
+    pool = torch.tensor([handler.CODE_TOKEN_OFFSET + i * 911 for i in range(6)]
+                        + [handler.CODE_END_TOKEN_ID, 3])
+    input_ids = torch.randint(0, 100, (2, prompt_len), generator=generator)
+    
+    for step in range(60):
+        scores = scores_for(handler, seed=step)
+        expected = reference_penalty(handler, input_ids, scores, prompt_len, penalty,
+                                     window_frames * handler.SNAC_TOKENS_PER_FRAME)
+        torch.testing.assert_close(processor(input_ids, scores.clone()), expected)
+        next_tokens = pool[torch.randint(0, len(pool), (2, 1), generator=generator)]
+        input_ids = torch.cat([input_ids, next_tokens], dim=1)
+    # The window slid well past its size
+    assert input_ids.shape[1] - prompt_len > 2 * window_frames * handler.SNAC_TOKENS_PER_FRAME
@@ -0,0 +1,139 @@
+"""Memory governor: scheduler admission and recovery from out-of-memory errors (injected)."""
+
+import pytest
+
+from conftest import VOICE, prompt_ids
+
+TEXTS = ['One short line.', 'A second, somewhat longer line of text.', 'Third.']
+
+
+def fake_oom():
+    return RuntimeError('CUDA out of memory. Tried to allocate 2.00 GiB (injected by the test)')
+
+
+@pytest.fixture
+def governor(handler, monkeypatch):
+    """A fresh process-wide governor (unlimited unless a test sets budget_bytes)."""
+    fresh = handler.MemoryGovernor(None)
+    monkeypatch.setattr(handler, 'memory_governor', fresh)
+    return fresh
+
+
+def run_scheduled(handler, scheduler):
+    futures = [scheduler.submit(text, VOICE, max_new_tokens=42, seed=seed) for seed, text in enumerate(TEXTS)]
+    return [future.result(timeout=120).tolist() for future in futures]
+
+
+def run_alone(handler):
+    return [handler.ContinuousBatchScheduler().submit(text, VOICE, max_new_tokens=42, seed=seed)
+            .result(timeout=120).tolist() for seed, text in enumerate(TEXTS)]
+
+
+def record_batch_sizes(scheduler):
+    sizes = []
+    step = scheduler._step
+    
+    def recording_step():
+        sizes.append(len(scheduler._active))
+        step()
+    
+    scheduler._step = recording_step
+    return sizes
+
+
+def test_scheduler_defers_admission_over_budget(handler, governor):
+    estimates = [handler.estimate_generation_bytes(prompt_ids(handler, text).shape[1], 42) for text in TEXTS]
+    governor.budget_bytes = int(1.5 * max(estimates))  # Room for one sequence at a time
+    assert 2 * min(estimates) > governor.budget_bytes
+    scheduler = handler.ContinuousBatchScheduler(max_batch_size=4)
+    sizes = record_batch_sizes(scheduler)
+    
+    assert run_scheduled(handler, scheduler) == run_alone(handler)
+    assert max(sizes) == 1
+    assert scheduler.deferrals >= 1
+    assert governor.reserved == 0
+
+
+def test_decode_oom_requeues_only_the_newest_sequence(handler, governor, monkeypatch):
+    forward = handler.model.forward
+    injected = []
+    
+    def forward_with_oom(*args, **kwargs):
+        outputs = forward(*args, **kwargs)  # The cache is already extended, as a late OOM would leave it
+        if kwargs.get('input_ids') is not None and kwargs['input_ids'].shape[0] == 3 and not injected:
+            injected.append(True)
+            raise fake_oom()
+        return outputs
+    
+    scheduler = handler.ContinuousBatchScheduler(max_batch_size=4)
+    monkeypatch.setattr(handler.model, 'forward', forward_with_oom)
+    results = run_scheduled(handler, scheduler)
+    monkeypatch.setattr(handler.model, 'forward', forward)
+    
+    assert injected and scheduler.oom_evictions == 1
+    assert governor.oom_retries == 1
+    assert results == run_alone(handler)  # The evicted sequence continued where it left off
+    assert governor.reserved == 0
+
+
+def test_decode_oom_of_a_lone_sequence_fails_only_it(handler, governor, monkeypatch):
+    forward = handler.model.forward
+    calls = []
+    
+    def forward_with_oom(*args, **kwargs):
+        calls.append(True)
+        if len(calls) == 3:
+            raise fake_oom()
+        return forward(*args, **kwargs)
+    
+    scheduler = handler.ContinuousBatchScheduler(max_batch_size=4)
+    monkeypatch.setattr(handler.model, 'forward', forward_with_oom)
+    with pytest.raises(RuntimeError, match='out of memory'):
+        scheduler.submit(TEXTS[0], VOICE, max_new_tokens=42, seed=0).result(timeout=120)
+    monkeypatch.setattr(handler.model, 'forward', forward)
+    
+    assert len(scheduler.submit(TEXTS[1], VOICE, max_new_tokens=42, seed=1).result(timeout=120)) > 0
+    assert governor.reserved == 0
+
+
+def test_batch_oom_halves_the_batch(handler, governor, monkeypatch):
+    generate = handler.model.generate
+    batch_sizes = []
+    
+    def generate_with_oom(input_ids, **kwargs):
+        batch_sizes.append(input_ids.shape[0])
+        if input_ids.shape[0] > 1:
+            raise fake_oom()
+        return generate(input_ids, **kwargs)
+    
+    monkeypatch.setattr(handler.model, 'generate', generate_with_oom)
+    audio, _ = handler.generate_audio_batch(TEXTS, VOICE, max_new_tokens=42, batch_size=4, pipeline_decode=False)
+    
+    assert len(audio) == len(TEXTS) and all(len(a) for a in audio)
+    assert batch_sizes == [3, 1, 1, 1]
+    assert governor.oom_retries == 1
+
+
+def test_single_chunk_oom_splits_the_text(handler, governor, monkeypatch):
+    text = 'The first half of the chunk is here. And this is the second half of it.'
+    full_len = prompt_ids(handler, text).shape[1]
+    generate = handler.model.generate
+    prompt_lens = []
+    
+    def generate_with_oom(input_ids, **kwargs):
+        prompt_lens.append(input_ids.shape[1])
+        if input_ids.shape[1] >= full_len:
+            raise fake_oom()
+        return generate(input_ids, **kwargs)
+    
+    monkeypatch.setattr(handler.model, 'generate', generate_with_oom)
+    for generate_text in (
+        lambda: handler.synthesize_speech(text, VOICE, max_new_tokens=42, enable_chunking=False),
+        lambda: handler.generate_audio_batch([text], VOICE, max_new_tokens=42, batch_size=1, pipeline_decode=False),
+    ):
+        prompt_lens.clear()
+        result, _ = generate_text()
+        assert len(result)
+        assert prompt_lens[0] == full_len and len(prompt_lens) == 3  # The whole chunk, then its two halves
+        assert max(prompt_lens[1:]) < full_len
+    assert governor.oom_retries == 2
@@ -0,0 +1,90 @@
+"""Prefix KV cache: generation from a cached voice header matches a full prefill, and the LRU stays in budget."""
+
+import pytest
+import torch
+
+from conftest import VOICE, prompt_ids
+
+TEXT = 'The header of this prompt is prefilled once and reused.'
+
+
+@pytest.fixture
+def prefix_cache(handler, monkeypatch):
+    """A fresh, roomy prefix cache in place of the module-level one."""
+    cache = handler.PrefixKVCache(64 * 1024 * 1024)
+    monkeypatch.setattr(handler, 'prefix_cache', cache)
+    monkeypatch.setattr(handler, 'PREFIX_CACHE_ENABLED', True)
+    return cache
+
+
+def header_cache(handler, description: str):
+    header_ids = handler.tokenizer(handler.build_prompt_header(description), return_tensors='pt')['input_ids']
+    cache = handler.DynamicCache()
+    with torch.no_grad():
+        handler.model(header_ids, past_key_values=cache, use_cache=True)
+    return header_ids, cache
+
+
+def test_cached_prefix_logits_match_a_full_prefill(handler, prefix_cache):
+    input_ids = prompt_ids(handler, TEXT)
+    cache = handler.get_prefix_past_key_values(VOICE, input_ids)
+    assert cache is not None
+    cached_len = cache.get_seq_length()
+    
+    with torch.no_grad():
+        full = handler.model(input_ids).logits
+        suffix = handler.model(input_ids[:, cached_len:], past_key_values=cache, use_cache=True).logits
+    torch.testing.assert_close(suffix, full[:, cached_len:], rtol=1e-4, atol=1e-5)
+
+
+def test_greedy_generation_with_a_cached_prefix_matches_without(handler, prefix_cache):
+    input_ids = prompt_ids(handler, TEXT)
+    kwargs = dict(do_sample=False, max_new_tokens=24, min_new_tokens=24, pad_token_id=0)
+    
+    with torch.no_grad():
+        expected = handler.model.generate(input_ids, **kwargs)
+        for _ in range(2):  # miss (prefill + store), then hit (copy of the stored entry)
+            past_key_values = handler.get_prefix_past_key_values(VOICE, input_ids)
+            assert past_key_values is not None
+            assert torch.equal(handler.model.generate(input_ids, past_key_values=past_key_values, **kwargs), expected)
+    assert (prefix_cache.misses, prefix_cache.hits) == (1, 1)
+
+
+def test_generation_does_not_mutate_the_stored_entry(handler, prefix_cache):
+    input_ids = prompt_ids(handler, TEXT)
+    cache = handler.get_prefix_past_key_values(VOICE, input_ids)
+    header_ids, stored = prefix_cache.get((getattr(handler.model, 'name_or_path', ''), VOICE))
+    header_len = stored.get_seq_length()
+    
+    with torch.no_grad():
+        handler.model(input_ids[:, header_len:], past_key_values=cache, use_cache=True)
+    assert cache.get_seq_length() == input_ids.shape[1]
+    assert stored.get_seq_length() == header_len == header_ids.shape[1]
+
+
+def test_lru_eviction_respects_capacity(handler):
+    entries = [header_cache(handler, f'Voice number {i}, calm and even') for i in range(4)]
+    entry_bytes = sum(t.numel() * t.element_size() for t in handler.kv_cache_tensors(entries[0][1]))
+    prefix_cache = handler.PrefixKVCache(int(2.5 * entry_bytes))
+    
+    for i, (header_ids, cache) in enumerate(entries[:3]):
+        prefix_cache.put(('tiny', i), header_ids, cache)
+        assert prefix_cache.current_bytes <= prefix_cache.max_bytes
+    assert prefix_cache.get(('tiny', 0)) is None  # oldest went first
+    assert prefix_cache.evictions == 1
+    
+    assert prefix_cache.get(('tiny', 1)) is not None  # now most recently used
+    prefix_cache.put(('tiny', 3), *entries[3])
+    assert prefix_cache.get(('tiny', 2)) is None
+    assert prefix_cache.get(('tiny', 1)) is not None
+    assert prefix_cache.get(('tiny', 3)) is not None
+    assert prefix_cache.current_bytes <= prefix_cache.max_bytes
+    assert prefix_cache.evictions == 2
+
+
+def test_entry_larger_than_the_budget_is_not_stored(handler):
+    header_ids, cache = header_cache(handler, VOICE)
+    prefix_cache = handler.PrefixKVCache(1024)
+    prefix_cache.put(('tiny', VOICE), header_ids, cache)
+    assert prefix_cache.get(('tiny', VOICE)) is None
+    assert prefix_cache.current_bytes == 0
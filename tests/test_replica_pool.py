@@ -0,0 +1,47 @@
+"""Replica pool: the parent owns the length predictor and, with GPU replicas, loads no model."""
+
+import numpy as np
+import pytest
+import torch
+
+from conftest import VOICE
+
+
+def test_worker_length_observations_reach_the_parent(handler, tmp_path, monkeypatch):
+    path = tmp_path / 'lengths.json'
+    predictor = handler.LengthPredictor(str(path), min_observations=1000, save_every=1000)
+    monkeypatch.setattr(handler, 'length_predictor', predictor)
+    
+    def fake_generate_audio(text, voice_description, max_new_tokens, **kwargs):
+        # Runs in the forked worker: record a finished generation as generate_audio does
+        tokens = torch.full((len(text),), handler.CODE_TOKEN_OFFSET)
+        tokens[-1] = handler.CODE_END_TOKEN_ID
+        handler.record_generation_length(text, voice_description, tokens)
+        return np.zeros(max_new_tokens, dtype=np.float32), handler.SAMPLING_RATE
+    
+    monkeypatch.setattr(handler, 'generate_audio', fake_generate_audio)
+    pool = handler.ReplicaPool(2)
+    pool.start()
+    try:
+        texts = ['One short text.', 'Another, slightly longer text.', 'Third.']
+        audio = [pool.submit(text, VOICE).result(timeout=60) for text in texts]
+    finally:
+        pool.shutdown()
+    
+    assert sorted(row[-1] for row in predictor.observations) == sorted(float(len(text)) for text in texts)
+    assert not path.exists()  # Nothing saved yet, and never by a worker
+    assert [len(a) for a in audio] == [4000, 4000, 4000]  # Budget resolved in the parent (fixed cap)
+
+
+def test_gpu_replica_parent_loads_only_the_tokenizer(handler, monkeypatch):
+    class GpuPool:
+        shares_weights = False
+    
+    def fail():
+        raise AssertionError("parent must not load the model")
+    
+    monkeypatch.setattr(handler, 'replica_pool', GpuPool())
+    monkeypatch.setattr(handler, 'model', None)
+    monkeypatch.setattr(handler, 'load_model', fail)
+    handler.ensure_model_loaded()
+    assert handler.tokenizer is not None
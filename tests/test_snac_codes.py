@@ -0,0 +1,97 @@
+"""SNAC code extraction and unpacking: the tensor paths against the original list implementations."""
+
+import random
+
+import pytest
+import torch
+
+
+def extract_snac_codes_list(handler, token_ids: list) -> list:
+    """The original .tolist() implementation of extract_snac_codes, kept as the reference."""
+    try:
+        eos_idx = len(token_ids) - 1 - token_ids[::-1].index(handler.CODE_END_TOKEN_ID)
+    except ValueError:
+        eos_idx = len(token_ids)
+    return [t for t in token_ids[:eos_idx] if handler.SNAC_MIN_ID <= t <= handler.SNAC_MAX_ID]
+
+
+def unpack_snac_from_7_loop(handler, snac_tokens: list) -> tuple:
+    """The original list implementation of unpack_snac_from_7, kept as the reference."""
+    if snac_tokens and snac_tokens[-1] == handler.CODE_END_TOKEN_ID:
+        snac_tokens = snac_tokens[:-1]
+    frames = len(snac_tokens) // handler.SNAC_TOKENS_PER_FRAME
+    if len(snac_tokens) % handler.SNAC_TOKENS_PER_FRAME:
+        padding_needed = handler.SNAC_TOKENS_PER_FRAME - len(snac_tokens) % handler.SNAC_TOKENS_PER_FRAME
+        snac_tokens = snac_tokens + [snac_tokens[-1]] * padding_needed
+        frames += 1
+    
+    l1, l2, l3 = [], [], []
+    for i in range(frames):
+        slots = snac_tokens[i * 7:(i + 1) * 7]
+        l1.append((slots[0] - handler.CODE_TOKEN_OFFSET) % 4096)
+        l2.extend([(slots[1] - handler.CODE_TOKEN_OFFSET) % 4096, (slots[4] - handler.CODE_TOKEN_OFFSET) % 4096])
+        l3.extend([(slots[j] - handler.CODE_TOKEN_OFFSET) % 4096 for j in (2, 3, 5, 6)])
+    return l1, l2, l3
+
+
+def random_snac_tokens(handler, num_tokens: int, seed: int) -> list:
+    rng = random.Random(seed)
+    return [rng.randint(handler.SNAC_MIN_ID, handler.SNAC_MAX_ID) for _ in range(num_tokens)]
+
+
+@pytest.mark.parametrize('num_tokens', [0, 1, 6, 7, 8, 13, 14, 70, 75])
+@pytest.mark.parametrize('trailing_eos', [False, True])
+def test_vectorized_unpack_matches_the_frame_loop(handler, num_tokens, trailing_eos):
+    tokens = random_snac_tokens(handler, num_tokens, seed=num_tokens)
+    if trailing_eos:
+        tokens.append(handler.CODE_END_TOKEN_ID)
+    
+    expected = unpack_snac_from_7_loop(handler, tokens)
+    for snac_tokens in (tokens, torch.tensor(tokens, dtype=torch.long)):
+        levels = handler.unpack_snac_from_7(snac_tokens, device=torch.device('cpu'))
+        assert [level.shape[0] for level in levels] == [1, 1, 1]
+        assert [level[0].tolist() for level in levels] == list(expected)
+
+
+def test_batched_unpack_matches_the_loop_per_row(handler):
+    rows = [random_snac_tokens(handler, 5 * handler.SNAC_TOKENS_PER_FRAME + 3, seed=seed) for seed in range(3)]
+    levels = handler.unpack_snac_from_7(torch.tensor(rows), device=torch.device('cpu'))
+    
+    for row_index, row in enumerate(rows):
+        expected = unpack_snac_from_7_loop(handler, row)
+        assert [level[row_index].tolist() for level in levels] == list(expected)
+
+
+def mixed_token_ids(handler, num_tokens: int, seed: int) -> list:
+    """SNAC codes with text tokens, padding and (early) EOS tokens sprinkled in."""
+    rng = random.Random(seed)
+    others = [0, handler.CODE_END_TOKEN_ID, handler.SNAC_MIN_ID - 1, handler.SNAC_MAX_ID + 1,
+              handler.tokenizer.pad_token_id or 0]
+    return [rng.choice(others) if rng.random() < 0.2 else rng.randint(handler.SNAC_MIN_ID, handler.SNAC_MAX_ID)
+            for _ in range(num_tokens)]
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_tensor_extraction_matches_the_list_path(handler, seed):
+    token_ids = mixed_token_ids(handler, num_tokens=10 + 13 * seed, seed=seed)
+    
+    codes = handler.extract_snac_codes(torch.tensor(token_ids, dtype=torch.long))
+    assert isinstance(codes, torch.Tensor)
+    assert codes.tolist() == extract_snac_codes_list(handler, token_ids)
+    assert handler.extract_snac_codes(token_ids) == extract_snac_codes_list(handler, token_ids)
+
+
+@pytest.mark.parametrize('case', ['empty', 'eos_only', 'no_eos', 'eos_first', 'eos_last'])
+def test_tensor_extraction_edge_cases(handler, case):
+    code = handler.SNAC_MIN_ID + 5
+    eos = handler.CODE_END_TOKEN_ID
+    token_ids = {
+        'empty': [],
+        'eos_only': [eos],
+        'no_eos': [code, 0, code + 1],
+        'eos_first': [eos, code, code + 1],
+        'eos_last': [code, eos, code + 1, eos],
+    }[case]
+    
+    codes = handler.extract_snac_codes(torch.tensor(token_ids, dtype=torch.long))
+    assert codes.tolist() == extract_snac_codes_list(handler, token_ids)
@@ -0,0 +1,47 @@
+"""Model snapshot: the tiny model, tokenizer and SNAC survive a save and a load from MODEL_SNAPSHOT_DIR."""
+
+import json
+import os
+
+import huggingface_hub
+import torch
+
+from benchmarks import tiny_model
+from conftest import VOICE, prompt_ids
+
+MODEL_NAME = 'tiny/maya1'
+
+
+def test_snapshot_round_trip(handler, monkeypatch, tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshot')
+    snac_config = tmp_path / 'snac-config.json'
+    snac_config.write_text(json.dumps(tiny_model.SNAC_CONFIG))
+    # The SNAC config is the only file the snapshot fetches from the hub
+    monkeypatch.setattr(huggingface_hub, 'hf_hub_download', lambda repo_id, filename: str(snac_config))
+    
+    handler.save_model_snapshot(snapshot_dir, MODEL_NAME, torch.float32)
+    assert sorted(os.listdir(snapshot_dir)) == ['manifest.json', 'model', 'snac']
+    assert not os.path.exists(f'{snapshot_dir}.tmp')
+    with open(os.path.join(snapshot_dir, 'manifest.json')) as f:
+        assert json.load(f)['model_name'] == MODEL_NAME
+    
+    saved_model, saved_tokenizer, saved_snac = handler.model, handler.tokenizer, handler.snac_decoder
+    monkeypatch.setenv('MODEL_NAME', MODEL_NAME)
+    monkeypatch.setattr(handler, 'MODEL_SNAPSHOT_DIR', snapshot_dir)
+    for name in ('model', 'tokenizer', 'snac_decoder', 'model_load_timings'):
+        monkeypatch.setattr(handler, name, None)
+    loaded_model, loaded_tokenizer = handler.load_model(device='cpu')
+    
+    assert 'snapshot_write' not in handler.model_load_timings  # loaded, not rewritten
+    input_ids = prompt_ids(handler, 'Loaded from the snapshot.')
+    assert loaded_tokenizer.decode(input_ids[0]) == saved_tokenizer.decode(input_ids[0])
+    assert torch.equal(input_ids, saved_tokenizer(handler.build_prompt(VOICE, 'Loaded from the snapshot.'),
+                                                  return_tensors='pt')['input_ids'])
+    with torch.no_grad():
+        torch.testing.assert_close(loaded_model(input_ids).logits, saved_model(input_ids).logits)
+    
+    saved_state = saved_snac.state_dict()
+    loaded_state = handler.snac_decoder.state_dict()
+    assert loaded_state.keys() == saved_state.keys()
+    for name, tensor in saved_state.items():
+        assert torch.equal(loaded_state[name], tensor), name
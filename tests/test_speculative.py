@@ -0,0 +1,57 @@
+"""Speculative decoding: with greedy sampling the output must be token-identical to model.generate."""
+
+import functools
+
+import pytest
+import torch
+
+from conftest import VOICE, prompt_ids
+
+TEXT = 'Speculation must not change a single token.'
+MAX_NEW_TOKENS = 196
+
+
+class GreedyLogitsProcessor:
+    """Keeps only the best token, so sampling from the processed distribution is greedy."""
+    
+    def __call__(self, input_ids, scores):
+        greedy = torch.full_like(scores, float('-inf'))
+        return greedy.scatter(1, scores.argmax(dim=1, keepdim=True), 0.0)
+
+
+@pytest.fixture
+def greedy_pipeline(handler, monkeypatch):
+    build_logits_processors = handler.build_logits_processors
+    
+    def greedy_processors(*args, **kwargs):
+        processors = build_logits_processors(*args, **kwargs)
+        processors.append(GreedyLogitsProcessor())
+        return processors
+    
+    monkeypatch.setattr(handler, 'build_logits_processors', greedy_processors)
+    # The repetition penalty keeps longer n-grams from recurring in a short output
+    monkeypatch.setattr(handler, 'NgramDrafter', functools.partial(handler.NgramDrafter, ngram=1))
+    # Drafting with the target itself (sampled, not greedy) gets both accepted and rejected drafts
+    monkeypatch.setattr(handler, 'draft_model', handler.model)
+
+
+@pytest.mark.parametrize('mode', ['ngram', 'draft'])
+def test_greedy_speculative_output_matches_generate(handler, greedy_pipeline, mode):
+    input_ids = prompt_ids(handler, TEXT)
+    generate_kwargs = handler.build_generate_kwargs(0.6, MAX_NEW_TOKENS, input_ids.shape[1])
+    generate_kwargs['do_sample'] = False
+    with torch.no_grad():
+        expected = handler.model.generate(input_ids, **generate_kwargs)[0, input_ids.shape[1]:]
+    
+    sampling = dict(handler.parse_sampling_options({}), speculative=mode, speculative_tokens=4)
+    stats = handler.SpeculationStats(mode)
+    with torch.no_grad():
+        generated = handler.speculative_generate(input_ids, VOICE, 0.6, MAX_NEW_TOKENS, sampling, stats)
+    
+    assert generated.tolist() == expected.tolist()
+    assert stats.proposed > 0
+    if mode == 'draft':  # The random stand-in rarely repeats itself, so n-gram drafts are all rejected
+        assert 0 < stats.accepted < stats.proposed
+        assert stats.forward_passes < len(generated)
+    stats.seconds = 1.0
+    assert stats.summary()["estimated_speedup"] > 0
@@ -0,0 +1,25 @@
+import pytest
+
+
+def test_background_upload_requires_returned_audio(handler):
+    result = handler.handler({'input': {
+        'text': 'Hello there.',
+        'upload_to_firebase': True,
+        'firebase_user_id': 'user-1',
+        'return_audio': False,
+        'wait_for_upload': False,
+    }})
+    assert result['status'] == 'FAILED'
+    assert 'wait_for_upload' in result['error']
+
+
+def test_storage_backend_is_abstract(handler):
+    with pytest.raises(TypeError):
+        handler.StorageBackend()
+    
+    class UploadOnly(handler.StorageBackend):
+        def upload(self, data, path, content_type):
+            return path
+    
+    with pytest.raises(TypeError):
+        UploadOnly()